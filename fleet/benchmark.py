@@ -0,0 +1,278 @@
+"""Throughput benchmark for the manager/worker protocol.
+
+Runs a Manager and N local Workers on a temporary directory and reports tasks/sec, assignment latency percentiles,
+manager CPU time and the file system operations of the manager and worker processes on the run directory: open,
+stat, listdir, rename, unlink, mkdir and fsync, the metadata operations that dominate on network file systems. They
+are counted in Python (audit events plus wrapped os.stat/os.lstat/os.fsync), so I/O done inside SQLite, by the
+heartbeat process or on sockets and pipes is not included. Example:
+
+    python -m fleet.benchmark --jobs 1000 --durations 0 0.01 --nodes 1 4 --payloads 0 4096 \
+        --fleet_args "--lease_size 10"
+"""
+import argparse
+import itertools
+import json
+import os
+import pathlib
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from rich.console import Console
+from rich.table import Table
+
+from fleet.config.config import get_args
+from fleet.utils.journal import Journal
+
+# manager 正常结束后 worker 退出的最长等待时间, 以及读取进程统计的超时
+WORKER_GRACE = 30
+QUEUE_TIMEOUT = 10
+
+# 统计的文件系统操作, 以及审计事件对应的操作; 表格中显示前五种, 全部写入 --json_output
+FS_OPERATIONS = ["open", "stat", "listdir", "rename", "unlink", "mkdir", "fsync"]
+AUDIT_OPERATIONS = {"open": "open", "os.listdir": "listdir", "os.scandir": "listdir", "os.rename": "rename",
+                    "os.remove": "unlink", "os.rmdir": "unlink", "os.mkdir": "mkdir"}
+TABLE_FS_OPERATIONS = FS_OPERATIONS[:5]
+
+
+def benchmark_job(job_input, info):
+    if info["duration"] > 0:
+        time.sleep(info["duration"])
+    return {"status": "success"}
+
+
+def count_fs_operations(base_dir: Path) -> Dict[str, int]:
+    """Count the file system operations of this process on paths under `base_dir`, return the live counters."""
+    counters = dict.fromkeys(FS_OPERATIONS, 0)
+    prefix = str(base_dir)
+
+    def count(operation: str, path):
+        # 只统计运行目录中的路径, 不包括导入模块、管道和 socket
+        if isinstance(path, (str, bytes, os.PathLike)) and os.fsdecode(path).startswith(prefix):
+            counters[operation] += 1
+
+    def audit_hook(event: str, args: tuple):
+        operation = AUDIT_OPERATIONS.get(event)
+        if operation is not None and args:
+            count(operation, args[0])
+
+    def count_call(func, operation: str):
+        def wrapper(path, *args, **kwargs):
+            count(operation, path)
+            return func(path, *args, **kwargs)
+        return wrapper
+
+    def count_fsync(func):
+        # fsync 只有文件描述符, 全部计入
+        def wrapper(fd):
+            counters["fsync"] += 1
+            return func(fd)
+        return wrapper
+
+    sys.addaudithook(audit_hook)
+    # stat 没有审计事件; Python 3.10 之前 pathlib 通过 _normal_accessor 调用
+    os.stat, os.lstat = count_call(os.stat, "stat"), count_call(os.lstat, "stat")
+    accessor = getattr(pathlib, "_normal_accessor", None)
+    if accessor is not None and hasattr(accessor, "stat"):
+        accessor.stat, accessor.lstat = os.stat, os.lstat
+    os.fsync = count_fsync(os.fsync)
+    return counters
+
+
+def silence_output():
+    devnull = open(os.devnull, "w")
+    sys.stdout = devnull
+    sys.stderr = devnull
+
+
+def run_manager(fleet_args: str, base_dir: Path, jobs: int, payload: int, output_queue: Queue):
+    silence_output()
+    fs_operations = count_fs_operations(base_dir)
+    from fleet.manager import Manager
+
+    job_list = [{"id": idx, "payload": "x" * payload} for idx in range(jobs)]
+    Manager(args=get_args(fleet_args), job_list=job_list).run()
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    # 分配线程的 CPU 时间计入 RUSAGE_SELF, 分片 manager 等子进程的计入 RUSAGE_CHILDREN
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    output_queue.put({
+        "cpu": usage_self.ru_utime + usage_self.ru_stime + usage_children.ru_utime + usage_children.ru_stime,
+        "fs_operations": fs_operations,
+    })
+
+
+def run_worker(fleet_args: str, base_dir: Path, duration: float, output_queue: Queue):
+    silence_output()
+    fs_operations = count_fs_operations(base_dir)
+    from fleet.worker import Worker
+
+    Worker(args=get_args(fleet_args + " --wait_manager"), job_func=benchmark_job, info={"duration": duration}).run()
+    output_queue.put({"fs_operations": fs_operations})
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def assignment_latencies(task_records: Dict[str, Dict]) -> List[float]:
+    """Idle time of a node between finishing one task and starting its next task."""
+    node_tasks = {}
+    for status_info in task_records.values():
+        if "started_at" in status_info and "assigned_to" in status_info:
+            node_tasks.setdefault(status_info["assigned_to"], []).append(
+                (status_info["started_at"], status_info["finished_at"]))
+
+    latencies = []
+    for tasks in node_tasks.values():
+        tasks.sort()
+        for (_, previous_finished_at), (started_at, _) in zip(tasks, tasks[1:]):
+            # 并发执行时任务会重叠, 只统计节点真正空闲的间隔
+            if started_at >= previous_finished_at:
+                latencies.append(started_at - previous_finished_at)
+    return latencies
+
+
+def run_case(base_dir: Path, jobs: int, duration: float, nodes: int, payload: int, fleet_args: str,
+             timeout: float) -> Dict:
+    if base_dir.exists():
+        shutil.rmtree(base_dir)
+    fleet_args = f"--base_dir {base_dir} {fleet_args}"
+
+    manager_queue = Queue()
+    worker_queue = Queue()
+    start_time = time.time()
+    manager = Process(target=run_manager, args=(fleet_args, base_dir, jobs, payload, manager_queue))
+    manager.start()
+    workers = [Process(target=run_worker, args=(fleet_args, base_dir, duration, worker_queue)) for _ in range(nodes)]
+    for worker in workers:
+        worker.start()
+
+    manager.join(timeout)
+    wall_time = time.time() - start_time
+    timed_out = manager.is_alive()
+    if timed_out:
+        manager.terminate()
+    manager.join()
+    # manager 崩溃时不会写入统计, worker 也不会等到结束标记
+    failed = not timed_out and manager.exitcode != 0
+    for worker in workers:
+        worker.join(0 if timed_out or failed else max(WORKER_GRACE, timeout - (time.time() - start_time)))
+        if worker.is_alive():
+            worker.terminate()
+            worker.join()
+
+    manager_stats = {}
+    if not timed_out and not failed:
+        try:
+            manager_stats = manager_queue.get(timeout=QUEUE_TIMEOUT)
+        except queue.Empty:
+            failed = True
+    worker_stats = []
+    # qsize() 不可靠, 按正常退出的 worker 数读取
+    for _ in range(sum(1 for worker in workers if worker.exitcode == 0)):
+        try:
+            worker_stats.append(worker_queue.get(timeout=QUEUE_TIMEOUT))
+        except queue.Empty:
+            break
+
+    task_records = Journal(base_dir / "journal").load()
+    finished = [status_info for status_info in task_records.values() if "finished_at" in status_info]
+    span = max(s["finished_at"] for s in finished) - min(s["started_at"] for s in finished) if finished else 0
+    latencies = assignment_latencies(task_records)
+    shutil.rmtree(base_dir, ignore_errors=True)
+
+    return {
+        "finished": len(finished),
+        "timed_out": timed_out,
+        "failed": failed,
+        "wall_time": wall_time,
+        "tasks_per_sec": len(finished) / span if span > 0 else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "manager_cpu": manager_stats.get("cpu"),
+        "manager_fs_operations": manager_stats.get("fs_operations"),
+        "worker_fs_operations": {operation: sum(stats["fs_operations"][operation] for stats in worker_stats)
+                                 for operation in FS_OPERATIONS},
+    }
+
+
+def default_dirs() -> List[str]:
+    dirs = []
+    if Path("/dev/shm").is_dir():
+        dirs.append("/dev/shm")
+    dirs.append(tempfile.gettempdir())
+    return dirs
+
+
+def get_benchmark_args(input: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Fleet benchmark")
+    parser.add_argument("--jobs", default=[1000], type=int, nargs="+", help="job counts to sweep")
+    parser.add_argument("--durations", default=[0.0], type=float, nargs="+", help="job durations (sec) to sweep")
+    parser.add_argument("--nodes", default=[1, 4], type=int, nargs="+", help="worker counts to sweep")
+    parser.add_argument("--payloads", default=[0], type=int, nargs="+", help="job input sizes (bytes) to sweep")
+    parser.add_argument("--dirs", default=None, type=str, nargs="+",
+                        help="parent directories of the run, defaults to /dev/shm and the local temp dir")
+    parser.add_argument("--fleet_args", default="", type=str, help="extra arguments passed to Manager and Worker")
+    parser.add_argument("--timeout", default=600, type=float, help="max seconds for each case")
+    parser.add_argument("--json_output", default=None, type=str,
+                        help="also append one JSON record per case to this file, e.g. to track regressions")
+    return parser.parse_args(input)
+
+
+def format_fs_operations(counters: Optional[Dict[str, int]]) -> str:
+    if counters is None:
+        return "-"
+    return "/".join(str(counters[operation]) for operation in TABLE_FS_OPERATIONS)
+
+
+def format_value(value, digits: int = 2) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+def main(input: Optional[List[str]] = None):
+    args = get_benchmark_args(input)
+    console = Console()
+    table = Table(title="Fleet benchmark")
+    for column in ["dir", "jobs", "duration", "nodes", "payload", "finished", "wall (s)", "tasks/s",
+                   "lat p50 (ms)", "lat p90 (ms)", "lat p99 (ms)", "mgr cpu (s)",
+                   f"mgr fs {'/'.join(TABLE_FS_OPERATIONS)}", f"worker fs {'/'.join(TABLE_FS_OPERATIONS)}"]:
+        table.add_column(column)
+
+    for parent_dir, jobs, duration, nodes, payload in itertools.product(args.dirs or default_dirs(), args.jobs,
+                                                                       args.durations, args.nodes, args.payloads):
+        base_dir = Path(parent_dir) / f"fleet_benchmark_{os.getpid()}"
+        console.log(f"Running dir={parent_dir} jobs={jobs} duration={duration} nodes={nodes} payload={payload}")
+        result = run_case(base_dir, jobs, duration, nodes, payload, args.fleet_args, args.timeout)
+        if args.json_output:
+            with open(args.json_output, "a") as f:
+                f.write(json.dumps({"dir": parent_dir, "jobs": jobs, "duration": duration, "nodes": nodes,
+                                    "payload": payload, "fleet_args": args.fleet_args, **result}) + "\n")
+        latencies = [None if result[key] is None else result[key] * 1000
+                     for key in ["latency_p50", "latency_p90", "latency_p99"]]
+        table.add_row(parent_dir, str(jobs), str(duration), str(nodes), str(payload),
+                      f"{result['finished']}{' (timeout)' if result['timed_out'] else ''}"
+                      f"{' (failed)' if result['failed'] else ''}",
+                      format_value(result["wall_time"]), format_value(result["tasks_per_sec"]),
+                      *[format_value(latency) for latency in latencies],
+                      format_value(result["manager_cpu"]),
+                      format_fs_operations(result["manager_fs_operations"]),
+                      format_fs_operations(result["worker_fs_operations"]))
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from typing import Optional, List, Union
 import argparse
+import os
 
 
 def get_args(input: Optional[Union[str, List[str]]] = None):
@@ -11,6 +12,74 @@ def get_args(input: Optional[Union[str, List[str]]] = None):
     parser.add_argument("--wait_manager", default=False, action="store_true", help="whether to wait manager")
     parser.add_argument("--max_job", default=None, type=int, help="max number of jobs to run for each worker")
     parser.add_argument("--max_work_time", default=None, type=int, help="max time (sec) to run for each worker")
+    parser.add_argument("--resources", default=None, type=str,
+                        help="resources advertised by the worker as name=value,... (cpus and memory_gb are detected)")
+    parser.add_argument("--tags", default=None, type=str, help="comma separated labels advertised by the worker")
+    parser.add_argument("--input_cache_dir", default=None, type=str,
+                        help="host-local directory caching shared inputs read through fetch_input, shared by the "
+                             "workers on the host and reported to the assigner for locality-aware assignment")
+    parser.add_argument("--input_cache_size", default=10240, type=float,
+                        help="max size (MB) of the input cache, least recently used inputs are evicted first")
+    parser.add_argument("--lease_size", default=1, type=int,
+                        help="max number of tasks leased to a node in one assignment")
+    parser.add_argument("--schedule", default="fifo", type=str, choices=["fifo", "priority", "lpt"],
+                        help="assignment order: ingest order, higher Job priority first, or priority then longest "
+                             "expected cost first (costs learned from finished tasks)")
+    parser.add_argument("--ingest_window", default=10000, type=int,
+                        help="max number of ingested but unassigned tasks kept ahead of the workers")
+    parser.add_argument("--claim", default=False, action="store_true",
+                        help="workers claim leases published by the manager from partition queues instead of waiting "
+                             "for the assigner, the manager only publishes tasks and monitors (set on both sides)")
+    parser.add_argument("--claim_partitions", default=16, type=int,
+                        help="number of partition queues of --claim, must be the same on the manager and workers")
+    parser.add_argument("--shards", default=1, type=int,
+                        help="number of sub-managers of a RootManager, each with its own store under base_dir/shard_<i>"
+                             " (TCP port + i); workers join one shard chosen from their node id")
+    parser.add_argument("--concurrency", default=1, type=int, help="number of jobs to run at once on each worker")
+    parser.add_argument("--executor", default="thread", type=str, choices=["thread", "process"],
+                        help="run concurrent jobs in threads or in runner processes")
+    parser.add_argument("--max_poll_interval", default=0.5, type=float,
+                        help="max seconds to sleep between polls when there is nothing to do")
+    parser.add_argument("--heartbeat_timeout", default=120, type=int,
+                        help="seconds without heartbeat before a node is considered dead")
+    parser.add_argument("--store", default="file", type=str, choices=["file", "sqlite", "tcp"],
+                        help="coordination store: files under base_dir, a SQLite database under base_dir (single host)"
+                             " or a TCP broker run by the manager")
+    parser.add_argument("--store_address", default="127.0.0.1:7821", type=str,
+                        help="host:port of the TCP broker, the manager binds it (a loopback address unless "
+                             "--store_allow_remote is given)")
+    parser.add_argument("--store_allow_remote", default=False, action="store_true",
+                        help="let the manager bind the TCP broker on a non-loopback address, requires --store_token")
+    parser.add_argument("--store_token", default=os.environ.get("FLEET_STORE_TOKEN"), type=str,
+                        help="shared secret that TCP store clients must present to the broker, defaults to the "
+                             "FLEET_STORE_TOKEN environment variable")
+    parser.add_argument("--checkpoint_interval", default=300, type=float,
+                        help="seconds between checkpoints of the manager journal, a restarted manager only replays "
+                             "the records written after the last checkpoint")
+    parser.add_argument("--fsync", default="none", type=str, choices=["none", "data", "full"],
+                        help="fsync policy of journal and store writes: none, data (fsync files) or full (also fsync "
+                             "directories after rename)")
+    parser.add_argument("--serializer", default="json", type=str, choices=["json", "msgpack", "pickle", "raw"],
+                        help="encoding of task inputs and results, fixed for a run (recorded in the journal metadata); "
+                             "workers must use the same value and refuse leases encoded otherwise")
+    parser.add_argument("--memoize", default=False, action="store_true",
+                        help="run identical job inputs once and reuse successful results cached by earlier runs")
+    parser.add_argument("--cache_dir", default=None, type=str,
+                        help="directory of the result cache used by --memoize, defaults to base_dir/cache")
+    parser.add_argument("--cache_max_size", default=None, type=float,
+                        help="max size (MB) of the result cache, least recently used entries are evicted first")
+    parser.add_argument("--cache_max_age", default=None, type=int,
+                        help="max age (sec) of unused result cache entries")
+    parser.add_argument("--speculative", default=False, action="store_true",
+                        help="run backup copies of straggling tasks on idle nodes once all tasks are assigned")
+    parser.add_argument("--speculative_factor", default=3.0, type=float,
+                        help="a lease is straggling after running this many times the median task runtime")
+    parser.add_argument("--max_retries", default=0, type=int,
+                        help="max times a crashed or timed out task is assigned again, failed tasks are never retried")
+    parser.add_argument("--retry_backoff", default=5.0, type=float,
+                        help="seconds before the first retry of a task, doubled for every further retry (max 300)")
+    parser.add_argument("--max_node_crashes", default=None, type=int,
+                        help="exclude a node from assignment after this many of its tasks crashed")
     if input is not None:
         if isinstance(input, str):
             input = [element for element in input.split(" ") if element]
@@ -1,109 +1,256 @@
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Iterable, Iterator, Optional, Tuple
+import heapq
+import itertools
+import threading
 import time
-import json
-from multiprocessing import Process
-from datetime import datetime
+import uuid
 
 from pathlib import Path
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn
 
-from fleet.utils.file_utils import safe_load_json
+from fleet.store.base import CoordinationStore
+from fleet.store.factory import create_store
+from fleet.utils.journal import Journal
+from fleet.utils.memo_cache import MemoCache, input_digest
+from fleet.utils.result_store import ResultReader, ResultWriter
+from fleet.utils.scheduling import Backoff
+from fleet.utils.serializer import get_serializer
+from fleet.utils.task_table import CODE_STATES, TaskTable, name_of
 from fleet.utils.time_tracker import TimeTracker
-from fleet.manager_utils.assign_jobs import loop_assignment
+from fleet.manager_utils.assign_jobs import CommandQueue, do_assign_job, loop_assignment
+from fleet.manager_utils.heartbeat_index import HeartbeatIndex
+from fleet.manager_utils.lease_publisher import LeasePublisher
+from fleet.manager_utils.job_source import HINT_KEYS, get_job_total, iter_jobs, source_closed, split_job
+from fleet.manager_utils.matching import fits
+from fleet.manager_utils.retry_policy import RetryPolicy
+from fleet.manager_utils.scheduler import CostModel
+from fleet.manager_utils.speculation import RuntimeStats, find_stragglers
 
 
 class Manager:
-    def __init__(self, args, job_list: List[Any], info: Dict = {}):
+    def __init__(self, args, job_list: Iterable[Any], info: Dict = {}, total: Optional[int] = None):
+        """job_list can be a list, any iterable (e.g. a generator) or a JsonlJobSource.
+
+        Jobs are written to the journal at most `--ingest_window` tasks ahead of the workers; `total` is only
+        used to show the progress when it can not be derived from job_list.
+        """
         base_dir = args.base_dir
         self.base_dir = Path(base_dir)
         self.console = Console()
         self.base_dir.mkdir(parents=True, exist_ok=True)
-        self.nodes_dir = self.base_dir / 'nodes'
-
-        self.status_dir = self.base_dir / 'status'
-        self.working_dir = self.base_dir / 'working'
-
-        self.heart_dir = self.base_dir / 'heart'
-
-        # to store the available nodes
-        self.available_dir = self.base_dir / 'available'
-
-        self.finished_file = self.base_dir / 'finished'
-
-        self.nodes_dir.mkdir(parents=True, exist_ok=True)
-        print(f"nodes_dir: {self.nodes_dir}")
-        self.heart_dir.mkdir(parents=True, exist_ok=True)
-        print(f"heart_dir: {self.heart_dir}")
-        self.status_dir.mkdir(parents=True, exist_ok=True)
-        print(f"status_dir: {self.status_dir}")
-        self.available_dir.mkdir(parents=True, exist_ok=True)
-        print(f"available_dir: {self.available_dir}")
-        self.working_dir.mkdir(parents=True, exist_ok=True)
+        self.check_status_run()
+
+        # manager 自己的任务状态始终保存在 base_dir 下的 journal 中
+        self.journal_dir = self.base_dir / 'journal'
+        self.journal = Journal(self.journal_dir, fsync=args.fsync)
+        print(f"journal_dir: {self.journal_dir}")
+        # 定期写入检查点, 重启时只重放检查点之后的记录
+        self.checkpoint_interval = args.checkpoint_interval
+        self.previous_checkpoint_time = time.time()
+
+        # 节点、租约、结果和心跳通过协调存储交换
+        self.store = self.open_store(args)
+        self.store.initialize()
+        self.lease_cursor = None
+
+        # 任务返回值保存在 results/ 下的分片中, journal 中只记录引用
+        self.result_dir = self.base_dir / 'results'
+        self.result_reader = ResultReader(self.result_dir)
+        # 没有共享 base_dir 的 worker 随结果一起上报的返回值由 manager 写入
+        self.result_writer = ResultWriter(self.result_dir, f"manager_{int(time.time() * 1000)}", fsync=args.fsync)
+        # 本轮新完成的任务, 由 run_iter 逐个返回
+        self.finished_tasks = []
+
+        # 输入相同的任务只执行一次: 输入摘要 -> 第一个任务, 第一个任务 -> 等待它的结果的任务
+        self.memoize = args.memoize
+        self.input_tasks = {}
+        self.duplicate_tasks = {}
+        if self.memoize:
+            memo_cache = MemoCache(args.cache_dir or self.base_dir / 'cache')
+            evicted_num = memo_cache.evict(
+                max_size=None if args.cache_max_size is None else int(args.cache_max_size * 1024 * 1024),
+                max_age=args.cache_max_age)
+            print(f"cache_dir: {memo_cache.cache_dir}, evicted {evicted_num} entries")
 
         self.job_list = job_list
-        self.total_jobs = len(job_list)
+        # 任务总数未知时为 None, 读完任务源后确定
+        self.total_jobs = get_job_total(job_list, total)
+        self.ingest_window = args.ingest_window
+        self.job_iter = None
+        self.ingested_num = 0
+        self.source_exhausted = False
+        # --claim 时 worker 自己领取 manager 发布的租约, 不启动分配线程
+        self.claim = args.claim
+        self.claim_partitions = args.claim_partitions
+        self.publisher = None
+        self.claim_cursor = None
+        # 新读入的任务、重试的任务和优先级变化通过队列发送给分配线程, --claim 时由 manager 自己发布
+        self.task_queue = self.create_task_queue()
         self.info = info
+        # 任务输入在读入时编码一次, manager 和分配线程不再解析
+        self.serializer = get_serializer(args.serializer)
+        self.check_run_meta()
+        self.lease_size = args.lease_size
+        # 分配顺序, lpt 时根据已完成任务的运行时间学习任务的 cost, 定期发送给分配线程
+        self.schedule = args.schedule
+        self.cost_model = CostModel()
+        self.sent_cost_version = 0
+        self.previous_cost_time = None
+        self.max_poll_interval = args.max_poll_interval
         # self.working_task_status = {}
         self.working_num = 0
         self.unassigned_task_status = {}
+        # 所有任务的当前状态, 与 journal 保持一致; 输入保存在 journal 目录中, 需要时读取
+        self.task_records: Optional[TaskTable] = None
+        # 正在执行的租约
+        self.working_leases = {}
+        # 租约记录还没有读到时就上报了结果的任务: lease_id -> 任务名
+        self.early_results = {}
 
         self.no_available_nodes_num = 0
 
+        # 推测执行: 所有任务分配完后, 在空闲节点上运行落后租约的副本, 先完成的副本的结果生效
+        self.speculative = args.speculative
+        self.speculative_factor = args.speculative_factor
+        self.runtime_stats = RuntimeStats()
+        self.previous_speculation_time = None
+
+        # 崩溃 (包括超时) 的任务在退避之后重新分配: (retry_at, task_name)
+        self.retry_policy = RetryPolicy(max_retries=args.max_retries, backoff=args.retry_backoff,
+                                        max_node_crashes=args.max_node_crashes)
+        self.retry_tasks = []
+
         self.success_num = 0
         self.crashed_num = 0
         self.failed_num = 0
 
-        self.dead_nodes = {}
+        self.heartbeat_index = HeartbeatIndex(self.store, heartbeat_timeout=args.heartbeat_timeout)
+        self.dead_nodes = self.heartbeat_index.dead_nodes
         self.available_nodes = {}
 
         self.time_tracker = TimeTracker(total_tasks=self.total_jobs)
 
         self.first_assigned = True
 
-        self.job_assign_process = None
+        # 分配线程与 manager 在同一个进程中, 共用存储连接以外的所有状态
+        self.job_assign_thread = None
+        self.job_assign_stop = threading.Event()
+        # 分配线程中的异常, 由主循环重新抛出
+        self.job_assign_error = None
 
         self.previous_log_time = None
         # self.new_finished_num = 0
 
+    def create_task_queue(self):
+        return CommandQueue()
+
+    def open_store(self, args) -> CoordinationStore:
+        return create_store(args)
+
+    def check_status_run(self):
+        # 早期版本把每个任务的状态写入 status/*.status, 这样的运行不能用 journal 继续
+        status_dir = self.base_dir / 'status'
+        if status_dir.is_dir() and next(status_dir.glob('task*.status'), None) is not None:
+            raise ValueError(f"{self.base_dir} holds a run of an earlier Fleet version (status/*.status files) that "
+                             f"can not be resumed, finish it with that version or use a new --base_dir")
+
+    def check_run_meta(self):
+        # meta.json 在写入任何记录之前创建
+        run_meta = self.journal.load_meta() or {}
+        if run_meta.get("serializer", self.serializer.name) != self.serializer.name:
+            raise ValueError(f"Journal {self.journal_dir} was written with serializer {run_meta['serializer']}, "
+                             f"can not resume it with {self.serializer.name}")
+        run_meta["serializer"] = self.serializer.name
+        self.journal.write_meta(run_meta)
+
+    def record_tasks(self, records: List[Dict]):
+        for record in records:
+            self.task_records.apply(record)
+        # 记录引用的输入必须先于记录写入
+        self.task_records.flush()
+        self.journal.append(records)
+        # 当前段写满, 或者距离上次检查点超过 checkpoint_interval 秒
+        if self.journal.need_compact or (
+                self.journal.changed and time.time() - self.previous_checkpoint_time >= self.checkpoint_interval):
+            self.write_checkpoint()
+
+    def write_checkpoint(self):
+        summary = {"input_tasks": self.input_tasks} if self.memoize else {}
+        self.journal.write_checkpoint(self.task_records, summary)
+        self.previous_checkpoint_time = time.time()
+
+    def restore_input_tasks(self):
+        # 检查点中有输入摘要时只计算之后读入的任务的摘要
+        input_tasks = self.journal.checkpoint_summary.get("input_tasks")
+        if input_tasks is None:
+            task_names = list(self.task_records)
+        else:
+            self.input_tasks = dict(input_tasks)
+            task_names = [task_name for task_name, status in self.journal.replayed.items() if status is None]
+        for task_name in task_names:
+            if 'duplicate_of' not in self.task_records[task_name]:
+                self.input_tasks[input_digest(self.task_records.get_input(task_name))] = task_name
+
     def initialize_tasks(self):
         self.finished_num = 0
-        for idx, job_input in enumerate(self.job_list):
-            task_name = f'task{idx + 1}'
-            task_status_path = self.status_dir / f'{task_name}.status'
-            if not task_status_path.exists():
-                status_info = {'status': 'unassigned', 'input': job_input, "task_status_path": str(task_status_path)}
-                task_status_path.write_text(json.dumps(status_info))
-            else:
-                status_info = safe_load_json(task_status_path)
-
-            if status_info is None:
-                continue
-
-            if status_info['status'] in ["success", "crashed", "failed"]:
-                self.finished_num += 1
-                self.time_tracker.update()
-                if status_info['status'] == 'success':
-                    self.success_num += 1
-                elif status_info['status'] == 'crashed':
-                    self.crashed_num += 1
-                elif status_info['status'] == 'failed':
-                    self.failed_num += 1
-
-                self.progress.update(self.task_id, advance=1)
-
-            else:
-                if status_info['status'] == 'unassigned':
-                    self.unassigned_task_status[task_name] = status_info
-                    self.unassigned_task_status[task_name]["task_status_path"] = str(task_status_path)
-                else:
-                    assert status_info['status'] == 'assigned'
-                    # self.working_task_status[task_name] = status_info
-                    # self.working_task_status[task_name]["task_status_path"] = str(task_status_path)
-                    working_file = self.working_dir / task_name
-                    if not working_file.exists():
-                        status_info["task_status_path"] = str(task_status_path)
-                        working_file.write_text(json.dumps(status_info))
+        self.task_records = self.journal.load()
+        self.ingested_num = len(self.task_records)
+        self.job_iter = iter_jobs(self.job_list, skip=self.ingested_num)
+        if self.memoize:
+            self.restore_input_tasks()
+
+        # 已完成的任务只按状态码计数, 不读取任务记录
+        restored_tasks = {"success": [], "crashed": [], "failed": []}
+        unassigned_tasks = []
+        for index, code in enumerate(self.task_records.states):
+            status = CODE_STATES.get(code)
+            if status in restored_tasks:
+                restored_tasks[status].append(name_of(index))
+
+            elif status == 'unassigned':
+                unassigned_tasks.append(name_of(index))
+
+            elif status == 'assigned':
+                task_name = name_of(index)
+                status_info = self.task_records[task_name]
+                lease_info = self.working_leases.setdefault(status_info['lease_id'], {
+                    "lease_id": status_info['lease_id'],
+                    "assigned_to": status_info['assigned_to'],
+                    "assigned_at": status_info.get('assigned_at'),
+                    "progress_at": status_info.get('assigned_at') or time.time(),
+                    "tasks": []
+                })
+                lease_info["tasks"].append(task_name)
+                self.working_num += 1
+        for status, task_names in restored_tasks.items():
+            self.count_finished_tasks(task_names, status)
+
+        # 上次运行中分配但还没有写入 journal 的租约
+        stale_leases = self.store.pop_stale_leases()
+        if self.task_records:
+            self.add_working_leases(stale_leases)
+            # 上次运行中没有被领取的租约重新发布, 已经领取的继续执行
+            self.store.clear_published()
+            claim_records, self.claim_cursor = self.store.read_claims()
+            self.add_working_leases(claim_records)
+        else:
+            # journal 为空时, store 中残留的租约和结果来自另一次运行
+            self.store.pop_completions()
+            self.store.clear_published(stale_claims=True)
+
+        self.check_completed_tasks()
+
+        duplicate_records = []
+        for task_name in unassigned_tasks:
+            status_info = self.task_records[task_name]
+            if status_info['status'] == 'unassigned' and 'duplicate_of' in status_info:
+                duplicate_records.extend(self.add_duplicate_task(task_name, status_info['duplicate_of']))
+            elif status_info['status'] == 'unassigned' and 'retry_at' in status_info:
+                heapq.heappush(self.retry_tasks, (status_info['retry_at'], task_name))
+            elif status_info['status'] == 'unassigned':
+                self.unassigned_task_status[task_name] = self.get_unassigned_info(task_name)
+        self.record_tasks(duplicate_records)
 
         if self.finished_num == 0:
             success_rate = 0
@@ -111,26 +258,82 @@ class Manager:
             success_rate = self.success_num / self.finished_num * 100
 
         self.progress.update(self.task_id,
-                             description=f"Success Rate: {success_rate:.2f}% Finished: {self.finished_num}/{self.total_jobs}")
+                             description=f"Success Rate: {success_rate:.2f}% Finished: {self.finished_num}/{self.total_text}")
 
         if self.finished_num > 0:
             self.first_assigned = False
 
+    @property
+    def total_text(self) -> str:
+        return "?" if self.total_jobs is None else str(self.total_jobs)
+
+    def ingest_tasks(self):
+        # 只在未分配的任务少于 ingest_window 时继续读取任务源
+        if self.source_exhausted:
+            return
+        pending_num = self.ingested_num - self.finished_num - self.working_num
+        batch_size = self.ingest_window - pending_num
+        if batch_size <= 0:
+            return
+
+        # 在读取之前判断, JobFeed 可能在读取的同时被放入任务并关闭
+        closed = source_closed(self.job_list)
+        records = []
+        new_tasks = {}
+        duplicates = []
+        for job_input in itertools.islice(self.job_iter, batch_size):
+            self.ingested_num += 1
+            task_name = f'task{self.ingested_num}'
+            job_input, hints = split_job(job_input)
+            task_input = self.serializer.encode(job_input)
+            # 输入只写入一次, journal 中记录它在输入文件中的位置
+            record = {'task': task_name, 'status': 'unassigned', 'input_ref': self.task_records.store_input(task_input),
+                      **hints}
+            if self.memoize:
+                digest = input_digest(task_input)
+                if digest in self.input_tasks:
+                    # 不分配给节点, 等待相同输入的任务的结果
+                    record['duplicate_of'] = self.input_tasks[digest]
+                    records.append(record)
+                    duplicates.append((task_name, record['duplicate_of']))
+                    continue
+                self.input_tasks[digest] = task_name
+            records.append(record)
+            new_tasks[task_name] = {'status': 'unassigned', 'input': task_input, **hints}
+        self.record_tasks(records)
+        # 相同输入的任务可能在同一批中, 写入 journal 之后再查找它的结果
+        self.record_tasks([duplicate_record for task_name, primary_task in duplicates
+                           for duplicate_record in self.add_duplicate_task(task_name, primary_task)])
+        if new_tasks:
+            self.task_queue.put(new_tasks)
+
+        if len(records) < batch_size and closed:
+            self.source_exhausted = True
+            # 允许重试时, 分配线程要一直等待重新分配的任务
+            if self.retry_policy.max_retries == 0:
+                self.task_queue.put(None)
+            if self.total_jobs != self.ingested_num:
+                self.total_jobs = self.ingested_num
+                self.time_tracker.total_tasks = self.ingested_num
+                self.progress.update(self.task_id, total=self.ingested_num)
+
     def process_dead_nodes(self, dead_nodes):
         # check if the task is assigned to a dead node
         for node in dead_nodes:
-            node_file = self.nodes_dir / f"{node}.status"
-            node_info = safe_load_json(node_file)
+            # 不再给死亡节点分配任务
+            self.store.clear_available(node)
+            node_info = self.store.read_node(node)
             if node_info and node_info["status"] == 'busy':
-                task_status_path = node_info["task_status_path"]
-
-                status_info = safe_load_json(Path(task_status_path))
-
-                if status_info and status_info['status'] == 'assigned':
-                    status_info['status'] = 'crashed'
-                    Path(task_status_path).write_text(json.dumps(status_info))
-                    node_info['status'] = 'dead'
-                    node_file.write_text(json.dumps(node_info))
+                node_info['status'] = 'dead'
+                self.store.write_node(node, node_info)
+            if self.claim:
+                # 节点领取但还没有完成的租约
+                self.add_working_leases(self.store.pop_claimed(node))
+            # --concurrency 时节点可能同时执行多个租约; 还没读到租约记录的在加入时被标记为崩溃
+            for lease_info in [lease_info for lease_info in self.working_leases.values()
+                               if lease_info["assigned_to"] == node]:
+                self.finish_tasks(lease_info["lease_id"],
+                                  {task_name: {"status": "crashed"} for task_name in lease_info["tasks"]})
 
     def log_status(self):
         current_time = time.time()
@@ -146,66 +349,323 @@ class Manager:
         time_summary = self.time_tracker.summary
 
         self.progress.update(self.task_id,
-                             description=f"Success Rate: {success_rate:.2f}% Finished/Working: {self.finished_num}/{self.working_num}/{self.total_jobs} Nodes(Good/Dead): {len(self.available_nodes)}/{len(self.dead_nodes)} {time_summary}")
+                             description=f"Success Rate: {success_rate:.2f}% Finished/Working: {self.finished_num}/{self.working_num}/{self.total_text} Nodes(Good/Dead): {len(self.available_nodes)}/{len(self.dead_nodes)} {time_summary}")
 
-    def check_task_status_and_assign(self):
+    def check_task_status_and_assign(self) -> bool:
+        self.ingest_tasks()
         self.monitor_heartbeats()
-        self.check_working_tasks()
+        changed = self.check_working_tasks()
+        if self.requeue_retry_tasks():
+            changed = True
+        if self.publisher is not None and self.publisher.publish_new_tasks(self.task_queue):
+            changed = True
+        if self.schedule == "lpt":
+            self.send_cost_model()
+        if self.speculative:
+            self.launch_backups()
         self.log_status()
-
-    def check_working_tasks(self):
-        self.working_num = 0
-        # self.new_finished_num = 0
-        # Remove finished tasks in working_task_status
-        working_files = list(self.working_dir.glob("*"))
-
-        # for job_key in list(self.working_task_status.keys()):
-        for working_file in working_files:
-            # status_info = self.working_task_status[job_key]
-            status_info = safe_load_json(working_file)
-            task_status_file = Path(status_info["task_status_path"])
-
-            assert task_status_file.exists(), f"task_status_file {task_status_file} not exists"
-
-            status_info_in_file = safe_load_json(task_status_file)
-            if status_info_in_file is None:
+        return changed
+
+    def add_working_leases(self, lease_records: List[Dict]):
+        records = []
+        for lease_info in lease_records:
+            # 结果可能先于租约记录被读到, 这些任务可能已经在等待重试, 不能再标记为已分配
+            early_tasks = self.early_results.pop(lease_info["lease_id"], ())
+            tasks = [task_name for task_name in lease_info["tasks"]
+                     if self.task_records.status(task_name) == 'unassigned' and task_name not in early_tasks]
+            if len(tasks) == 0:
                 continue
+            self.working_leases[lease_info["lease_id"]] = {
+                "lease_id": lease_info["lease_id"],
+                "assigned_to": lease_info["assigned_to"],
+                "assigned_at": lease_info.get("assigned_at"),
+                # 租约中最近一次有任务完成的时间, 用于判断落后的租约
+                "progress_at": lease_info.get("assigned_at") or time.time(),
+                "tasks": tasks
+            }
+            self.working_num += len(tasks)
+            records.extend({"task": task_name, "status": "assigned", "assigned_to": lease_info["assigned_to"],
+                            "lease_id": lease_info["lease_id"], "assigned_at": lease_info.get("assigned_at")}
+                           for task_name in tasks)
+        self.record_tasks(records)
+
+        # 分配线程可能在节点被判定死亡之后才把租约分配给它
+        for lease_info in lease_records:
+            working_lease = self.working_leases.get(lease_info["lease_id"])
+            if working_lease and lease_info["assigned_to"] in self.dead_nodes:
+                self.finish_tasks(lease_info["lease_id"],
+                                  {task_name: {"status": "crashed"} for task_name in working_lease["tasks"]})
+
+    def finish_tasks(self, lease_id: str, results: Dict[str, Dict], assigned_to: Optional[str] = None):
+        # results 可能只包含租约中的部分任务
+        lease_info = self.working_leases.get(lease_id)
+        # 推测执行时同一批任务的另一个副本
+        other_lease = None
+        if lease_info:
+            lease_info["progress_at"] = time.time()
+            other_lease = self.working_leases.get(lease_info.get("backup_lease", lease_info.get("backup_of")))
+        else:
+            self.early_results.setdefault(lease_id, set()).update(results)
 
-            assert status_info_in_file['status'] in ["assigned", "success", "crashed", "failed"]
+        records = []
+        cancelled_tasks = []
+        for task_name, result in results.items():
+            # 已经有结果的任务 (例如节点被判定死亡后又写回结果)
+            if self.task_records.status(task_name) in ["success", "crashed", "failed"]:
+                continue
+            running_copy = other_lease is not None and task_name in other_lease["tasks"]
+            if lease_info and task_name in lease_info["tasks"]:
+                lease_info["tasks"].remove(task_name)
+                # 另一个副本还在执行时, 只放弃崩溃的副本
+                if result['status'] == 'crashed' and running_copy:
+                    continue
+                self.working_num -= 1
+            if running_copy:
+                other_lease["tasks"].remove(task_name)
+                cancelled_tasks.append(task_name)
+
+            if result['status'] == 'crashed' and assigned_to is not None:
+                self.record_node_crash(assigned_to)
+            if result['status'] == 'crashed' and self.retry_policy.should_retry(
+                    self.task_records[task_name].get('attempts', 0)):
+                records.append(self.retry_task(task_name, result))
+                continue
 
-            if status_info_in_file['status'] == "assigned":
-                self.working_num += 1
-            else:
-                if status_info_in_file['status'] == 'success':
-                    self.success_num += 1
-                elif status_info_in_file['status'] == 'crashed':
-                    self.crashed_num += 1
-                elif status_info_in_file['status'] == 'failed':
-                    self.failed_num += 1
+            assert result['status'] in ["success", "crashed", "failed"]
+            if result['status'] != 'crashed':
+                self.runtime_stats.add(result)
+                self.observe_cost(task_name, result)
+            record = {"task": task_name, **result}
+            if lease_info and "backup_of" in lease_info:
+                record["speculative"] = True
+            if "result_data" in record:
+                record["result_ref"] = self.result_writer.append_bytes(self.serializer.unwrap(record.pop("result_data")))
+            if assigned_to is not None:
+                record["assigned_to"] = assigned_to
+            records.append(record)
+            self.count_finished(task_name, record['status'])
+
+            # 输入相同的任务直接使用这个任务的结果
+            for duplicate_name in self.duplicate_tasks.pop(task_name, []):
+                records.append({**record, "task": duplicate_name, "duplicate_of": task_name})
+                self.count_finished(duplicate_name, record['status'])
+        # journal 中的引用必须指向已经写入的结果
+        self.result_writer.flush()
+        self.record_tasks(records)
+
+        if cancelled_tasks:
+            self.store.cancel_tasks(other_lease["lease_id"], cancelled_tasks)
+        for finished_lease in [lease_info, other_lease]:
+            if finished_lease and len(finished_lease["tasks"]) == 0:
+                self.working_leases.pop(finished_lease["lease_id"], None)
+
+    def retry_task(self, task_name: str, result: Dict) -> Dict:
+        """Schedule a crashed task to be assigned again, return its journal record."""
+        attempts = self.task_records[task_name].get('attempts', 0) + 1
+        retry_at = time.time() + self.retry_policy.retry_delay(attempts)
+        heapq.heappush(self.retry_tasks, (retry_at, task_name))
+        self.console.log(f"Task {task_name} crashed, retry {attempts}/{self.retry_policy.max_retries} "
+                         f"in {retry_at - time.time():.1f}s")
+        return {"task": task_name, "status": "unassigned", "attempts": attempts, "retry_at": retry_at,
+                "last_error": result.get("error", "crashed")}
+
+    def requeue_retry_tasks(self) -> bool:
+        """Send the retried tasks whose backoff has passed to the assigner, return True if there was any."""
+        current_time = time.time()
+        new_tasks = {}
+        while self.retry_tasks and self.retry_tasks[0][0] <= current_time:
+            _, task_name = heapq.heappop(self.retry_tasks)
+            # 节点被判定死亡后又写回了结果
+            if self.task_records.status(task_name) != 'unassigned':
+                continue
+            new_tasks[task_name] = self.get_unassigned_info(task_name)
+        if new_tasks:
+            self.task_queue.put(new_tasks)
+        return len(new_tasks) > 0
+
+    def get_unassigned_info(self, task_name: str) -> Dict:
+        # 发送给分配线程的任务: 输入和调度提示
+        status_info = self.task_records[task_name]
+        unassigned_info = {'status': 'unassigned', 'input': self.task_records.get_input(task_name)}
+        for key in HINT_KEYS:
+            if key in status_info:
+                unassigned_info[key] = status_info[key]
+        return unassigned_info
+
+    def observe_cost(self, task_name: str, result: Dict):
+        if self.schedule != "lpt" or result.get("cached") or "started_at" not in result:
+            return
+        status_info = self.task_records[task_name]
+        self.cost_model.observe(status_info.get("group"), status_info.get("cost"),
+                                max(0.0, result.get("finished_at", result["started_at"]) - result["started_at"]))
 
-                # del self.working_task_status[job_key]
-                working_file.unlink()
+    def send_cost_model(self):
+        # 每秒最多发送一次, 分配线程收到后重建任务堆
+        current_time = time.time()
+        if self.cost_model.version == self.sent_cost_version or (
+                self.previous_cost_time is not None and current_time - self.previous_cost_time < 1):
+            return
+        self.previous_cost_time = current_time
+        self.sent_cost_version = self.cost_model.version
+        self.task_queue.put(("cost_model", self.cost_model))
+
+    def record_node_crash(self, node: str):
+        if self.retry_policy.record_crash(node, self.available_nodes):
+            self.console.log(f"Node {node} crashed {self.retry_policy.node_crashes[node]} tasks, "
+                             f"it is excluded from assignment")
+            self.task_queue.put(("exclude_nodes", [node]))
+
+    def set_priority(self, task_names: Iterable[str], priority: int):
+        """Change the priority of tasks that are not assigned yet, e.g. between the results of run_iter.
+
+        The change is journaled, so retries and a restarted manager keep it. Leases already published with
+        --claim keep their order. Raises ValueError under `--schedule fifo`, which ignores priorities.
+        """
+        if self.schedule == "fifo":
+            raise ValueError("set_priority has no effect with --schedule fifo, use --schedule priority or lpt")
+        priorities = {task_name: priority for task_name in task_names
+                      if task_name in self.task_records and self.task_records.status(task_name) == 'unassigned'}
+        if not priorities:
+            return
+        self.record_tasks([{"task": task_name, "priority": priority} for task_name in priorities])
+        self.task_queue.put(("priorities", priorities))
 
-                self.finished_num += 1
-                # self.new_finished_num += 1
-                # self.console.log(f"{self.finished_num}/{self.new_finished_num}")
+    @property
+    def unassigned_num(self) -> int:
+        # 等待相同输入的任务结果的任务不需要分配
+        waiting_num = sum(len(duplicate_names) for duplicate_names in self.duplicate_tasks.values())
+        return self.ingested_num - self.finished_num - self.working_num - waiting_num
 
-                self.time_tracker.update()
-                self.progress.update(self.task_id, advance=1)
+    def launch_backups(self):
+        """Run a copy of the straggling leases on idle nodes once all tasks are assigned."""
+        current_time = time.time()
+        if self.previous_speculation_time is not None and current_time - self.previous_speculation_time < 1:
+            return
+        self.previous_speculation_time = current_time
+        # 所有任务的租约都已经读到时, 分配线程不会再写入节点状态
+        if not self.source_exhausted or self.unassigned_num > 0:
+            return
+        median = self.runtime_stats.median()
+        if median is None:
+            return
+        stragglers = find_stragglers(self.working_leases, median, self.speculative_factor, current_time)
+        if not stragglers:
+            return
 
-    def loop_assignment(self):
-        loop_assignment(self.available_dir, self.nodes_dir, self.working_dir, self.unassigned_task_status, self.console)
+        idle_nodes = [node for node, _ in self.store.list_available()
+                      if node not in self.dead_nodes and node not in self.retry_policy.excluded_nodes]
+        profiles = self.store.read_profiles(idle_nodes) if idle_nodes else {}
+        for lease_info in stragglers:
+            # 副本也只能运行在满足任务需求的节点上
+            requirements = [self.task_records[task_name].get("requires") for task_name in lease_info["tasks"]]
+            candidates = [node for node in idle_nodes if node != lease_info["assigned_to"]
+                          and all(fits(profiles.get(node), requires) for requires in requirements)]
+            if not candidates:
+                break
+            chosen_node = candidates[0]
+            idle_nodes.remove(chosen_node)
+
+            backup_id = f"lease_{uuid.uuid4().hex}"
+            lease = [(task_name, {"input": self.task_records.get_input(task_name)}) for task_name in lease_info["tasks"]]
+            do_assign_job((self.store, chosen_node, backup_id, lease, self.console, self.serializer.name))
+            self.working_leases[backup_id] = {
+                "lease_id": backup_id,
+                "assigned_to": chosen_node,
+                "assigned_at": current_time,
+                "progress_at": current_time,
+                "tasks": list(lease_info["tasks"]),
+                "backup_of": lease_info["lease_id"],
+            }
+            lease_info["backup_lease"] = backup_id
+            self.console.log(f"Lease {lease_info['lease_id']} on node {lease_info['assigned_to']} is running for "
+                             f"{current_time - lease_info['progress_at']:.1f}s (median task {median:.2f}s), "
+                             f"backup on node {chosen_node}")
+
+    def count_finished(self, task_name: str, status: str):
+        self.count_finished_tasks([task_name], status)
+
+    def count_finished_tasks(self, task_names: List[str], status: str):
+        if status == 'success':
+            self.success_num += len(task_names)
+        elif status == 'crashed':
+            self.crashed_num += len(task_names)
+        elif status == 'failed':
+            self.failed_num += len(task_names)
+        self.finished_tasks.extend(task_names)
+        self.finished_num += len(task_names)
+        self.time_tracker.update(len(task_names))
+        self.progress.update(self.task_id, advance=len(task_names))
+
+    def add_duplicate_task(self, task_name: str, primary_task: str) -> List[Dict]:
+        """Wait for the result of `primary_task`, or return the records that finish the task if it already has one."""
+        primary_info = self.task_records[primary_task]
+        if primary_info['status'] not in ["success", "crashed", "failed"]:
+            self.duplicate_tasks.setdefault(primary_task, []).append(task_name)
+            return []
+        self.count_finished(task_name, primary_info['status'])
+        return [{**primary_info, "task": task_name, "duplicate_of": primary_task}]
+
+    def check_completed_tasks(self) -> int:
+        completed_num = 0
+        for completed_info in self.store.pop_completions():
+            self.finish_tasks(completed_info["lease_id"], completed_info["results"], completed_info["assigned_to"])
+            completed_num += 1
+        return completed_num
+
+    def check_working_tasks(self) -> bool:
+        """Read the new leases and completed results, return True if there was any."""
+        # 只读取新追加的租约和新完成的结果
+        lease_records, self.lease_cursor = self.store.read_new_leases(self.lease_cursor)
+        if self.claim:
+            claim_records, self.claim_cursor = self.store.read_claims(self.claim_cursor)
+            lease_records += claim_records
+        self.add_working_leases(lease_records)
+        completed_num = self.check_completed_tasks()
+        return len(lease_records) > 0 or completed_num > 0
+
+    def loop_assignment(self, unassigned_task_status: Dict[str, Dict]):
+        try:
+            loop_assignment(self.store, unassigned_task_status, self.console, self.lease_size, self.task_queue,
+                            self.max_poll_interval, self.serializer.name, self.schedule, self.job_assign_stop)
+        except Exception as e:
+            self.job_assign_error = e
+
+    def check_job_assignment(self):
+        # 分配线程异常退出后不会再有任务被分配, 不能继续等待
+        if self.job_assign_thread is not None and not self.job_assign_thread.is_alive() \
+                and self.job_assign_error is not None:
+            raise self.job_assign_error
 
     def start_job_assignment(self):
-        self.job_assign_process = Process(target=self.loop_assignment)
-        self.job_assign_process.start()
+        if self.claim:
+            self.publisher = LeasePublisher(self.store, self.claim_partitions, self.lease_size, self.serializer.name,
+                                            self.schedule)
+            self.task_queue.put(self.unassigned_task_status)
+            self.publisher.publish_new_tasks(self.task_queue)
+            self.console.log(f"Publishing leases in {self.claim_partitions} partitions for the workers to claim")
+            return
+        # 等待分配的任务交给分配线程
+        unassigned_task_status, self.unassigned_task_status = self.unassigned_task_status, {}
+        self.job_assign_thread = threading.Thread(target=self.loop_assignment, args=(unassigned_task_status,),
+                                                  daemon=True)
+        self.job_assign_thread.start()
 
     def stop_job_assignment(self):
-        if self.job_assign_process:
-            self.job_assign_process.terminate()
-            self.job_assign_process.join()
+        if self.job_assign_thread:
+            self.job_assign_stop.set()
+            self.task_queue.wakeup.set()
+            self.job_assign_thread.join()
+        self.task_queue.wakeup.close()
 
     def run(self):
+        for _ in self.run_iter():
+            pass
+
+    def run_iter(self) -> Iterator[str]:
+        """Run until all tasks are finished, yield the name of every task as soon as it is finished.
+
+        Tasks finished in a previous run of the same journal are yielded first.
+        """
         with Progress(
                 TextColumn("[progress.description]{task.description}"),
                 BarColumn(),
@@ -216,51 +676,65 @@ class Manager:
             self.progress = progress
             # self.pbar = tqdm(total=len(self.job_list), desc="Processing Jobs")
             self.initialize_tasks()
+            self.ingest_tasks()
 
             self.start_job_assignment()
 
+            # 没有新的租约和结果时逐渐延长等待时间, 有文件变化时立即唤醒
+            backoff = Backoff(max_interval=self.max_poll_interval, watcher=self.store.watcher("manager"),
+                              wakeup=getattr(self.job_list, "wakeup", None))
             try:
                 while True:
-                    if self.finished_num == self.total_jobs or self.working_num + self.finished_num == self.total_jobs:
-                        if not self.finished_file.exists():
-                            self.finished_file.touch()
+                    finished_tasks, self.finished_tasks = self.finished_tasks, []
+                    yield from finished_tasks
+
+                    # 推测执行或重试时空闲节点要等到所有任务完成, 用来运行副本或重试的任务
+                    keep_idle_nodes = self.speculative or self.retry_policy.max_retries > 0
+                    if self.source_exhausted and (self.finished_num == self.ingested_num or (
+                            not keep_idle_nodes and self.working_num + self.finished_num == self.ingested_num)):
+                        self.store.set_finished()
 
-                    if self.finished_num == self.total_jobs:
+                    if self.source_exhausted and self.finished_num == self.ingested_num:
                         break
 
-                    self.check_task_status_and_assign()
+                    self.check_job_assignment()
+                    if self.check_task_status_and_assign():
+                        backoff.reset()
+                    else:
+                        backoff.wait()
 
             finally:
+                if backoff.watcher:
+                    backoff.watcher.close()
                 self.stop_job_assignment()
-
-    def monitor_heartbeats(self, heartbeat_timeout: int = 120):
-        self.available_nodes = {}
-        new_dead_nodes = {}
-
-        current_time = int(time.time())
-        for node_file in self.heart_dir.iterdir():
-            if node_file.stem in self.dead_nodes:
+                # 正常结束或中断时也写入检查点, 下次启动不需要重放
+                if self.journal.changed:
+                    self.write_checkpoint()
+                self.store.close()
+                self.result_writer.close()
+
+    def iter_results(self, ordered: bool = False) -> Iterator[Tuple[str, Dict, Any]]:
+        """Run the manager and yield (task_name, status_info, result) for every task.
+
+        Results are yielded as the tasks finish, or in job_list order if `ordered` (tasks finished early are held
+        back by name only). `result` is the "result" value returned by the job function, None if there is none.
+        """
+        next_index = 1
+        held_tasks = set()
+        for task_name in self.run_iter():
+            if not ordered:
+                yield self.get_result(task_name)
                 continue
-
-            node_info = safe_load_json(node_file)
-
-            if node_info and node_info['status'] == "available" and current_time - node_info.get("last_heartbeat",
-                                                                                                 0) <= heartbeat_timeout:
-                self.available_nodes[node_file.stem] = node_info
-
-            else:
-                if node_info is None:
-                    dead_reason = f"can not load node info from {str(node_file)}"
-                    node_info = {}
-                else:
-                    if node_info['status'] == 'dead':
-                        dead_reason = f"worker sends dead"
-                    else:
-                        dead_reason = f"no heartbeat, last heartbeat: {datetime.fromtimestamp(node_info.get('last_heartbeat', 0)).strftime('%Y-%m-%d %H:%M:%S')}"
-                node_info['status'] = 'dead'
-                node_info['dead_reason'] = dead_reason
-
-                node_file.write_text(json.dumps(node_info))
-                self.dead_nodes[node_file.stem] = node_info
-                new_dead_nodes[node_file.stem] = node_info
+            held_tasks.add(task_name)
+            while f"task{next_index}" in held_tasks:
+                held_tasks.remove(f"task{next_index}")
+                yield self.get_result(f"task{next_index}")
+                next_index += 1
+
+    def get_result(self, task_name: str) -> Tuple[str, Dict, Any]:
+        status_info = {**self.task_records[task_name], "input": self.task_records.get_input(task_name)}
+        return task_name, status_info, self.result_reader.read(status_info.get("result_ref"), self.serializer)
+
+    def monitor_heartbeats(self):
+        self.available_nodes, new_dead_nodes = self.heartbeat_index.update()
         self.process_dead_nodes(new_dead_nodes)
@@ -1,96 +1,182 @@
-import json
+import math
+import queue
 import time
-from copy import deepcopy
+import uuid
 import threading
+from typing import Optional
+
+from fleet.manager_utils.matching import ResourceMatcher
+from fleet.store.base import CoordinationStore
+from fleet.utils.scheduling import Backoff, Wakeup
+
+
+class CommandQueue(queue.Queue):
+    """Queue from the manager to the assigner thread, every message wakes the assigner up at once."""
+
+    def __init__(self):
+        super().__init__()
+        self.wakeup = Wakeup()
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self.wakeup.set()
+
+
+def receive_tasks(task_queue, scheduler: ResourceMatcher, excluded_nodes=None) -> bool:
+    """Move newly ingested (or retried) tasks from task_queue into the scheduler, return True if the source is
+    exhausted.
+
+    Besides task dicts the queue carries ("exclude_nodes", [node, ...]) for nodes that must not get new leases,
+    ("cost_model", CostModel) with the costs learned by the manager, ("remove_tasks", [task_name, ...]) for tasks
+    the manager took back and ("priorities", {task_name: priority}) for waiting tasks whose priority changed.
+    """
+    while True:
+        try:
+            message = task_queue.get_nowait()
+        except queue.Empty:
+            return False
+        if message is None:
+            return True
+        if isinstance(message, tuple):
+            if excluded_nodes is not None and message[0] == "exclude_nodes":
+                excluded_nodes.update(message[1])
+            elif message[0] == "cost_model":
+                scheduler.set_cost_model(message[1])
+            elif message[0] == "remove_tasks":
+                scheduler.remove_tasks(message[1])
+            elif message[0] == "priorities":
+                scheduler.set_priorities(message[1])
+            continue
+        scheduler.add(message)
+
+
+def loop_assignment(store: CoordinationStore, unassigned_task_status, console, lease_size: int = 1,
+                    task_queue=None, max_poll_interval: float = 0.5, serializer: str = "json",
+                    schedule: str = "fifo", stop_event: Optional[threading.Event] = None):
+    """Assign the unassigned tasks to available nodes, until all tasks are assigned or `stop_event` is set."""
+    source_exhausted = task_queue is None
+    excluded_nodes = set()
+    scheduler = ResourceMatcher(schedule)
+    scheduler.add(unassigned_task_status)
+    # worker 输入缓存变化的读取位置, 每秒最多读取一次
+    cache_cursor = None
+    previous_cache_time = 0
+    # 有节点变为可用或者 manager 发来消息时立即唤醒
+    backoff = Backoff(max_interval=max_poll_interval, watcher=store.watcher("assigner"),
+                      wakeup=getattr(task_queue, "wakeup", None))
+    while stop_event is None or not stop_event.is_set():
+        # 任务源读完之后仍然接收排除节点和优先级等消息
+        if task_queue is not None and receive_tasks(task_queue, scheduler, excluded_nodes):
+            source_exhausted = True
+        if source_exhausted and len(scheduler) == 0:
+            break
+        if time.time() - previous_cache_time >= 1:
+            previous_cache_time = time.time()
+            cache_updates, cache_cursor = store.read_cache_updates(cache_cursor)
+            scheduler.apply_cache_updates(cache_updates)
 
-from pathlib import Path
-
-
-def loop_assignment(available_dir, nodes_dir, working_dir, unassigned_task_status, console):
-    while len(unassigned_task_status) > 0:
-        unassigned_task_status, working_task_status = process_assignment(available_dir, nodes_dir, working_dir,
-                                                                         unassigned_task_status, console)
+        working_task_status = process_assignment(store, scheduler, console, lease_size, serializer, excluded_nodes)
         if len(working_task_status) == 0:
-            time.sleep(0.1)
+            backoff.wait()
+        else:
+            backoff.reset()
+    if backoff.watcher:
+        backoff.watcher.close()
     console.log("All tasks are assigned.")
 
 
-def process_assignment(available_dir, nodes_dir, working_dir: Path, unassigned_task_status, console):
+def process_assignment(store: CoordinationStore, scheduler: ResourceMatcher, console, lease_size: int = 1,
+                       serializer: str = "json", excluded_nodes=None):
     working_task_status = {}
-    if len(unassigned_task_status) == 0:
-        return unassigned_task_status, working_task_status
+    if len(scheduler) == 0:
+        return working_task_status
 
-    available_nodes = get_available_nodes(available_dir, nodes_dir)
+    available_nodes = store.list_available()
+    if excluded_nodes:
+        # 反复崩溃任务的节点不再分配
+        available_nodes = [node for node in available_nodes if node[0] not in excluded_nodes]
     if available_nodes:
-        unassigned_task_status, working_task_status = assign_job_to_node(available_nodes,
-                                                                         unassigned_task_status, working_dir, console)
+        working_task_status = assign_job_to_node(available_nodes, scheduler, store, console, lease_size, serializer)
 
-    return unassigned_task_status, working_task_status
-
-
-def get_available_nodes(available_dir, nodes_dir):
-    files = list(available_dir.glob('*'))
-    available_nodes = []
-    for file in files:
-        file_name = file.name
-        node_file = nodes_dir / f"{file_name}.status"
-        available_nodes.append((file_name, node_file, file))
-    return available_nodes
+    return working_task_status
 
 
 def do_assign_job(process_input):
-    chosen_node, node_file, available_file, status_info, working_dir, job_key, console = process_input
-    status_info['assigned_to'] = chosen_node
-    status_info['status'] = 'assigned'
-    task_status_file = Path(status_info["task_status_path"])
-    task_status_file.write_text(json.dumps(status_info))
+    store, chosen_node, lease_id, lease, console, serializer = process_input
+
+    # 一次写入整个租约 (包括任务输入), 节点在本地依次执行
     node_info = {
         "status": "busy",
-        "task": job_key,
-        "task_status_path": status_info["task_status_path"]
+        "lease_id": lease_id,
+        # 任务输入的编码方式, 由 worker 解码
+        "serializer": serializer,
+        "tasks": [{"task": job_key, "input": status_info["input"]} for job_key, status_info in lease],
     }
-    node_file.write_text(json.dumps(node_info))
-    if available_file.exists():
-        available_file.unlink()
-    console.log(f"Assign task {job_key} to node {chosen_node}")
+    # 先移除可用标记, 否则节点可能在写入节点状态后很快完成并重新标记为可用
+    store.clear_available(chosen_node)
+    store.write_node(chosen_node, node_info)
+    console.log(f"Assign tasks {[job_key for job_key, _ in lease]} to node {chosen_node}")
 
-    working_file = working_dir / job_key
-    if not working_file.exists():
-        # console.log(f"Writing {str(working_file)}")
-        working_file.write_text(json.dumps(status_info))
 
+def get_lease_size(task_num: int, node_num: int, lease_size: int) -> int:
+    # 任务不足时均匀分配, 避免最后几个节点空等
+    return max(1, min(lease_size, math.ceil(task_num / max(node_num, 1))))
 
-def assign_job_to_node(available_nodes, unassigned_task_status, working_dir, console):
+
+def assign_job_to_node(available_nodes, scheduler: ResourceMatcher, store: CoordinationStore, console,
+                       lease_size: int = 1, serializer: str = "json"):
     working_task_status = {}
 
     process_inputs = []
 
-    for job_key in list(unassigned_task_status.keys()):
-        status_info = deepcopy(unassigned_task_status[job_key])
-        assert status_info['status'] == 'unassigned'
-        if available_nodes:
-            chosen_node, node_file, available_file = available_nodes.pop()
-            process_inputs.append((chosen_node, node_file, available_file, status_info, working_dir, job_key, console))
-            # 移除未完成任务
-            del unassigned_task_status[job_key]
+    # 节点的资源注册后不再变化, 只读取新节点的
+    unknown_nodes = scheduler.unknown_nodes([node for node, _ in available_nodes])
+    if unknown_nodes:
+        profiles = store.read_profiles(unknown_nodes)
+        for node in unknown_nodes:
+            scheduler.add_profile(node, profiles.get(node))
+    for requires in scheduler.new_unmatched_requirements():
+        console.log(f"No node meets the requirements {requires} of the waiting tasks yet")
+    # 从资源最少的节点开始, 资源多的节点留给需要它的任务
+    available_nodes = sorted(available_nodes, key=lambda node: scheduler.capability(node[0]), reverse=True)
+
+    # 每个 slot 分到的任务数
+    current_lease_size = get_lease_size(len(scheduler), sum(node[1] for node in available_nodes), lease_size)
+    while len(scheduler) > 0 and available_nodes:
+        chosen_node, slots = available_nodes.pop()
+        # 按调度顺序取出这个节点满足需求的任务
+        lease = scheduler.pop_for_node(chosen_node, current_lease_size * slots)
+        if len(lease) == 0:
+            continue
+        for job_key, status_info in lease:
+            assert status_info['status'] == 'unassigned'
             working_task_status[job_key] = status_info
-        else:
-            break
-
-    # for process_input in process_inputs:
-    #     do_assign_job(process_input)
-
-    threads = []
-    for process_input in process_inputs:
-        thread = threading.Thread(target=do_assign_job, args=(process_input,))
-        threads.append(thread)
-        thread.start()  # 启动线程
-
-    # 等待所有线程完成
-    for thread in threads:
-        thread.join()
+        lease_id = f"lease_{uuid.uuid4().hex}"
+        process_inputs.append((store, chosen_node, lease_id, lease, console, serializer))
+
+    if not store.parallel_writes:
+        for process_input in process_inputs:
+            do_assign_job(process_input)
+    else:
+        threads = []
+        for process_input in process_inputs:
+            thread = threading.Thread(target=do_assign_job, args=(process_input,))
+            threads.append(thread)
+            thread.start()  # 启动线程
+
+        # 等待所有线程完成
+        for thread in threads:
+            thread.join()
+
+    # 本轮的租约一次追加到租约记录中, 由 manager 增量读取
+    assigned_at = time.time()
+    lease_records = [{"lease_id": lease_id, "assigned_to": chosen_node, "assigned_at": assigned_at,
+                      "tasks": [job_key for job_key, _ in lease]}
+                     for _, chosen_node, lease_id, lease, _, _ in process_inputs]
+    if len(lease_records) > 0:
+        store.append_leases(lease_records)
 
     if len(process_inputs) > 0:
-        console.log(f"Assigned jobs to {len(process_inputs)} nodes.")
+        console.log(f"Assigned {len(working_task_status)} jobs to {len(process_inputs)} nodes.")
 
-    return unassigned_task_status, working_task_status
+    return working_task_status
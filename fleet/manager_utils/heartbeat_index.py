@@ -0,0 +1,91 @@
+import heapq
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from fleet.store.base import CoordinationStore
+
+
+class HeartbeatIndex:
+    """Keep the heartbeat state of all nodes and only re-read the heartbeats that changed.
+
+    Alive nodes are kept in a min-heap ordered by their heartbeat deadline, so expired nodes are found without
+    reading every heartbeat. Heartbeats of dead nodes are archived after `archive_delay` seconds without change.
+    """
+
+    def __init__(self, store: CoordinationStore, heartbeat_timeout: int = 120, scan_interval: float = 1,
+                 archive_delay: Optional[float] = None):
+        self.store = store
+        self.heartbeat_timeout = heartbeat_timeout
+        self.scan_interval = scan_interval
+        self.archive_delay = heartbeat_timeout if archive_delay is None else archive_delay
+
+        # store.read_changed_heartbeats 的读取位置
+        self.cursor = None
+        self.available_nodes = {}
+        self.dead_nodes = {}
+        # 还没有归档的死亡节点 -> 心跳最后一次变化的时间
+        self.unarchived_dead_nodes = {}
+        # (deadline, node)
+        self.deadlines = []
+        self.previous_scan_time = None
+
+    def mark_dead(self, node: str, node_info: Dict, dead_reason: str):
+        node_info['status'] = 'dead'
+        node_info['dead_reason'] = dead_reason
+        self.store.write_heartbeat(node, node_info)
+        self.available_nodes.pop(node, None)
+        self.dead_nodes[node] = node_info
+        self.unarchived_dead_nodes[node] = time.time()
+
+    def archive_dead_nodes(self):
+        for node, changed_time in list(self.unarchived_dead_nodes.items()):
+            if time.time() - changed_time > self.archive_delay:
+                self.store.archive_heartbeat(node)
+                del self.unarchived_dead_nodes[node]
+
+    def scan_changed(self, current_time: int, new_dead_nodes: Dict[str, Dict]):
+        changed, self.cursor = self.store.read_changed_heartbeats(self.cursor)
+        for node, node_info in changed.items():
+            if node in self.dead_nodes:
+                # 死亡节点仍在写心跳时推迟归档
+                self.unarchived_dead_nodes[node] = time.time()
+                continue
+
+            if node_info and node_info['status'] == "available" and current_time - node_info.get(
+                    "last_heartbeat", 0) <= self.heartbeat_timeout:
+                self.available_nodes[node] = node_info
+                heapq.heappush(self.deadlines, (node_info.get("last_heartbeat", 0) + self.heartbeat_timeout, node))
+                continue
+
+            if node_info is None:
+                dead_reason = f"can not load heartbeat of node {node}"
+                node_info = {}
+            elif node_info['status'] == 'dead':
+                dead_reason = f"worker sends dead"
+            else:
+                dead_reason = f"no heartbeat, last heartbeat: {datetime.fromtimestamp(node_info.get('last_heartbeat', 0)).strftime('%Y-%m-%d %H:%M:%S')}"
+            self.mark_dead(node, node_info, dead_reason)
+            new_dead_nodes[node] = node_info
+        self.archive_dead_nodes()
+
+    def check_deadlines(self, current_time: int, new_dead_nodes: Dict[str, Dict]):
+        while self.deadlines and self.deadlines[0][0] < current_time:
+            deadline, node = heapq.heappop(self.deadlines)
+            node_info = self.available_nodes.get(node)
+            # 节点之后又发送过心跳, 堆中还有更新的截止时间
+            if node_info is None or node_info.get("last_heartbeat", 0) + self.heartbeat_timeout > deadline:
+                continue
+            dead_reason = f"no heartbeat, last heartbeat: {datetime.fromtimestamp(node_info.get('last_heartbeat', 0)).strftime('%Y-%m-%d %H:%M:%S')}"
+            self.mark_dead(node, node_info, dead_reason)
+            new_dead_nodes[node] = node_info
+
+    def update(self) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+        """Return the available nodes and the nodes found dead since the last call."""
+        new_dead_nodes = {}
+        current_time = int(time.time())
+        if self.previous_scan_time is None or time.time() - self.previous_scan_time >= self.scan_interval:
+            self.previous_scan_time = time.time()
+            self.scan_changed(current_time, new_dead_nodes)
+        self.check_deadlines(current_time, new_dead_nodes)
+        return self.available_nodes, new_dead_nodes
@@ -0,0 +1,146 @@
+import itertools
+import json
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sized, Tuple, Union
+
+from fleet.utils.scheduling import Wakeup
+
+# 任务记录中的调度提示
+HINT_KEYS = ["priority", "cost", "group", "requires", "inputs"]
+
+
+class Job:
+    """A job input with scheduling hints, used as an item of job_list.
+
+    Tasks with a higher `priority` are assigned first. `cost` is the expected runtime (seconds or any relative
+    unit) and `group` names tasks of similar cost; `--schedule lpt` uses both to assign long tasks first.
+    `requires` restricts the task to nodes with at least the given resources and all the given tags, e.g.
+    {"memory_gb": 32, "gpus": 1, "tags": ["ssd"]}. `inputs` lists the keys (e.g. shared file paths) the job reads
+    through `fetch_input`, so the task can go to a host that already has them cached.
+    """
+
+    def __init__(self, input: Any, priority: int = 0, cost: Optional[float] = None, group: Optional[str] = None,
+                 requires: Optional[Dict] = None, inputs: Optional[List[str]] = None):
+        self.input = input
+        self.priority = priority
+        self.cost = cost
+        self.group = group
+        self.requires = requires
+        self.inputs = inputs
+
+    def hints(self) -> Dict:
+        # 只记录设置了的提示
+        hints = {"priority": self.priority, "cost": self.cost, "group": self.group, "requires": self.requires,
+                 "inputs": self.inputs}
+        return {key: value for key, value in hints.items() if value}
+
+
+def split_job(job: Any) -> Tuple[Any, Dict]:
+    """Return the job input and its scheduling hints."""
+    if isinstance(job, Job):
+        return job.input, job.hints()
+    return job, {}
+
+
+class JsonlJobSource:
+    """Read job inputs lazily from a JSON lines file, one job per line."""
+
+    def __init__(self, file_path: Union[str, Path], total: Optional[int] = None):
+        self.file_path = Path(file_path)
+        self.total = total
+
+    def __iter__(self) -> Iterator[Any]:
+        return self.iter_from(0)
+
+    def iter_from(self, skip: int) -> Iterator[Any]:
+        # 跳过的行不做解析
+        with open(self.file_path, "r") as f:
+            lines = (line for line in f if line.strip())
+            for line in itertools.islice(lines, skip, None):
+                yield json.loads(line)
+
+
+class JobFeed:
+    """Job source filled while the run goes on, e.g. `feed.put([job, ...])` from another thread.
+
+    Iteration stops when no job is queued, but the source only ends once it is closed. Putting jobs wakes the
+    manager up at once. Like a job_list, the jobs of a resumed run are matched to the journal by position.
+    """
+
+    def __init__(self):
+        self.jobs = deque()
+        self.closed = False
+        # 上次运行已经写入 journal 的任务数
+        self.skip = 0
+        self.wakeup = Wakeup()
+
+    def put(self, jobs: Iterable[Any]):
+        self.jobs.extend(jobs)
+        self.wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+    def iter_from(self, skip: int) -> Iterator[Any]:
+        self.skip = skip
+        return self
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        while self.jobs:
+            job = self.jobs.popleft()
+            if self.skip > 0:
+                self.skip -= 1
+                continue
+            return job
+        raise StopIteration
+
+
+class ShardFeed(JobFeed):
+    """Job source of a sub-manager, filled by the root manager while the run goes on.
+
+    The k-th job taken from the feed becomes task{k} of the sub-manager, `origin` maps it back to the root task.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.origins: List[str] = []
+
+    def put(self, jobs: List[Tuple[str, Any]]):
+        """Queue (root task name, job) pairs."""
+        super().put(jobs)
+
+    def origin(self, task_name: str) -> str:
+        return self.origins[int(task_name[len("task"):]) - 1]
+
+    def __next__(self) -> Any:
+        origin, job = super().__next__()
+        self.origins.append(origin)
+        return job
+
+
+def source_closed(job_list: Iterable[Any]) -> bool:
+    """Whether a job source that yields no more jobs has ended; only a JobFeed can be open."""
+    return getattr(job_list, "closed", True)
+
+
+def get_job_total(job_list: Iterable[Any], total: Optional[int] = None) -> Optional[int]:
+    if total is not None:
+        return total
+    if isinstance(job_list, JsonlJobSource):
+        return job_list.total
+    if isinstance(job_list, Sized):
+        return len(job_list)
+    return None
+
+
+def iter_jobs(job_list: Iterable[Any], skip: int = 0) -> Iterator[Any]:
+    # 跳过上次运行已经写入 journal 的任务
+    # islice 在 JobFeed 暂时为空时就会结束
+    if isinstance(job_list, (JsonlJobSource, JobFeed)):
+        return job_list.iter_from(skip)
+    return itertools.islice(iter(job_list), skip, None)
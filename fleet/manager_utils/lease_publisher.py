@@ -0,0 +1,55 @@
+import itertools
+import uuid
+from typing import Dict, List, Tuple
+
+from fleet.manager_utils.assign_jobs import receive_tasks
+from fleet.manager_utils.matching import signature
+from fleet.manager_utils.scheduler import TaskScheduler
+from fleet.store.base import CoordinationStore
+
+
+class LeasePublisher:
+    """Publish unassigned tasks as leases in partition queues of the store, for workers to claim (--claim).
+
+    Each batch of new tasks is ordered by the schedule, grouped by requirements and cut into leases of
+    `lease_size` tasks, which are spread round-robin over the partitions. Nodes are not chosen here: a worker
+    claims from its own partition first and steals from the others, skipping leases it does not meet.
+    """
+
+    def __init__(self, store: CoordinationStore, partitions: int, lease_size: int = 1, serializer: str = "json",
+                 schedule: str = "fifo"):
+        self.store = store
+        self.partitions = partitions
+        self.lease_size = lease_size
+        self.serializer = serializer
+        self.scheduler = TaskScheduler(schedule)
+        # 发布顺序, 同时决定租约所在的分区
+        self.seq = itertools.count()
+
+    def publish_new_tasks(self, task_queue) -> bool:
+        """Publish the tasks sent by the manager through task_queue, return True if there was any."""
+        receive_tasks(task_queue, self.scheduler)
+        return self.publish(self.scheduler.pop(len(self.scheduler))) > 0
+
+    def publish(self, tasks: List[Tuple[str, Dict]]) -> int:
+        groups = {}
+        for task_name, status_info in tasks:
+            groups.setdefault(signature(status_info.get("requires")), []).append((task_name, status_info))
+        leases = []
+        for group_tasks in groups.values():
+            for start in range(0, len(group_tasks), self.lease_size):
+                chunk = group_tasks[start:start + self.lease_size]
+                seq = next(self.seq)
+                lease = {
+                    "lease_id": f"lease_{uuid.uuid4().hex}",
+                    "partition": seq % self.partitions,
+                    "seq": seq,
+                    "serializer": self.serializer,
+                    "tasks": [{"task": task_name, "input": status_info["input"]} for task_name, status_info in chunk],
+                }
+                if chunk[0][1].get("requires"):
+                    lease["requires"] = chunk[0][1]["requires"]
+                leases.append(lease)
+        if leases:
+            self.store.publish_leases(leases)
+        return len(leases)
@@ -0,0 +1,201 @@
+import itertools
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+from fleet.manager_utils.scheduler import CostModel, TaskScheduler
+from fleet.utils.input_cache import input_key_hash
+
+
+def fits(profile: Optional[Dict], requires: Optional[Dict]) -> bool:
+    """Whether a node profile meets the requirements of a task.
+
+    Numeric requirements are minimums of the node's resources (e.g. {"memory_gb": 32, "gpus": 1}), "tags" lists
+    labels the node must have. Nodes without a profile only run tasks without requirements.
+    """
+    if not requires:
+        return True
+    profile = profile or {}
+    resources = profile.get("resources", {})
+    for name, value in requires.items():
+        if name == "tags":
+            if not set(value) <= set(profile.get("tags", [])):
+                return False
+        elif resources.get(name, 0) < value:
+            return False
+    return True
+
+
+def signature(value: Optional[Dict]) -> str:
+    return json.dumps(value or {}, sort_keys=True)
+
+
+def profile_signature(profile: Optional[Dict]) -> str:
+    # 主机名不参与匹配, 资源和标签相同的节点共用一个索引项
+    profile = profile or {}
+    return signature({"resources": profile.get("resources", {}), "tags": profile.get("tags", [])})
+
+
+class ResourceMatcher:
+    """Unassigned tasks of the assigner, grouped by their requirements and matched to nodes through an index.
+
+    Tasks with the same requirements share one TaskScheduler heap. For every distinct node profile the index keeps
+    the requirement groups it can run, so a node only looks at heaps it fits instead of scanning tasks. Nodes are
+    served from the least to the most capable one, and a node takes the tasks that the fewest profiles can run
+    first, which keeps big nodes free for the tasks that need them.
+
+    Tasks whose `inputs` are in the input cache of a node's host are given to that node before any other task.
+    """
+
+    def __init__(self, schedule: str = "fifo"):
+        self.schedule = schedule
+        self.cost_model = CostModel()
+        # 所有堆共用一个计数器, 保证 fifo 时跨组的顺序
+        self.counter = itertools.count()
+        # 需求签名 -> 需求 / 任务堆
+        self.requirements: Dict[str, Dict] = {}
+        self.queues: Dict[str, TaskScheduler] = {}
+        # 节点 -> 资源签名 -> 资源
+        self.node_profiles: Dict[str, str] = {}
+        self.profiles: Dict[str, Dict] = {}
+        # 资源签名 -> 可以运行的需求签名
+        self.compatible: Dict[str, List[str]] = {}
+        # 需求签名 -> 可以运行它的资源签名数
+        self.scarcity: Dict[str, int] = {}
+        # 已经提示过没有节点满足的需求
+        self.reported_requirements = set()
+        # 数据局部性: 节点 -> 主机, 主机 -> 缓存中的输入, 输入 -> 等待分配的任务
+        self.node_hosts: Dict[str, str] = {}
+        self.host_keys: Dict[str, Set[str]] = {}
+        self.key_tasks: Dict[str, Set[str]] = {}
+        # 有输入的等待分配的任务 -> (需求签名, 输入)
+        self.task_inputs: Dict[str, Tuple[str, List[str]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def add(self, tasks: Dict[str, Dict]):
+        for task_name, status_info in tasks.items():
+            requirement = signature(status_info.get("requires"))
+            if requirement not in self.queues:
+                self.add_requirement(requirement, status_info.get("requires") or {})
+            self.queues[requirement].add({task_name: status_info})
+            if status_info.get("inputs"):
+                key_hashes = [input_key_hash(key) for key in status_info["inputs"]]
+                self.task_inputs[task_name] = (requirement, key_hashes)
+                for key_hash in key_hashes:
+                    self.key_tasks.setdefault(key_hash, set()).add(task_name)
+
+    def remove_tasks(self, task_names: List[str]):
+        """Drop the given tasks that are still waiting, e.g. taken back by the manager."""
+        for task_name in task_names:
+            for queue in self.queues.values():
+                if task_name in queue.entries:
+                    queue.remove(task_name)
+                    self.discard_inputs(task_name)
+                    break
+
+    def set_priorities(self, priorities: Dict[str, int]):
+        for queue in self.queues.values():
+            queue.set_priorities(priorities)
+
+    def discard_inputs(self, task_name: str):
+        _, key_hashes = self.task_inputs.pop(task_name, (None, []))
+        for key_hash in key_hashes:
+            tasks = self.key_tasks.get(key_hash)
+            if tasks is not None:
+                tasks.discard(task_name)
+                if not tasks:
+                    del self.key_tasks[key_hash]
+
+    def apply_cache_updates(self, updates: List[Dict]):
+        for update in updates:
+            keys = self.host_keys.setdefault(update["host"], set())
+            keys.update(update.get("added", []))
+            keys.difference_update(update.get("removed", []))
+
+    def add_requirement(self, requirement: str, requires: Dict):
+        self.requirements[requirement] = requires
+        self.queues[requirement] = TaskScheduler(self.schedule, self.cost_model, counter=self.counter)
+        self.scarcity[requirement] = 0
+        for profile_key, profile in self.profiles.items():
+            if fits(profile, requires):
+                self.compatible[profile_key].append(requirement)
+                self.scarcity[requirement] += 1
+
+    def add_profile(self, node: str, profile: Optional[Dict]):
+        profile_key = profile_signature(profile)
+        self.node_profiles[node] = profile_key
+        if profile and profile.get("hostname"):
+            self.node_hosts[node] = profile["hostname"]
+        if profile_key in self.profiles:
+            return
+        self.profiles[profile_key] = profile or {}
+        self.compatible[profile_key] = []
+        for requirement, requires in self.requirements.items():
+            if fits(profile, requires):
+                self.compatible[profile_key].append(requirement)
+                self.scarcity[requirement] += 1
+
+    def unknown_nodes(self, nodes: List[str]) -> List[str]:
+        return [node for node in nodes if node not in self.node_profiles]
+
+    def new_unmatched_requirements(self) -> List[Dict]:
+        """Requirements of waiting tasks that no known node can meet, each one is returned once."""
+        unmatched = [requirement for requirement, queue in self.queues.items()
+                     if len(queue) > 0 and self.scarcity[requirement] == 0
+                     and requirement not in self.reported_requirements]
+        self.reported_requirements.update(unmatched)
+        return [self.requirements[requirement] for requirement in unmatched]
+
+    def capability(self, node: str) -> Tuple:
+        profile_key = self.node_profiles.get(node, profile_signature(None))
+        resources = self.profiles.get(profile_key, {}).get("resources", {})
+        return len(self.compatible.get(profile_key, [])), resources.get("memory_gb", 0), resources.get("cpus", 0)
+
+    def pop_for_node(self, node: str, task_num: int) -> List[Tuple[str, Dict]]:
+        profile_key = self.node_profiles.get(node)
+        if profile_key is None:
+            self.add_profile(node, None)
+            profile_key = self.node_profiles[node]
+        tasks = self.pop_local_tasks(node, profile_key, task_num)
+        queues = [(requirement, self.queues[requirement]) for requirement in self.compatible[profile_key]]
+        while len(tasks) < task_num:
+            candidates = []
+            for requirement, queue in queues:
+                entry = queue.peek()
+                if entry is not None:
+                    candidates.append((entry[0], self.scarcity[requirement], entry[1], queue))
+            if not candidates:
+                break
+            # 调度顺序优先, 其次是能运行它的节点少的任务
+            tasks.extend(min(candidates, key=lambda candidate: candidate[:3])[3].pop(1))
+        for task_name, _ in tasks:
+            self.discard_inputs(task_name)
+        return tasks
+
+    def pop_local_tasks(self, node: str, profile_key: str, task_num: int) -> List[Tuple[str, Dict]]:
+        """Take the tasks with the most inputs cached on the node's host."""
+        host_keys = self.host_keys.get(self.node_hosts.get(node))
+        if not host_keys or not self.key_tasks:
+            return []
+        # 遍历较小的集合
+        if len(host_keys) < len(self.key_tasks):
+            local_keys = [key_hash for key_hash in host_keys if key_hash in self.key_tasks]
+        else:
+            local_keys = [key_hash for key_hash in self.key_tasks if key_hash in host_keys]
+        compatible = set(self.compatible[profile_key])
+        local_counts = {}
+        for key_hash in local_keys:
+            for task_name in self.key_tasks[key_hash]:
+                if self.task_inputs[task_name][0] in compatible:
+                    local_counts[task_name] = local_counts.get(task_name, 0) + 1
+        # 本地输入多的任务优先, 其次按调度顺序
+        local_tasks = sorted(local_counts, key=lambda task_name: (
+            -local_counts[task_name], self.queues[self.task_inputs[task_name][0]].entries[task_name][:2]))
+        return [(task_name, self.queues[self.task_inputs[task_name][0]].remove(task_name))
+                for task_name in local_tasks[:task_num]]
+
+    def set_cost_model(self, cost_model: CostModel):
+        self.cost_model = cost_model
+        for queue in self.queues.values():
+            queue.set_cost_model(cost_model)
@@ -0,0 +1,38 @@
+from collections import Counter
+from typing import Iterable, Optional
+
+
+class RetryPolicy:
+    """Decide whether a crashed task is assigned again and which nodes crash too many tasks.
+
+    Only `crashed` tasks (dead node, timeout, runner exit or an exception in the job) are retried; a job that
+    returns `failed` is final. The n-th retry waits `backoff * 2 ** (n - 1)` seconds, at most `max_delay`.
+    """
+
+    def __init__(self, max_retries: int = 0, backoff: float = 5, max_delay: float = 300,
+                 max_node_crashes: Optional[int] = None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.max_node_crashes = max_node_crashes
+        self.node_crashes = Counter()
+        self.excluded_nodes = set()
+
+    def should_retry(self, attempts: int) -> bool:
+        return attempts < self.max_retries
+
+    def retry_delay(self, attempts: int) -> float:
+        return min(self.backoff * 2 ** (attempts - 1), self.max_delay)
+
+    def record_crash(self, node: str, alive_nodes: Iterable[str]) -> bool:
+        """Count a task crashed on a live node, return True if the node is excluded from now on."""
+        if not self.max_node_crashes or node in self.excluded_nodes:
+            return False
+        self.node_crashes[node] += 1
+        if self.node_crashes[node] < self.max_node_crashes:
+            return False
+        # 至少保留一个可用节点, 否则所有节点都崩溃同一个任务时 (例如任务本身有问题) 剩下的任务永远无法分配
+        if not any(alive_node != node and alive_node not in self.excluded_nodes for alive_node in alive_nodes):
+            return False
+        self.excluded_nodes.add(node)
+        return True
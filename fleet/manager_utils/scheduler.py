@@ -0,0 +1,119 @@
+import heapq
+import itertools
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEDULES = ["fifo", "priority", "lpt"]
+
+
+class CostModel:
+    """Expected runtime of tasks, learned online from the runtimes of finished tasks.
+
+    Tasks of the same `group` are assumed to have similar costs. A task with a cost hint is scaled by the observed
+    runtime / hinted cost ratio of its group; a task without a hint gets the mean runtime of its group.
+    """
+
+    def __init__(self):
+        # group -> [任务数, 运行时间之和, 有 cost 提示的任务数, 这些任务的运行时间之和, 提示的 cost 之和]
+        self.groups: Dict[Any, List[float]] = {}
+        self.total = [0, 0.0, 0, 0.0, 0.0]
+        self.version = 0
+
+    def observe(self, group: Any, cost: Optional[float], runtime: float):
+        for stats in [self.groups.setdefault(group, [0, 0.0, 0, 0.0, 0.0]), self.total]:
+            stats[0] += 1
+            stats[1] += runtime
+            if cost:
+                stats[2] += 1
+                stats[3] += runtime
+                stats[4] += cost
+        self.version += 1
+
+    def estimate(self, group: Any = None, cost: Optional[float] = None) -> float:
+        stats = self.groups.get(group)
+        if cost is not None:
+            # 同组的比例优先, 否则使用所有任务的比例
+            for ratio_stats in [stats, self.total]:
+                if ratio_stats and ratio_stats[2] > 0 and ratio_stats[4] > 0:
+                    return cost * ratio_stats[3] / ratio_stats[4]
+            return cost
+        if stats and stats[0] > 0:
+            return stats[1] / stats[0]
+        if self.total[0] > 0:
+            return self.total[1] / self.total[0]
+        return 1.0
+
+
+class TaskScheduler:
+    """The unassigned tasks of the assigner in a heap.
+
+    `fifo` keeps the ingest order, `priority` assigns higher `priority` first, and `lpt` assigns higher priority
+    first and then the longest expected task first (longest processing time), which shortens the makespan when task
+    costs differ. The heap is rebuilt when a new cost model arrives. `remove` takes a task out of order (e.g. for
+    data locality); its heap entry is dropped lazily.
+    """
+
+    def __init__(self, schedule: str = "fifo", cost_model: Optional[CostModel] = None, counter=None):
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule: {schedule}, choose from {SCHEDULES}")
+        self.schedule = schedule
+        self.cost_model = cost_model or CostModel()
+        self.heap = []
+        # 等待分配的任务 -> 堆中的项
+        self.entries = {}
+        # 相同优先级时按读入顺序
+        self.counter = counter or itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def sort_key(self, status_info: Dict) -> Tuple:
+        if self.schedule == "fifo":
+            return ()
+        if self.schedule == "priority":
+            return (-status_info.get("priority", 0),)
+        return (-status_info.get("priority", 0),
+                -self.cost_model.estimate(status_info.get("group"), status_info.get("cost")))
+
+    def add(self, tasks: Dict[str, Dict]):
+        for task_name, status_info in tasks.items():
+            entry = (self.sort_key(status_info), next(self.counter), task_name, status_info)
+            self.entries[task_name] = entry
+            heapq.heappush(self.heap, entry)
+
+    def peek(self) -> Optional[Tuple]:
+        """Return the heap entry (sort_key, seq, task_name, status_info) of the next task, None if empty."""
+        # 丢弃已经被 remove 的项
+        while self.heap and self.entries.get(self.heap[0][2]) is not self.heap[0]:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def pop(self, task_num: int) -> List[Tuple[str, Dict]]:
+        tasks = []
+        while len(tasks) < task_num and self.peek() is not None:
+            _, _, task_name, status_info = heapq.heappop(self.heap)
+            del self.entries[task_name]
+            tasks.append((task_name, status_info))
+        return tasks
+
+    def remove(self, task_name: str) -> Dict:
+        return self.entries.pop(task_name)[3]
+
+    def set_priorities(self, priorities: Dict[str, int]):
+        """Change the priority of waiting tasks, they keep their ingest order among tasks of the same priority."""
+        for task_name, priority in priorities.items():
+            entry = self.entries.get(task_name)
+            if entry is None:
+                continue
+            status_info = {**entry[3], "priority": priority}
+            # 旧的堆中的项在 peek 时丢弃
+            self.entries[task_name] = (self.sort_key(status_info), entry[1], task_name, status_info)
+            heapq.heappush(self.heap, self.entries[task_name])
+
+    def set_cost_model(self, cost_model: CostModel):
+        self.cost_model = cost_model
+        if self.schedule != "lpt":
+            return
+        self.entries = {task_name: (self.sort_key(status_info), index, task_name, status_info)
+                        for _, index, task_name, status_info in self.entries.values()}
+        self.heap = list(self.entries.values())
+        heapq.heapify(self.heap)
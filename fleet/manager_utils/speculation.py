@@ -0,0 +1,42 @@
+import statistics
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+
+class RuntimeStats:
+    """Runtimes of the most recently finished tasks, used to decide which running tasks are stragglers."""
+
+    def __init__(self, max_samples: int = 1000, min_samples: int = 5):
+        self.samples = deque(maxlen=max_samples)
+        # 样本太少时中位数不可靠, 不启动推测执行
+        self.min_samples = min_samples
+
+    def add(self, result: Dict):
+        # 从缓存中得到的结果不代表执行时间
+        if result.get("cached") or "started_at" not in result or "finished_at" not in result:
+            return
+        self.samples.append(max(0.0, result["finished_at"] - result["started_at"]))
+
+    def median(self) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        return statistics.median(self.samples)
+
+
+def find_stragglers(working_leases: Dict[str, Dict], median: float, factor: float,
+                    current_time: Optional[float] = None) -> List[Dict]:
+    """Return the leases without a backup that are running more than `factor` times the expected time, oldest first.
+
+    The expected time of a lease is the median task runtime times its remaining tasks, counted from the last time
+    one of its tasks finished.
+    """
+    current_time = time.time() if current_time is None else current_time
+    stragglers = []
+    for lease_info in working_leases.values():
+        if "backup_lease" in lease_info or "backup_of" in lease_info or len(lease_info["tasks"]) == 0:
+            continue
+        expected_time = max(median, 1e-3) * len(lease_info["tasks"])
+        if current_time - lease_info["progress_at"] > factor * expected_time:
+            stragglers.append(lease_info)
+    return sorted(stragglers, key=lambda lease_info: lease_info["progress_at"])
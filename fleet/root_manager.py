@@ -0,0 +1,343 @@
+from typing import Any, Dict, Iterable, List, Optional
+import queue
+import shutil
+import time
+import uuid
+from multiprocessing import Process, Queue
+
+from pathlib import Path
+from rich.console import Console
+
+from fleet.manager import Manager
+from fleet.manager_utils.assign_jobs import receive_tasks
+from fleet.manager_utils.job_source import HINT_KEYS, Job, ShardFeed
+from fleet.manager_utils.retry_policy import RetryPolicy
+from fleet.manager_utils.scheduler import TaskScheduler
+from fleet.store.base import CoordinationStore
+from fleet.store.memory_store import MemoryStore
+from fleet.utils.sharding import shard_args
+
+# 子 manager 上报给 root 的任务记录中不包含的字段
+LOCAL_KEYS = {"task", "input", "result_ref", "lease_id", "assigned_at", *HINT_KEYS}
+
+
+class ShardManager(Manager):
+    """A sub-manager of a RootManager, run in a child process of the root.
+
+    It assigns the tasks fed by the root to the nodes of its own store under `base_dir/shard_<i>`, and reports
+    finished tasks and its progress back to the root. On request it gives back tasks that are not assigned yet.
+    """
+
+    def __init__(self, args, shard: int, command_queue, event_queue, info: Dict = {}):
+        self.shard = shard
+        self.command_queue = command_queue
+        self.event_queue = event_queue
+        self.feed = ShardFeed()
+        self.previous_report_time = None
+        super().__init__(args, job_list=self.feed, info=info)
+        # 进度只由 root 显示
+        self.console = Console(quiet=True)
+
+    def check_task_status_and_assign(self) -> bool:
+        changed = self.receive_root_messages()
+        if super().check_task_status_and_assign():
+            changed = True
+        self.report_finished()
+        self.report_progress()
+        return changed
+
+    def receive_root_messages(self) -> bool:
+        received = False
+        while True:
+            try:
+                message = self.command_queue.get_nowait()
+            except queue.Empty:
+                return received
+            received = True
+            if message[0] == "tasks":
+                self.feed.put(message[1])
+            elif message[0] == "release":
+                self.release_tasks(message[1])
+            elif message[0] == "close":
+                self.feed.close()
+
+    def release_tasks(self, task_num: int):
+        """Give back up to `task_num` unassigned tasks to the root, the most recently fed first."""
+        released = []
+        # --claim 时任务读入后立即发布, 发布的租约可能已经被领取, 不能收回
+        for task_name in reversed(self.task_records if self.publisher is None else []):
+            if len(released) >= task_num:
+                break
+            # 等待重试的任务留在分片中
+            if self.task_records.status(task_name) == 'unassigned' and 'retry_at' not in self.task_records[task_name]:
+                released.append(task_name)
+        if released:
+            # 分配线程可能已经分配了其中的任务, 它们的结果不再上报
+            self.task_queue.put(("remove_tasks", released))
+            self.record_tasks([{"task": task_name, "status": "released"} for task_name in released])
+            for task_name in released:
+                self.count_finished(task_name, "released")
+        self.event_queue.put(("released", self.shard, [self.feed.origin(task_name) for task_name in released]))
+
+    def finish_tasks(self, lease_id: str, results: Dict[str, Dict], assigned_to: Optional[str] = None):
+        results = {task_name: result for task_name, result in results.items()
+                   if self.task_records.status(task_name) != 'released'}
+        super().finish_tasks(lease_id, results, assigned_to)
+
+    def report_finished(self):
+        finished_tasks, self.finished_tasks = self.finished_tasks, []
+        results = {}
+        for task_name in finished_tasks:
+            status_info = self.task_records[task_name]
+            if status_info['status'] == 'released':
+                continue
+            result = {key: value for key, value in status_info.items() if key not in LOCAL_KEYS}
+            if status_info.get('result_ref') is not None:
+                # 结果分片在子 manager 的目录中, 随结果一起发送给 root
+                result['result_data'] = self.serializer.wrap(self.result_reader.read_bytes(status_info['result_ref']))
+            results[self.feed.origin(task_name)] = result
+        if results:
+            self.event_queue.put(("results", self.shard, results))
+
+    def report_progress(self):
+        current_time = time.time()
+        if self.previous_report_time is not None and current_time - self.previous_report_time < 1:
+            return
+        self.previous_report_time = current_time
+        self.event_queue.put(("progress", self.shard, {
+            "working": self.working_num,
+            "pending": self.unassigned_num,
+            "nodes": len(self.available_nodes),
+            "dead_nodes": len(self.dead_nodes),
+            "idle_slots": sum(slots for node, slots in self.store.list_available() if node not in self.dead_nodes),
+        }))
+
+
+def run_shard(args, shard: int, command_queue, event_queue, info: Dict):
+    ShardManager(args, shard, command_queue, event_queue, info).run()
+
+
+class RootManager(Manager):
+    """Manager of a hierarchical run, for more nodes than one manager loop can serve.
+
+    The root keeps the journal, results and progress of all tasks but has no nodes: it runs `--shards`
+    ShardManagers in child processes, each with its own store, assigner and nodes under `base_dir/shard_<i>`.
+    A shard is fed tasks while it has less than two leases per node outstanding. When a shard has idle nodes and
+    the root has nothing left to feed, the root takes back half of the unassigned tasks of the busiest shard.
+
+    Sub-managers start empty on every run; tasks that were in a shard when the root stopped are fed again.
+    """
+
+    def __init__(self, args, job_list: Iterable[Any], info: Dict = {}, total: Optional[int] = None):
+        super().__init__(args, job_list, info, total)
+        self.shards = args.shards
+        self.args = args
+        self.scheduler = TaskScheduler(self.schedule, self.cost_model)
+        # 重试和推测执行由子 manager 在分片内完成
+        self.retry_policy = RetryPolicy()
+        self.speculative = False
+
+        self.event_queue = Queue()
+        self.command_queues = {}
+        self.shard_processes = {}
+        self.dead_shards = set()
+        # 分片 -> 最近一次上报的状态和上报时间
+        self.shard_stats: Dict[int, Dict] = {}
+        self.stats_at: Dict[int, float] = {}
+        # 分片 -> 已经发送但还没有完成的任务, 最近一次发送任务的时间
+        self.shard_tasks = {shard: set() for shard in range(self.shards)}
+        self.dispatched_at = {shard: 0 for shard in range(self.shards)}
+        # 已经发送的任务 -> 租约
+        self.task_leases: Dict[str, str] = {}
+        # 已经要求交还任务, 还没有回复的分片
+        self.releasing = set()
+        self.previous_steal_time = None
+
+    def create_task_queue(self):
+        # root 在自己的进程中分发任务, 不需要唤醒分配线程
+        return queue.Queue()
+
+    def open_store(self, args) -> CoordinationStore:
+        # root 不直接管理节点
+        return MemoryStore()
+
+    def initialize_tasks(self):
+        super().initialize_tasks()
+        # 上次运行中发送给分片但还没有完成的任务重新分发
+        records = []
+        for lease_info in self.working_leases.values():
+            for task_name in lease_info["tasks"]:
+                records.append({"task": task_name, "status": "unassigned"})
+                self.unassigned_task_status[task_name] = self.get_unassigned_info(task_name)
+            self.working_num -= len(lease_info["tasks"])
+        self.working_leases = {}
+        self.record_tasks(records)
+
+    def start_job_assignment(self):
+        self.scheduler.add(self.unassigned_task_status)
+        self.unassigned_task_status = {}
+        for shard in range(self.shards):
+            args = shard_args(self.args, shard)
+            # 子 manager 的 journal 每次启动时清空, 分片中残留的租约和结果随之丢弃
+            shutil.rmtree(Path(args.base_dir) / 'journal', ignore_errors=True)
+            # 相同输入的任务已经由 root 合并, 结果缓存也由 root 清理
+            args.memoize = False
+            self.command_queues[shard] = Queue()
+            process = Process(target=run_shard, args=(args, shard, self.command_queues[shard], self.event_queue,
+                                                      self.info))
+            process.start()
+            self.shard_processes[shard] = process
+        self.console.log(f"Started {self.shards} sub-managers under {self.base_dir}/shard_*")
+
+    def stop_job_assignment(self):
+        for command_queue in self.command_queues.values():
+            command_queue.put(("close",))
+        deadline = time.time() + 30
+        for process in self.shard_processes.values():
+            # 子 manager 退出前要把事件写完, 等待时继续读取
+            while process.is_alive() and time.time() < deadline:
+                self.receive_shard_events()
+                process.join(timeout=0.1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def monitor_heartbeats(self):
+        # 节点的心跳由子 manager 监控, root 只检查子 manager 进程
+        for shard, process in self.shard_processes.items():
+            if shard in self.dead_shards or process.exitcode is None:
+                continue
+            self.dead_shards.add(shard)
+            self.console.log(f"Sub-manager of shard {shard} exited with code {process.exitcode}, "
+                             f"its {len(self.shard_tasks[shard])} tasks are fed to the other shards")
+            self.take_back(shard, list(self.shard_tasks[shard]))
+        if self.shard_processes and len(self.dead_shards) == self.shards:
+            raise RuntimeError("All sub-managers exited")
+
+    def check_working_tasks(self) -> bool:
+        changed = self.receive_shard_events()
+        receive_tasks(self.task_queue, self.scheduler)
+        if self.dispatch_tasks():
+            changed = True
+        self.steal_tasks()
+        return changed
+
+    def receive_shard_events(self) -> bool:
+        received = False
+        while True:
+            try:
+                event, shard, data = self.event_queue.get_nowait()
+            except queue.Empty:
+                return received
+            received = True
+            if event == "progress":
+                self.shard_stats[shard] = data
+                self.stats_at[shard] = time.time()
+            elif event == "results":
+                self.finish_shard_tasks(shard, data)
+            elif event == "released":
+                self.releasing.discard(shard)
+                if data:
+                    self.console.log(f"Took back {len(data)} unassigned tasks from shard {shard}")
+                self.take_back(shard, data)
+
+    def finish_shard_tasks(self, shard: int, results: Dict[str, Dict]):
+        lease_results = {}
+        for task_name, result in results.items():
+            if task_name not in self.shard_tasks[shard]:
+                continue
+            self.shard_tasks[shard].remove(task_name)
+            lease_results.setdefault(self.task_leases.pop(task_name), {})[task_name] = result
+        for lease_id, results in lease_results.items():
+            self.finish_tasks(lease_id, results)
+
+    def take_back(self, shard: int, task_names: List[str]):
+        """Return tasks sent to a shard to the waiting tasks of the root."""
+        records = []
+        new_tasks = {}
+        for task_name in task_names:
+            if task_name not in self.shard_tasks[shard]:
+                continue
+            self.shard_tasks[shard].remove(task_name)
+            lease_info = self.working_leases[self.task_leases.pop(task_name)]
+            lease_info["tasks"].remove(task_name)
+            if len(lease_info["tasks"]) == 0:
+                self.working_leases.pop(lease_info["lease_id"])
+            self.working_num -= 1
+            records.append({"task": task_name, "status": "unassigned"})
+            new_tasks[task_name] = self.get_unassigned_info(task_name)
+        self.record_tasks(records)
+        self.scheduler.add(new_tasks)
+
+    def shard_capacity(self, shard: int) -> int:
+        stats = self.shard_stats[shard]
+        return max(stats["nodes"], stats["idle_slots"])
+
+    def shard_job(self, task_name: str) -> Job:
+        status_info = self.task_records[task_name]
+        return Job(self.serializer.decode(self.task_records.get_input(task_name)),
+                   **{key: status_info[key] for key in HINT_KEYS if key in status_info})
+
+    def dispatch_tasks(self) -> bool:
+        """Feed waiting tasks to the shards with less than two leases per node outstanding."""
+        shards = [shard for shard in self.shard_stats if shard not in self.dead_shards]
+        # 未完成的任务相对节点数最少的分片优先
+        shards.sort(key=lambda shard: len(self.shard_tasks[shard]) / max(self.shard_capacity(shard), 1))
+        current_time = time.time()
+        lease_records = []
+        for shard in shards:
+            if len(self.scheduler) == 0:
+                break
+            task_num = 2 * self.lease_size * self.shard_capacity(shard) - len(self.shard_tasks[shard])
+            if task_num <= 0:
+                continue
+            tasks = [task_name for task_name, _ in self.scheduler.pop(task_num)]
+            lease_id = f"lease_{uuid.uuid4().hex}"
+            lease_records.append({"lease_id": lease_id, "assigned_to": f"shard_{shard}", "assigned_at": current_time,
+                                  "tasks": tasks})
+            for task_name in tasks:
+                self.task_leases[task_name] = lease_id
+            self.shard_tasks[shard].update(tasks)
+            self.dispatched_at[shard] = current_time
+            self.command_queues[shard].put(("tasks", [(task_name, self.shard_job(task_name)) for task_name in tasks]))
+        self.add_working_leases(lease_records)
+        return len(lease_records) > 0
+
+    def steal_tasks(self):
+        """Take unassigned tasks back from the busiest shard when another shard has idle nodes and nothing to do."""
+        current_time = time.time()
+        if len(self.scheduler) > 0 or (self.previous_steal_time is not None
+                                       and current_time - self.previous_steal_time < 1):
+            return
+        self.previous_steal_time = current_time
+        shards = [shard for shard in self.shard_stats if shard not in self.dead_shards]
+        # 上报状态之后没有再收到任务, 并且有空闲节点的分片
+        idle_shards = [shard for shard in shards if self.shard_stats[shard]["pending"] == 0
+                       and self.shard_stats[shard]["idle_slots"] > 0 and self.dispatched_at[shard] < self.stats_at[shard]]
+        # 等待的任务多于空闲节点的分片
+        backlogs = {shard: self.shard_stats[shard]["pending"] - self.shard_stats[shard]["idle_slots"]
+                    for shard in shards if shard not in self.releasing}
+        backlogs = {shard: backlog for shard, backlog in backlogs.items() if backlog > 0}
+        if not idle_shards or not backlogs:
+            return
+        donor = max(backlogs, key=backlogs.get)
+        self.releasing.add(donor)
+        self.command_queues[donor].put(("release", max(1, backlogs[donor] // 2)))
+
+    def log_status(self):
+        current_time = time.time()
+        if self.previous_log_time is None or current_time - self.previous_log_time > 1 or self.finished_num == self.total_jobs:
+            self.previous_log_time = current_time
+        else:
+            return
+
+        if self.finished_num == 0:
+            success_rate = 0
+        else:
+            success_rate = self.success_num / self.finished_num * 100
+        # 汇总各分片上报的节点数
+        live_stats = [stats for shard, stats in self.shard_stats.items() if shard not in self.dead_shards]
+        node_num = sum(stats["nodes"] for stats in live_stats)
+        dead_num = sum(stats["dead_nodes"] for stats in live_stats)
+        self.progress.update(self.task_id,
+                             description=f"Success Rate: {success_rate:.2f}% Finished/Working: {self.finished_num}/{self.working_num}/{self.total_text} Shards: {self.shards - len(self.dead_shards)}/{self.shards} Nodes(Good/Dead): {node_num}/{dead_num} {self.time_tracker.summary}")
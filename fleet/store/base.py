@@ -0,0 +1,164 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fleet.utils.scheduling import DirWatcher
+
+
+class StoreUnavailableError(Exception):
+    """The coordination store can not be reached any more, e.g. the manager running the broker has exited."""
+
+
+def claim_record(node_id: str, lease: Dict, claimed_at: Optional[float] = None) -> Dict:
+    # 与分配线程追加的租约记录格式相同, manager 以相同的方式处理
+    return {"lease_id": lease["lease_id"], "assigned_to": node_id,
+            "assigned_at": time.time() if claimed_at is None else claimed_at,
+            "tasks": [task["task"] for task in lease["tasks"]]}
+
+
+class CoordinationStore:
+    """Shared state through which the manager, its assigner thread and the workers coordinate.
+
+    The same store object is used from several processes (the worker heartbeat daemon is forked) and from
+    several threads, so implementations must open their connections lazily in each process and thread.
+
+    Cursors returned by the `read_*` methods are opaque: callers keep them and pass them back on the next call.
+    """
+
+    # 写入是否适合在多个线程中并行 (共享文件系统的延迟高)
+    parallel_writes = False
+    # worker 是否与 manager 共享 base_dir (例如用于写入任务结果)
+    shares_base_dir = False
+
+    def initialize(self):
+        """Create the store, called once by the manager before any worker can use it."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def missing_parts(self) -> List[str]:
+        """Parts of the store that the manager has not created yet, workers wait until this is empty."""
+        raise NotImplementedError
+
+    # 节点状态: idle 或者 busy (带有租约中的任务)
+    def read_node(self, node_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def write_node(self, node_id: str, node_info: Dict):
+        raise NotImplementedError
+
+    # 等待分配任务的节点
+    def set_available(self, node_id: str, slots: int):
+        raise NotImplementedError
+
+    def clear_available(self, node_id: str):
+        raise NotImplementedError
+
+    def list_available(self) -> List[Tuple[str, int]]:
+        """Return (node_id, slots) of all available nodes."""
+        raise NotImplementedError
+
+    # 节点注册时声明的资源和标签, 注册后不再变化
+    def write_profile(self, node_id: str, profile: Dict):
+        raise NotImplementedError
+
+    def read_profiles(self, node_ids: List[str]) -> Dict[str, Dict]:
+        """Return the profiles of the given nodes, nodes without a profile are left out."""
+        raise NotImplementedError
+
+    # 心跳
+    def write_heartbeat(self, node_id: str, heart_info: Dict):
+        raise NotImplementedError
+
+    def read_heartbeat(self, node_id: str) -> Optional[Dict]:
+        """Return None if the heartbeat is missing or archived."""
+        raise NotImplementedError
+
+    def read_changed_heartbeats(self, cursor: Any = None) -> Tuple[Dict[str, Optional[Dict]], Any]:
+        """Return the heartbeats written since `cursor`, None for the ones that can not be read."""
+        raise NotImplementedError
+
+    def archive_heartbeat(self, node_id: str):
+        raise NotImplementedError
+
+    # 租约记录, 由分配线程追加, manager 增量读取
+    def append_leases(self, lease_records: List[Dict]):
+        raise NotImplementedError
+
+    def read_new_leases(self, cursor: Any = None) -> Tuple[List[Dict], Any]:
+        raise NotImplementedError
+
+    def pop_stale_leases(self) -> List[Dict]:
+        """Return and drop the lease records left by a previous manager run."""
+        raise NotImplementedError
+
+    # worker 上报的结果, 读取后删除
+    def push_completion(self, name: str, completed_info: Dict):
+        raise NotImplementedError
+
+    def pop_completions(self) -> List[Dict]:
+        raise NotImplementedError
+
+    # 数据局部性: worker 上报本机输入缓存中新增和淘汰的输入, 分配线程增量读取
+    def push_cache_updates(self, node_id: str, updates: List[Dict]):
+        """Append {"host", "added": [key hash, ...], "removed": [...]} records of one node."""
+        raise NotImplementedError
+
+    def read_cache_updates(self, cursor: Any = None) -> Tuple[List[Dict], Any]:
+        raise NotImplementedError
+
+    # 去中心化领取 (--claim): manager 把租约发布到分区队列, worker 直接领取, manager 只读取领取记录
+    def publish_leases(self, leases: List[Dict]):
+        """Publish leases {"lease_id", "partition", "seq", "tasks", ...} for workers to claim."""
+        raise NotImplementedError
+
+    def list_published(self, partition: int) -> List[str]:
+        """Return the entries of the unclaimed leases of a partition, oldest first."""
+        raise NotImplementedError
+
+    def read_published(self, partition: int, entry: str) -> Optional[Dict]:
+        """Return a published lease, None if it has been claimed."""
+        raise NotImplementedError
+
+    def claim_lease(self, node_id: str, partition: int, entry: str, lease: Dict) -> bool:
+        """Atomically take a published lease for `node_id`, False if another node took it first.
+
+        A successful claim is recorded with `claim_record` for `read_claims`.
+        """
+        raise NotImplementedError
+
+    def finish_claim(self, node_id: str, lease_id: str):
+        """Drop a claimed lease after its results are reported."""
+        raise NotImplementedError
+
+    def pop_claimed(self, node_id: str) -> List[Dict]:
+        """Return and drop the claim records of the unfinished leases of a node, e.g. a dead one."""
+        raise NotImplementedError
+
+    def read_claims(self, cursor: Any = None) -> Tuple[List[Dict], Any]:
+        raise NotImplementedError
+
+    def clear_published(self, stale_claims: bool = False):
+        """Drop the unclaimed leases, with `stale_claims` also the claimed leases and claims of a previous run."""
+        raise NotImplementedError
+
+    # 推测执行: 已经由另一个副本完成的任务, 由 manager 写入, 执行租约的 worker 读取
+    def cancel_tasks(self, lease_id: str, task_names: List[str]):
+        raise NotImplementedError
+
+    def read_cancelled(self, lease_id: str) -> List[str]:
+        raise NotImplementedError
+
+    def clear_cancelled(self, lease_id: str):
+        """Drop the cancelled tasks of a lease, called by the worker once it has finished the lease."""
+        raise NotImplementedError
+
+    def set_finished(self):
+        raise NotImplementedError
+
+    def is_finished(self) -> bool:
+        raise NotImplementedError
+
+    def watcher(self, role: str, node_id: Optional[str] = None) -> Optional[DirWatcher]:
+        """Return a watcher that wakes up `role` ("manager", "assigner" or "worker") on changes, None to poll."""
+        return None
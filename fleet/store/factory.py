@@ -0,0 +1,20 @@
+from pathlib import Path
+
+from fleet.store.base import CoordinationStore
+from fleet.store.file_store import FileStore
+from fleet.store.sqlite_store import SqliteStore
+from fleet.store.tcp_store import TcpStore
+
+
+def create_store(args) -> CoordinationStore:
+    """Create the coordination store selected by `--store`."""
+    if args.store == "file":
+        assert args.base_dir is not None, "--base_dir is required by the file store"
+        return FileStore(args.base_dir, fsync=args.fsync)
+    if args.store == "sqlite":
+        assert args.base_dir is not None, "--base_dir is required by the sqlite store"
+        return SqliteStore(Path(args.base_dir) / "fleet.sqlite", fsync=args.fsync)
+    if args.store == "tcp":
+        host, port = args.store_address.rsplit(":", 1)
+        return TcpStore(host, int(port), token=args.store_token, allow_remote=args.store_allow_remote)
+    raise ValueError(f"Unknown store: {args.store}")
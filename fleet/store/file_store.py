@@ -0,0 +1,298 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from fleet.store.base import CoordinationStore, claim_record
+from fleet.utils.file_utils import atomic_write, safe_load_json
+from fleet.utils.journal import append_records, read_new_records
+from fleet.utils.scheduling import DirWatcher
+
+
+class FileStore(CoordinationStore):
+    """Coordinate through files under `base_dir` on a shared file system.
+
+    Layout: nodes/<node>.status, profiles/<node>, available/<node>, heart/<node>.heart (moved to heart_archive/ when the node is
+    dead), leases/<manager start ms>.jsonl, completed/<lease_id>[.<task>], cancelled/<lease_id>, locality/<node>.jsonl
+    and the `finished` flag file. With --claim leases are published as queue/<partition>/<seq>_<lease_id>, renamed to
+    claimed/<node>/<lease_id> by the worker that claims them and recorded in claims/<node>.jsonl.
+
+    Files are written to tmp/ and renamed into place, so readers never see a partial file.
+    """
+
+    parallel_writes = True
+    shares_base_dir = True
+
+    def __init__(self, base_dir: Union[str, Path], fsync: str = "none"):
+        self.base_dir = Path(base_dir)
+        self.fsync = fsync
+        # 与其他目录在同一个文件系统上, 保证 rename 是原子的
+        self.tmp_dir = self.base_dir / 'tmp'
+        self.nodes_dir = self.base_dir / 'nodes'
+        self.profiles_dir = self.base_dir / 'profiles'
+        self.available_dir = self.base_dir / 'available'
+        self.heart_dir = self.base_dir / 'heart'
+        # 死亡节点的心跳文件会被移动到这里
+        self.heart_archive_dir = self.base_dir / 'heart_archive'
+        # 分配线程追加写入的租约记录, 每次启动 manager 使用新的文件
+        self.leases_dir = self.base_dir / 'leases'
+        self.lease_log = self.leases_dir / f"{int(time.time() * 1000)}.jsonl"
+        # worker 完成租约后写入的结果, 读取后删除
+        self.completed_dir = self.base_dir / 'completed'
+        # 每个 worker 追加写入自己的输入缓存变化
+        self.locality_dir = self.base_dir / 'locality'
+        # manager 取消的任务, 每个租约一个文件
+        self.cancelled_dir = self.base_dir / 'cancelled'
+        # 发布的租约, 领取时 rename 到领取节点的目录, 同时只有一个节点能成功
+        self.queue_dir = self.base_dir / 'queue'
+        self.claimed_dir = self.base_dir / 'claimed'
+        # 每个 worker 追加写入自己的领取记录
+        self.claims_dir = self.base_dir / 'claims'
+        # 已经创建的分区和节点目录
+        self.created_dirs = set()
+        self.finished_file = self.base_dir / 'finished'
+
+    def initialize(self):
+        for dir in [self.nodes_dir, self.profiles_dir, self.heart_dir, self.heart_archive_dir, self.available_dir, self.leases_dir,
+                    self.completed_dir, self.cancelled_dir, self.locality_dir, self.queue_dir, self.claimed_dir,
+                    self.claims_dir, self.tmp_dir]:
+            dir.mkdir(parents=True, exist_ok=True)
+            print(f"{dir.name}_dir: {dir}")
+        # 上次运行结束时留下的标记, 否则新启动的 worker 会立即退出
+        if self.finished_file.exists():
+            self.finished_file.unlink()
+        # 租约完成前没有被 worker 读到的取消标记
+        for cancelled_file in self.cancelled_dir.iterdir():
+            cancelled_file.unlink(missing_ok=True)
+
+    def missing_parts(self) -> List[str]:
+        return [str(dir) for dir in [self.nodes_dir, self.profiles_dir, self.completed_dir, self.heart_dir, self.available_dir,
+                                     self.tmp_dir] if not dir.exists()]
+
+    def write_json(self, file_path: Path, data: Dict):
+        atomic_write(file_path, json.dumps(data), tmp_dir=self.tmp_dir, fsync=self.fsync)
+
+    def node_file(self, node_id: str) -> Path:
+        return self.nodes_dir / f"{node_id}.status"
+
+    def read_node(self, node_id: str) -> Optional[Dict]:
+        return safe_load_json(self.node_file(node_id))
+
+    def write_node(self, node_id: str, node_info: Dict):
+        self.write_json(self.node_file(node_id), node_info)
+
+    def set_available(self, node_id: str, slots: int):
+        available_file = self.available_dir / node_id
+        if not available_file.exists():
+            self.write_json(available_file, {"slots": slots})
+
+    def clear_available(self, node_id: str):
+        try:
+            (self.available_dir / node_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    def list_available(self) -> List[Tuple[str, int]]:
+        available_nodes = []
+        for available_file in self.available_dir.iterdir():
+            # 节点在 available 文件中声明可以同时执行的任务数
+            try:
+                slots = max(1, int(json.loads(available_file.read_text())["slots"]))
+            except FileNotFoundError:
+                # 节点已经被分配了任务
+                continue
+            except Exception:
+                slots = 1
+            available_nodes.append((available_file.name, slots))
+        return available_nodes
+
+    def write_profile(self, node_id: str, profile: Dict):
+        self.write_json(self.profiles_dir / node_id, profile)
+
+    def read_profiles(self, node_ids: List[str]) -> Dict[str, Dict]:
+        profiles = {}
+        for node_id in node_ids:
+            profile = safe_load_json(self.profiles_dir / node_id)
+            if profile is not None:
+                profiles[node_id] = profile
+        return profiles
+
+    def heart_file(self, node_id: str) -> Path:
+        return self.heart_dir / f"{node_id}.heart"
+
+    def write_heartbeat(self, node_id: str, heart_info: Dict):
+        self.write_json(self.heart_file(node_id), heart_info)
+
+    def read_heartbeat(self, node_id: str) -> Optional[Dict]:
+        return safe_load_json(self.heart_file(node_id))
+
+    def read_changed_heartbeats(self, cursor: Optional[Dict[str, int]] = None
+                                ) -> Tuple[Dict[str, Optional[Dict]], Dict[str, int]]:
+        # cursor: node -> 上次读取时心跳文件的 mtime_ns, 只解析 mtime 变化的文件
+        cursor = cursor or {}
+        new_cursor = {}
+        changed = {}
+        with os.scandir(self.heart_dir) as entries:
+            for entry in entries:
+                node = entry.name.rsplit('.', 1)[0]
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                new_cursor[node] = mtime
+                if cursor.get(node) != mtime:
+                    changed[node] = safe_load_json(Path(entry.path))
+        return changed, new_cursor
+
+    def archive_heartbeat(self, node_id: str):
+        heart_file = self.heart_file(node_id)
+        try:
+            os.replace(heart_file, self.heart_archive_dir / heart_file.name)
+        except FileNotFoundError:
+            pass
+
+    def append_leases(self, lease_records: List[Dict]):
+        append_records(self.lease_log, lease_records, fsync=self.fsync)
+
+    def read_new_leases(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        return read_new_records(self.lease_log, cursor or 0)
+
+    def pop_stale_leases(self) -> List[Dict]:
+        lease_records = []
+        for lease_log in sorted(self.leases_dir.glob("*.jsonl")):
+            if lease_log == self.lease_log:
+                continue
+            records, _ = read_new_records(lease_log)
+            lease_records.extend(records)
+            lease_log.unlink()
+        return lease_records
+
+    def push_completion(self, name: str, completed_info: Dict):
+        self.write_json(self.completed_dir / name, completed_info)
+
+    def pop_completions(self) -> List[Dict]:
+        completions = []
+        for completed_file in list(self.completed_dir.iterdir()):
+            completed_info = safe_load_json(completed_file)
+            if completed_info is None:
+                continue
+            completions.append(completed_info)
+            completed_file.unlink()
+        return completions
+
+    def push_cache_updates(self, node_id: str, updates: List[Dict]):
+        self.locality_dir.mkdir(exist_ok=True)
+        append_records(self.locality_dir / f"{node_id}.jsonl", updates, fsync=self.fsync)
+
+    def read_cache_updates(self, cursor: Optional[Dict[str, int]] = None) -> Tuple[List[Dict], Dict[str, int]]:
+        return self.read_appended(self.locality_dir, cursor)
+
+    def read_appended(self, dir_path: Path, cursor: Optional[Dict[str, int]] = None
+                      ) -> Tuple[List[Dict], Dict[str, int]]:
+        # cursor: 文件名 -> 已经读取的位置, 只读取变大的文件
+        cursor = dict(cursor or {})
+        records = []
+        if not dir_path.exists():
+            return records, cursor
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    size = entry.stat().st_size
+                except FileNotFoundError:
+                    continue
+                if size > cursor.get(entry.name, 0):
+                    new_records, cursor[entry.name] = read_new_records(Path(entry.path), cursor.get(entry.name, 0))
+                    records.extend(new_records)
+        return records, cursor
+
+    def make_dir(self, dir_path: Path) -> Path:
+        if dir_path not in self.created_dirs:
+            dir_path.mkdir(parents=True, exist_ok=True)
+            self.created_dirs.add(dir_path)
+        return dir_path
+
+    def publish_leases(self, leases: List[Dict]):
+        for lease in leases:
+            partition_dir = self.make_dir(self.queue_dir / str(lease["partition"]))
+            self.write_json(partition_dir / f"{lease['seq']:012d}_{lease['lease_id']}", lease)
+
+    def list_published(self, partition: int) -> List[str]:
+        try:
+            return sorted(os.listdir(self.queue_dir / str(partition)))
+        except FileNotFoundError:
+            return []
+
+    def read_published(self, partition: int, entry: str) -> Optional[Dict]:
+        return safe_load_json(self.queue_dir / str(partition) / entry)
+
+    def claim_lease(self, node_id: str, partition: int, entry: str, lease: Dict) -> bool:
+        claimed_file = self.make_dir(self.claimed_dir / node_id) / lease["lease_id"]
+        try:
+            os.rename(self.queue_dir / str(partition) / entry, claimed_file)
+        except FileNotFoundError:
+            # NFS 重传 rename 请求时, 成功的 rename 也可能返回 ENOENT
+            if not claimed_file.exists():
+                return False
+        append_records(self.claims_dir / f"{node_id}.jsonl", [claim_record(node_id, lease)], fsync=self.fsync)
+        return True
+
+    def finish_claim(self, node_id: str, lease_id: str):
+        try:
+            (self.claimed_dir / node_id / lease_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    def pop_claimed(self, node_id: str) -> List[Dict]:
+        claim_records = []
+        node_dir = self.claimed_dir / node_id
+        if not node_dir.exists():
+            return claim_records
+        for claimed_file in list(node_dir.iterdir()):
+            lease = safe_load_json(claimed_file)
+            if lease is not None:
+                claim_records.append(claim_record(node_id, lease, claimed_file.stat().st_mtime))
+            claimed_file.unlink()
+        return claim_records
+
+    def read_claims(self, cursor: Optional[Dict[str, int]] = None) -> Tuple[List[Dict], Dict[str, int]]:
+        return self.read_appended(self.claims_dir, cursor)
+
+    def clear_published(self, stale_claims: bool = False):
+        dirs = [self.queue_dir, self.claimed_dir] if stale_claims else [self.queue_dir]
+        for dir_path in dirs:
+            for lease_file in dir_path.glob("*/*"):
+                lease_file.unlink()
+        if stale_claims:
+            for claims_file in self.claims_dir.glob("*.jsonl"):
+                claims_file.unlink()
+
+    def cancel_tasks(self, lease_id: str, task_names: List[str]):
+        # 只有 manager 写入, 读取后合并不会丢失更新
+        cancelled_file = self.cancelled_dir / lease_id
+        cancelled = safe_load_json(cancelled_file) or {"tasks": []}
+        cancelled["tasks"].extend(task_name for task_name in task_names if task_name not in cancelled["tasks"])
+        self.write_json(cancelled_file, cancelled)
+
+    def read_cancelled(self, lease_id: str) -> List[str]:
+        cancelled = safe_load_json(self.cancelled_dir / lease_id)
+        return [] if cancelled is None else cancelled["tasks"]
+
+    def clear_cancelled(self, lease_id: str):
+        (self.cancelled_dir / lease_id).unlink(missing_ok=True)
+
+    def set_finished(self):
+        if not self.finished_file.exists():
+            self.finished_file.touch()
+
+    def is_finished(self) -> bool:
+        return self.finished_file.exists()
+
+    def watcher(self, role: str, node_id: Optional[str] = None) -> Optional[DirWatcher]:
+        if role == "manager":
+            return DirWatcher([self.completed_dir, self.leases_dir, self.claims_dir])
+        if role == "assigner":
+            return DirWatcher([self.available_dir])
+        if role == "worker":
+            return DirWatcher([self.nodes_dir], names={self.node_file(node_id).name})
+        return None
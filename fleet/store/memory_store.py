@@ -0,0 +1,189 @@
+import threading
+from copy import deepcopy
+from typing import Dict, List, Optional, Tuple
+
+from fleet.store.base import CoordinationStore, claim_record
+
+
+class MemoryStore(CoordinationStore):
+    """Keep the coordination state in the memory of one process, served to other processes by the TCP broker.
+
+    The state is lost when the process exits, so unlike FileStore and SqliteStore there are never stale leases
+    to recover after a manager restart.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.profiles = {}
+        self.available = {}
+        # node -> (seq, heart_info)
+        self.heartbeats = {}
+        self.heartbeat_seq = 0
+        self.leases = []
+        # self.leases 中第一条记录的序号
+        self.leases_start = 0
+        self.completions = []
+        self.cache_updates = []
+        # self.cache_updates 中第一条记录的序号
+        self.cache_updates_start = 0
+        # 分区 -> lease_id -> 发布的租约, 节点 -> lease_id -> 领取的租约
+        self.published = {}
+        self.claimed = {}
+        self.claims = []
+        # lease_id -> 取消的任务
+        self.cancelled = {}
+        self.finished = False
+
+    def initialize(self):
+        pass
+
+    def missing_parts(self) -> List[str]:
+        return []
+
+    def read_node(self, node_id: str) -> Optional[Dict]:
+        with self.lock:
+            return deepcopy(self.nodes.get(node_id))
+
+    def write_node(self, node_id: str, node_info: Dict):
+        with self.lock:
+            self.nodes[node_id] = node_info
+
+    def set_available(self, node_id: str, slots: int):
+        with self.lock:
+            self.available[node_id] = slots
+
+    def clear_available(self, node_id: str):
+        with self.lock:
+            self.available.pop(node_id, None)
+
+    def list_available(self) -> List[Tuple[str, int]]:
+        with self.lock:
+            return [(node_id, max(1, slots)) for node_id, slots in self.available.items()]
+
+    def write_profile(self, node_id: str, profile: Dict):
+        with self.lock:
+            self.profiles[node_id] = profile
+
+    def read_profiles(self, node_ids: List[str]) -> Dict[str, Dict]:
+        with self.lock:
+            return {node_id: deepcopy(self.profiles[node_id]) for node_id in node_ids if node_id in self.profiles}
+
+    def write_heartbeat(self, node_id: str, heart_info: Dict):
+        with self.lock:
+            self.heartbeat_seq += 1
+            self.heartbeats[node_id] = (self.heartbeat_seq, heart_info)
+
+    def read_heartbeat(self, node_id: str) -> Optional[Dict]:
+        with self.lock:
+            heartbeat = self.heartbeats.get(node_id)
+            return None if heartbeat is None else deepcopy(heartbeat[1])
+
+    def read_changed_heartbeats(self, cursor: Optional[int] = None) -> Tuple[Dict[str, Optional[Dict]], int]:
+        cursor = cursor or 0
+        with self.lock:
+            changed = {node_id: deepcopy(heart_info) for node_id, (seq, heart_info) in self.heartbeats.items()
+                       if seq > cursor}
+            return changed, self.heartbeat_seq
+
+    def archive_heartbeat(self, node_id: str):
+        with self.lock:
+            self.heartbeats.pop(node_id, None)
+
+    def append_leases(self, lease_records: List[Dict]):
+        with self.lock:
+            self.leases.extend(lease_records)
+
+    def read_new_leases(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        cursor = cursor or 0
+        with self.lock:
+            # 只有 manager 读取租约记录, 读过的记录可以丢弃
+            lease_records = self.leases[max(0, cursor - self.leases_start):]
+            self.leases_start += len(self.leases)
+            self.leases = []
+            return lease_records, self.leases_start
+
+    def pop_stale_leases(self) -> List[Dict]:
+        return []
+
+    def push_completion(self, name: str, completed_info: Dict):
+        with self.lock:
+            self.completions.append(completed_info)
+
+    def pop_completions(self) -> List[Dict]:
+        with self.lock:
+            completions, self.completions = self.completions, []
+            return completions
+
+    def push_cache_updates(self, node_id: str, updates: List[Dict]):
+        with self.lock:
+            self.cache_updates.extend(updates)
+
+    def read_cache_updates(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        cursor = cursor or 0
+        with self.lock:
+            # 只有分配线程读取缓存变化, 读过的记录可以丢弃
+            updates = self.cache_updates[max(0, cursor - self.cache_updates_start):]
+            self.cache_updates_start += len(self.cache_updates)
+            self.cache_updates = []
+            return updates, self.cache_updates_start
+
+    def publish_leases(self, leases: List[Dict]):
+        with self.lock:
+            for lease in leases:
+                self.published.setdefault(lease["partition"], {})[lease["lease_id"]] = lease
+
+    def list_published(self, partition: int) -> List[str]:
+        with self.lock:
+            return list(self.published.get(partition, {}))
+
+    def read_published(self, partition: int, entry: str) -> Optional[Dict]:
+        with self.lock:
+            return deepcopy(self.published.get(partition, {}).get(entry))
+
+    def claim_lease(self, node_id: str, partition: int, entry: str, lease: Dict) -> bool:
+        with self.lock:
+            lease = self.published.get(partition, {}).pop(entry, None)
+            if lease is None:
+                return False
+            self.claimed.setdefault(node_id, {})[lease["lease_id"]] = lease
+            self.claims.append(claim_record(node_id, lease))
+            return True
+
+    def finish_claim(self, node_id: str, lease_id: str):
+        with self.lock:
+            self.claimed.get(node_id, {}).pop(lease_id, None)
+
+    def pop_claimed(self, node_id: str) -> List[Dict]:
+        with self.lock:
+            return [claim_record(node_id, lease) for lease in self.claimed.pop(node_id, {}).values()]
+
+    def read_claims(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        cursor = cursor or 0
+        with self.lock:
+            return self.claims[cursor:], len(self.claims)
+
+    def clear_published(self, stale_claims: bool = False):
+        with self.lock:
+            self.published = {}
+            if stale_claims:
+                self.claimed = {}
+                self.claims = []
+
+    def cancel_tasks(self, lease_id: str, task_names: List[str]):
+        with self.lock:
+            self.cancelled.setdefault(lease_id, set()).update(task_names)
+
+    def read_cancelled(self, lease_id: str) -> List[str]:
+        with self.lock:
+            return list(self.cancelled.get(lease_id, []))
+
+    def clear_cancelled(self, lease_id: str):
+        with self.lock:
+            self.cancelled.pop(lease_id, None)
+
+    def set_finished(self):
+        self.finished = True
+
+    def is_finished(self) -> bool:
+        return self.finished
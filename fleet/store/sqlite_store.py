@@ -0,0 +1,254 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from fleet.store.base import CoordinationStore, claim_record
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, info TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS profiles (node_id TEXT PRIMARY KEY, profile TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS available (node_id TEXT PRIMARY KEY, slots INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS heartbeats (node_id TEXT PRIMARY KEY, info TEXT NOT NULL, seq INTEGER NOT NULL,
+                                       archived INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS heartbeats_seq ON heartbeats (seq);
+CREATE TABLE IF NOT EXISTS leases (seq INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS completions (seq INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS cache_updates (seq INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS published (seq INTEGER PRIMARY KEY AUTOINCREMENT, lease_id TEXT NOT NULL UNIQUE,
+                                      part INTEGER NOT NULL, lease TEXT NOT NULL, claimed_by TEXT);
+CREATE INDEX IF NOT EXISTS published_part ON published (part, claimed_by, seq);
+CREATE TABLE IF NOT EXISTS claims (seq INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS cancelled (lease_id TEXT NOT NULL, task TEXT NOT NULL, PRIMARY KEY (lease_id, task));
+CREATE TABLE IF NOT EXISTS flags (name TEXT PRIMARY KEY);
+"""
+
+
+class SqliteStore(CoordinationStore):
+    """Coordinate through one SQLite database in WAL mode, for runs where all nodes are on the same host.
+
+    SQLite locking is not reliable on network file systems, use FileStore or TcpStore across hosts.
+    Every write is one transaction; `fsync` other than "none" makes them durable across power loss.
+    """
+
+    shares_base_dir = True
+
+    def __init__(self, db_path: Union[str, Path], busy_timeout: float = 60, fsync: str = "none"):
+        self.db_path = Path(db_path)
+        self.busy_timeout = busy_timeout
+        self.fsync = fsync
+        self.local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # 每个进程 (心跳进程是 fork 出来的) 和线程 (包括分配线程) 使用自己的连接
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(str(self.db_path), timeout=self.busy_timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # WAL 模式下 NORMAL 不会损坏数据库, 只是断电时可能丢失最后的事务
+            connection.execute(f"PRAGMA synchronous={'NORMAL' if self.fsync == 'none' else 'FULL'}")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def initialize(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection.executescript(SCHEMA)
+        # 上次运行结束时留下的标记, 否则新启动的 worker 会立即退出
+        self.connection.execute("DELETE FROM flags WHERE name = 'finished'")
+        self.connection.execute("DELETE FROM cancelled")
+        print(f"sqlite store: {self.db_path}")
+
+    def close(self):
+        if getattr(self.local, "pid", None) == os.getpid():
+            self.local.connection.close()
+            self.local.pid = None
+
+    def missing_parts(self) -> List[str]:
+        if not self.db_path.exists():
+            return [str(self.db_path)]
+        tables = {row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return [f"{self.db_path}:{table}" for table in ["nodes", "profiles", "available", "heartbeats", "leases", "completions",
+                                                        "cache_updates", "published", "claims", "cancelled",
+                                                        "flags"] if table not in tables]
+
+    def read_node(self, node_id: str) -> Optional[Dict]:
+        row = self.connection.execute("SELECT info FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def write_node(self, node_id: str, node_info: Dict):
+        self.connection.execute("INSERT OR REPLACE INTO nodes (node_id, info) VALUES (?, ?)",
+                                (node_id, json.dumps(node_info)))
+
+    def set_available(self, node_id: str, slots: int):
+        self.connection.execute("INSERT OR REPLACE INTO available (node_id, slots) VALUES (?, ?)", (node_id, slots))
+
+    def clear_available(self, node_id: str):
+        self.connection.execute("DELETE FROM available WHERE node_id = ?", (node_id,))
+
+    def list_available(self) -> List[Tuple[str, int]]:
+        return [(node_id, max(1, slots)) for node_id, slots in
+                self.connection.execute("SELECT node_id, slots FROM available")]
+
+    def write_profile(self, node_id: str, profile: Dict):
+        self.connection.execute("INSERT OR REPLACE INTO profiles (node_id, profile) VALUES (?, ?)",
+                                (node_id, json.dumps(profile)))
+
+    def read_profiles(self, node_ids: List[str]) -> Dict[str, Dict]:
+        profiles = {}
+        # sqlite 默认最多 999 个参数
+        for start in range(0, len(node_ids), 500):
+            chunk = node_ids[start:start + 500]
+            for node_id, profile in self.connection.execute(
+                    f"SELECT node_id, profile FROM profiles WHERE node_id IN ({', '.join('?' * len(chunk))})",
+                    chunk):
+                profiles[node_id] = json.loads(profile)
+        return profiles
+
+    def write_heartbeat(self, node_id: str, heart_info: Dict):
+        # seq 单调递增, manager 只读取 seq 大于上次读取位置的心跳
+        self.connection.execute(
+            "INSERT OR REPLACE INTO heartbeats (node_id, info, seq, archived) "
+            "VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM heartbeats), 0)",
+            (node_id, json.dumps(heart_info)))
+
+    def read_heartbeat(self, node_id: str) -> Optional[Dict]:
+        row = self.connection.execute("SELECT info FROM heartbeats WHERE node_id = ? AND archived = 0",
+                                      (node_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def read_changed_heartbeats(self, cursor: Optional[int] = None) -> Tuple[Dict[str, Optional[Dict]], int]:
+        cursor = cursor or 0
+        changed = {}
+        for node_id, info, seq in self.connection.execute(
+                "SELECT node_id, info, seq FROM heartbeats WHERE seq > ? AND archived = 0", (cursor,)):
+            changed[node_id] = json.loads(info)
+            cursor = max(cursor, seq)
+        return changed, cursor
+
+    def archive_heartbeat(self, node_id: str):
+        self.connection.execute("UPDATE heartbeats SET archived = 1 WHERE node_id = ?", (node_id,))
+
+    def append_leases(self, lease_records: List[Dict]):
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT INTO leases (record) VALUES (?)",
+                                   [(json.dumps(record),) for record in lease_records])
+
+    def read_new_leases(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        cursor = cursor or 0
+        lease_records = []
+        for seq, record in self.connection.execute("SELECT seq, record FROM leases WHERE seq > ? ORDER BY seq",
+                                                   (cursor,)):
+            lease_records.append(json.loads(record))
+            cursor = seq
+        return lease_records, cursor
+
+    def pop_stale_leases(self) -> List[Dict]:
+        # 只在分配线程启动前调用, 此时表中的记录都来自上次运行
+        lease_records, _ = self.read_new_leases()
+        self.connection.execute("DELETE FROM leases")
+        return lease_records
+
+    def push_completion(self, name: str, completed_info: Dict):
+        self.connection.execute("INSERT INTO completions (record) VALUES (?)", (json.dumps(completed_info),))
+
+    def pop_completions(self) -> List[Dict]:
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute("SELECT seq, record FROM completions ORDER BY seq").fetchall()
+            if rows:
+                connection.execute("DELETE FROM completions WHERE seq <= ?", (rows[-1][0],))
+        return [json.loads(record) for _, record in rows]
+
+    def push_cache_updates(self, node_id: str, updates: List[Dict]):
+        self.connection.executemany("INSERT INTO cache_updates (record) VALUES (?)",
+                                    [(json.dumps(update),) for update in updates])
+
+    def read_cache_updates(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        cursor = cursor or 0
+        updates = []
+        for seq, record in self.connection.execute(
+                "SELECT seq, record FROM cache_updates WHERE seq > ? ORDER BY seq", (cursor,)):
+            updates.append(json.loads(record))
+            cursor = seq
+        return updates, cursor
+
+    def publish_leases(self, leases: List[Dict]):
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT INTO published (lease_id, part, lease) VALUES (?, ?, ?)",
+                                   [(lease["lease_id"], lease["partition"], json.dumps(lease)) for lease in leases])
+
+    def list_published(self, partition: int) -> List[str]:
+        return [row[0] for row in self.connection.execute(
+            "SELECT lease_id FROM published WHERE part = ? AND claimed_by IS NULL ORDER BY seq", (partition,))]
+
+    def read_published(self, partition: int, entry: str) -> Optional[Dict]:
+        row = self.connection.execute("SELECT lease FROM published WHERE lease_id = ? AND claimed_by IS NULL",
+                                      (entry,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def claim_lease(self, node_id: str, partition: int, entry: str, lease: Dict) -> bool:
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            claimed = connection.execute("UPDATE published SET claimed_by = ? WHERE lease_id = ? AND claimed_by IS NULL",
+                                         (node_id, entry)).rowcount == 1
+            if claimed:
+                connection.execute("INSERT INTO claims (record) VALUES (?)", (json.dumps(claim_record(node_id, lease)),))
+        return claimed
+
+    def finish_claim(self, node_id: str, lease_id: str):
+        self.connection.execute("DELETE FROM published WHERE lease_id = ? AND claimed_by = ?", (lease_id, node_id))
+
+    def pop_claimed(self, node_id: str) -> List[Dict]:
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute("SELECT lease FROM published WHERE claimed_by = ?", (node_id,)).fetchall()
+            connection.execute("DELETE FROM published WHERE claimed_by = ?", (node_id,))
+        # 领取时间记录在 claims 表中, 这里只用于把任务标记为崩溃
+        return [claim_record(node_id, json.loads(lease)) for lease, in rows]
+
+    def read_claims(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        cursor = cursor or 0
+        claim_records = []
+        for seq, record in self.connection.execute("SELECT seq, record FROM claims WHERE seq > ? ORDER BY seq",
+                                                   (cursor,)):
+            claim_records.append(json.loads(record))
+            cursor = seq
+        return claim_records, cursor
+
+    def clear_published(self, stale_claims: bool = False):
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if stale_claims:
+                connection.execute("DELETE FROM published")
+                connection.execute("DELETE FROM claims")
+            else:
+                connection.execute("DELETE FROM published WHERE claimed_by IS NULL")
+
+    def cancel_tasks(self, lease_id: str, task_names: List[str]):
+        self.connection.executemany("INSERT OR IGNORE INTO cancelled (lease_id, task) VALUES (?, ?)",
+                                    [(lease_id, task_name) for task_name in task_names])
+
+    def read_cancelled(self, lease_id: str) -> List[str]:
+        return [row[0] for row in self.connection.execute("SELECT task FROM cancelled WHERE lease_id = ?",
+                                                          (lease_id,))]
+
+    def clear_cancelled(self, lease_id: str):
+        self.connection.execute("DELETE FROM cancelled WHERE lease_id = ?", (lease_id,))
+
+    def set_finished(self):
+        self.connection.execute("INSERT OR IGNORE INTO flags (name) VALUES ('finished')")
+
+    def is_finished(self) -> bool:
+        return self.connection.execute("SELECT 1 FROM flags WHERE name = 'finished'").fetchone() is not None
@@ -0,0 +1,270 @@
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import socketserver
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from fleet.store.base import CoordinationStore, StoreUnavailableError
+from fleet.store.memory_store import MemoryStore
+
+# 可以通过 TCP 调用的 MemoryStore 方法
+REMOTE_METHODS = {
+    "read_node", "write_node", "write_profile", "read_profiles", "set_available", "clear_available", "list_available",
+    "write_heartbeat", "read_heartbeat", "read_changed_heartbeats", "archive_heartbeat", "append_leases",
+    "read_new_leases", "pop_stale_leases", "push_completion", "pop_completions", "push_cache_updates",
+    "read_cache_updates", "publish_leases", "list_published", "read_published", "claim_lease", "finish_claim",
+    "pop_claimed", "read_claims", "clear_published", "cancel_tasks", "read_cancelled", "clear_cancelled",
+    "set_finished", "is_finished",
+}
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # 第一行是认证请求 {"token"}, 令牌不对时关闭连接
+        if not self.authenticate():
+            return
+        # 之后每行一个 JSON 请求 {"method", "args"}, 返回一行 {"result"} 或 {"error"}
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request["method"] not in REMOTE_METHODS:
+                    raise ValueError(f"unknown method {request['method']}")
+                result = getattr(self.server.store, request["method"])(*request["args"])
+                response = {"result": result}
+            except Exception as e:
+                response = {"error": repr(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+    def authenticate(self) -> bool:
+        try:
+            token = json.loads(self.rfile.readline()).get("token") or ""
+        except (ValueError, AttributeError):
+            token = ""
+        if not hmac.compare_digest(token.encode(), (self.server.token or "").encode()):
+            self.wfile.write(json.dumps({"error": "invalid store token"}).encode() + b"\n")
+            self.wfile.flush()
+            return False
+        self.wfile.write(json.dumps({"result": True}).encode() + b"\n")
+        self.wfile.flush()
+        return True
+
+
+class StoreBroker(socketserver.ThreadingTCPServer):
+    """Serve a MemoryStore over TCP, run in a thread of the manager process.
+
+    Clients must present `token` on every connection; without a token only empty tokens are accepted.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, token: Optional[str] = None):
+        super().__init__((host, port), BrokerHandler)
+        self.store = MemoryStore()
+        self.token = token
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TcpStore(CoordinationStore):
+    """Coordinate through a broker run by the manager, for clusters with a working network.
+
+    The manager binds `host:port`, workers connect to the manager host. Binding a non-loopback address needs
+    `allow_remote` and a `token`, which every client sends when it connects. The broker keeps everything in memory;
+    the manager journal under base_dir is still the source of truth.
+    """
+
+    def __init__(self, host: str, port: int, connect_timeout: float = 10, token: Optional[str] = None,
+                 allow_remote: bool = False):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.token = token
+        self.allow_remote = allow_remote
+        self.broker = None
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        # 每个进程和线程使用自己的连接
+        if getattr(self.local, "pid", None) != os.getpid():
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+            except OSError as e:
+                raise StoreUnavailableError(f"can not connect to broker {self.host}:{self.port}: {e}")
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = sock.makefile("rwb")
+            try:
+                connection.write(json.dumps({"token": self.token or ""}).encode() + b"\n")
+                connection.flush()
+                line = connection.readline()
+            except OSError as e:
+                connection.close()
+                raise StoreUnavailableError(f"can not authenticate to broker {self.host}:{self.port}: {e}")
+            if not line or "error" in json.loads(line):
+                connection.close()
+                # 令牌错误不是暂时的不可用, 不再重试
+                raise PermissionError(f"broker {self.host}:{self.port} refused the store token, check --store_token")
+            sock.settimeout(None)
+            self.local.file = connection
+            self.local.pid = os.getpid()
+        return self.local.file
+
+    def call(self, method: str, *args):
+        connection = self.connection
+        try:
+            connection.write(json.dumps({"method": method, "args": args}).encode() + b"\n")
+            connection.flush()
+            line = connection.readline()
+        except OSError as e:
+            self.local.pid = None
+            raise StoreUnavailableError(f"lost connection to broker {self.host}:{self.port}: {e}")
+        if not line:
+            self.local.pid = None
+            raise StoreUnavailableError(f"broker {self.host}:{self.port} closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"broker error in {method}: {response['error']}")
+        return response["result"]
+
+    def initialize(self):
+        if not is_loopback(self.host):
+            if not self.allow_remote:
+                raise ValueError(f"the tcp store broker would accept connections from other hosts on {self.host}, "
+                                 f"pass --store_allow_remote (with --store_token) to allow it")
+            if not self.token:
+                raise ValueError("--store_token (or FLEET_STORE_TOKEN) is required to bind the tcp store broker on "
+                                 f"{self.host}")
+        self.broker = StoreBroker(self.host, self.port, self.token)
+        self.broker.start()
+        print(f"tcp store broker: {self.host}:{self.port}")
+
+    def close(self):
+        if getattr(self.local, "pid", None) == os.getpid():
+            self.local.file.close()
+            self.local.pid = None
+        if self.broker is not None and self.broker.thread is not None:
+            self.broker.stop()
+            self.broker = None
+
+    def missing_parts(self) -> List[str]:
+        try:
+            self.connection
+        except StoreUnavailableError:
+            return [f"tcp broker {self.host}:{self.port}"]
+        return []
+
+    def read_node(self, node_id: str) -> Optional[Dict]:
+        return self.call("read_node", node_id)
+
+    def write_node(self, node_id: str, node_info: Dict):
+        self.call("write_node", node_id, node_info)
+
+    def set_available(self, node_id: str, slots: int):
+        self.call("set_available", node_id, slots)
+
+    def clear_available(self, node_id: str):
+        self.call("clear_available", node_id)
+
+    def list_available(self) -> List[Tuple[str, int]]:
+        return [tuple(node) for node in self.call("list_available")]
+
+    def write_profile(self, node_id: str, profile: Dict):
+        self.call("write_profile", node_id, profile)
+
+    def read_profiles(self, node_ids: List[str]) -> Dict[str, Dict]:
+        return self.call("read_profiles", node_ids)
+
+    def write_heartbeat(self, node_id: str, heart_info: Dict):
+        self.call("write_heartbeat", node_id, heart_info)
+
+    def read_heartbeat(self, node_id: str) -> Optional[Dict]:
+        return self.call("read_heartbeat", node_id)
+
+    def read_changed_heartbeats(self, cursor: Optional[int] = None) -> Tuple[Dict[str, Optional[Dict]], int]:
+        changed, cursor = self.call("read_changed_heartbeats", cursor)
+        return changed, cursor
+
+    def archive_heartbeat(self, node_id: str):
+        self.call("archive_heartbeat", node_id)
+
+    def append_leases(self, lease_records: List[Dict]):
+        self.call("append_leases", lease_records)
+
+    def read_new_leases(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        lease_records, cursor = self.call("read_new_leases", cursor)
+        return lease_records, cursor
+
+    def pop_stale_leases(self) -> List[Dict]:
+        return self.call("pop_stale_leases")
+
+    def push_completion(self, name: str, completed_info: Dict):
+        self.call("push_completion", name, completed_info)
+
+    def pop_completions(self) -> List[Dict]:
+        return self.call("pop_completions")
+
+    def push_cache_updates(self, node_id: str, updates: List[Dict]):
+        self.call("push_cache_updates", node_id, updates)
+
+    def read_cache_updates(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        updates, cursor = self.call("read_cache_updates", cursor)
+        return updates, cursor
+
+    def publish_leases(self, leases: List[Dict]):
+        self.call("publish_leases", leases)
+
+    def list_published(self, partition: int) -> List[str]:
+        return self.call("list_published", partition)
+
+    def read_published(self, partition: int, entry: str) -> Optional[Dict]:
+        return self.call("read_published", partition, entry)
+
+    def claim_lease(self, node_id: str, partition: int, entry: str, lease: Dict) -> bool:
+        return self.call("claim_lease", node_id, partition, entry, lease)
+
+    def finish_claim(self, node_id: str, lease_id: str):
+        self.call("finish_claim", node_id, lease_id)
+
+    def pop_claimed(self, node_id: str) -> List[Dict]:
+        return self.call("pop_claimed", node_id)
+
+    def read_claims(self, cursor: Optional[int] = None) -> Tuple[List[Dict], int]:
+        claim_records, cursor = self.call("read_claims", cursor)
+        return claim_records, cursor
+
+    def clear_published(self, stale_claims: bool = False):
+        self.call("clear_published", stale_claims)
+
+    def cancel_tasks(self, lease_id: str, task_names: List[str]):
+        self.call("cancel_tasks", lease_id, task_names)
+
+    def read_cancelled(self, lease_id: str) -> List[str]:
+        return self.call("read_cancelled", lease_id)
+
+    def clear_cancelled(self, lease_id: str):
+        self.call("clear_cancelled", lease_id)
+
+    def set_finished(self):
+        self.call("set_finished")
+
+    def is_finished(self) -> bool:
+        return self.call("is_finished")
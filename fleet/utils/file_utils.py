@@ -1,18 +1,66 @@
 import json
+import os
 import time
+import uuid
 from pathlib import Path
+from typing import Optional, Union
 
+# none: 不调用 fsync; data: rename 或追加前 fsync 文件; full: 同时 fsync 所在目录
+FSYNC_POLICIES = ["none", "data", "full"]
 
-def safe_load_json(file_path: Path, max_retry_times: int = 20):
+
+def safe_load_json(file_path: Path, max_retry_times: int = 3, retry_interval: float = 0.01):
+    """Load a JSON file, return None if it is missing or can not be parsed.
+
+    Protocol files are replaced atomically (see `atomic_write`), so a failed read is only retried a few times
+    for network file systems that briefly return stale handles.
+    """
     retry_time = 0
     while True:
         try:
             retry_time += 1
             data = json.loads(file_path.read_text())
             return data
+        except FileNotFoundError:
+            return None
         except Exception as e:
-            if retry_time>3:
-                print(f"Failed to load json file {file_path}, retry_time: {retry_time}")
             if retry_time >= max_retry_times:
+                print(f"Failed to load json file {file_path}: {e}")
                 return None
-            time.sleep(1)
+            time.sleep(retry_interval)
+
+
+def fsync_dir(dir_path: Path):
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(file_path: Path, data: Union[str, bytes], tmp_dir: Optional[Path] = None, fsync: str = "none"):
+    """Write `data` to a temp file in `tmp_dir` and rename it to `file_path`, readers never see a partial file.
+
+    `tmp_dir` must be on the same file system as `file_path`, it defaults to the directory of `file_path`.
+    """
+    file_path = Path(file_path)
+    tmp_dir = file_path.parent if tmp_dir is None else Path(tmp_dir)
+    # 不同节点可能同时写同一个文件, 临时文件名不能只依赖 pid
+    tmp_file = tmp_dir / f".{file_path.name}.{uuid.uuid4().hex}.tmp"
+    if isinstance(data, str):
+        data = data.encode()
+    try:
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+            if fsync != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, file_path)
+    except BaseException:
+        try:
+            tmp_file.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+    if fsync == "full":
+        fsync_dir(file_path.parent)
@@ -1,4 +1,6 @@
+import os
 import subprocess
+from typing import Dict, Optional
 
 
 def get_hostname():
@@ -17,3 +19,49 @@ def get_ip_address():
         return result.stdout.strip()  # 去除多余的换行符
     else:
         return "Error: " + result.stderr
+
+
+def get_cpu_count() -> int:
+    # 只统计当前进程可以使用的 cpu (例如容器或 taskset 的限制)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_memory_gb() -> float:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return round(int(line.split()[1]) / 1024 / 1024, 1)
+    except OSError:
+        pass
+    try:
+        return round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3, 1)
+    except (ValueError, OSError, AttributeError):
+        return 0.0
+
+
+def parse_resources(text: Optional[str]) -> Dict[str, float]:
+    """Parse "name=value,..." (e.g. "gpus=2,memory_gb=64") into numeric resources."""
+    resources = {}
+    for item in (text or "").split(","):
+        if item.strip():
+            name, value = item.split("=", 1)
+            resources[name.strip()] = float(value)
+    return resources
+
+
+def get_host_profile(resources: Optional[str] = None, tags: Optional[str] = None) -> Dict:
+    """Resources and tags a worker advertises when it registers.
+
+    `cpus` and `memory_gb` are detected, `resources` ("name=value,...") adds or overrides resources and `tags`
+    ("a,b") adds labels.
+    """
+    host_resources = {"cpus": get_cpu_count(), "memory_gb": get_memory_gb()}
+    host_resources.update(parse_resources(resources))
+    return {
+        "hostname": get_hostname(),
+        "resources": host_resources,
+        "tags": sorted({tag.strip() for tag in (tags or "").split(",") if tag.strip()}),
+    }
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Set, Union
+
+
+def input_key_hash(key: Union[str, Path]) -> str:
+    """Short hash of an input key, used as the cache file name and reported to the assigner."""
+    return hashlib.sha256(str(key).encode()).hexdigest()[:16]
+
+
+class InputCache:
+    """Host-local copies of input files read from shared storage, shared by all workers on the host.
+
+    Files are stored under `cache_dir/<hash[:2]>/<hash>` and copied in through a temporary file and a rename, so
+    concurrent workers never see a partial copy. Hits refresh the mtime; when the cache grows over `max_size`
+    bytes the least recently used files are removed, except those used in the last `grace_period` seconds, which
+    a job may still be about to open. The size is tracked in memory between scans of the cache directory; it is
+    rescanned when the tracked size crosses `max_size`, and every `rescan_interval` copies to account for the
+    files added by the other workers of the host. Eviction goes down to `low_watermark` of `max_size`, so a full
+    cache is not rescanned on every miss.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_size: Optional[int] = None, grace_period: float = 60,
+                 rescan_interval: int = 100, low_watermark: float = 0.9):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.grace_period = grace_period
+        self.rescan_interval = rescan_interval
+        self.low_watermark = low_watermark
+        self.tmp_dir = self.cache_dir / 'tmp'
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        # 上次扫描后的缓存大小加上之后复制的文件, 第一次复制时扫描
+        self.total_size = None
+        self.copies_since_scan = 0
+        # 上次扫描时宽限期内的文件使缓存仍然超出上限, 等到下次定期扫描
+        self.over_limit = False
+
+    def entry_path(self, key_hash: str) -> Path:
+        return self.cache_dir / key_hash[:2] / key_hash
+
+    def fetch(self, key: Union[str, Path], source: Optional[Union[str, Path]] = None) -> Path:
+        """Return the local path of `key`, copying `source` (the key itself by default) in on a miss."""
+        entry_path = self.entry_path(input_key_hash(key))
+        try:
+            os.utime(entry_path)
+            return entry_path
+        except FileNotFoundError:
+            pass
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.tmp_dir / f"{entry_path.name}.{uuid.uuid4().hex}"
+        shutil.copyfile(source or key, tmp_path)
+        size = os.stat(tmp_path).st_size
+        os.replace(tmp_path, entry_path)
+        if self.max_size is not None:
+            self.copies_since_scan += 1
+            if self.total_size is not None:
+                self.total_size += size
+            if (self.total_size is None or self.copies_since_scan >= self.rescan_interval
+                    or (self.total_size > self.max_size and not self.over_limit)):
+                self.evict()
+        return entry_path
+
+    def evict(self) -> int:
+        entries = []
+        for entry_path in self.cache_dir.glob("??/*"):
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total_size = sum(size for _, size, _ in entries)
+        # 超出上限时一次删除到低水位
+        target_size = self.max_size if total_size <= self.max_size else self.max_size * self.low_watermark
+        removed = 0
+        current_time = time.time()
+        for mtime, size, entry_path in sorted(entries):
+            if total_size <= target_size or current_time - mtime < self.grace_period:
+                break
+            try:
+                entry_path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            removed += 1
+        self.total_size = total_size
+        self.copies_since_scan = 0
+        self.over_limit = total_size > self.max_size
+        return removed
+
+    def cached_keys(self) -> Set[str]:
+        """Hashes of the inputs currently in the cache."""
+        return {entry_path.name for entry_path in self.cache_dir.glob("??/*")}
+
+
+# worker 进程中配置的输入缓存, 由 runner 子进程继承
+_input_cache: Optional[InputCache] = None
+
+
+def set_input_cache(input_cache: Optional[InputCache]):
+    global _input_cache
+    _input_cache = input_cache
+
+
+def get_input_cache() -> Optional[InputCache]:
+    return _input_cache
+
+
+def fetch_input(key: Union[str, Path], source: Optional[Union[str, Path]] = None) -> Path:
+    """Local path of a shared input file, for job functions.
+
+    Goes through the worker's `--input_cache_dir` if it is set, otherwise returns the shared path unchanged. Use the
+    same key as in `Job(inputs=[...])` so the assigner can send the task to a host that has it.
+    """
+    if _input_cache is None:
+        return Path(source or key)
+    return _input_cache.fetch(key, source)
@@ -0,0 +1,178 @@
+import json
+import os
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fleet.utils.file_utils import atomic_write, fsync_dir
+from fleet.utils.task_table import TaskTable
+
+
+def encode_record(record: Dict) -> str:
+    # 每行: crc32 (8 位十六进制) + 空格 + json
+    data = json.dumps(record)
+    return f"{zlib.crc32(data.encode()):08x} {data}\n"
+
+
+def decode_record(line: str) -> Dict:
+    """Decode one line written by `encode_record`, raise ValueError if it is corrupted."""
+    checksum, data = line.rstrip("\n").split(" ", 1)
+    if int(checksum, 16) != zlib.crc32(data.encode()):
+        raise ValueError("checksum mismatch")
+    return json.loads(data)
+
+
+def append_records(file_path: Path, records: List[Dict], chunk_records: int = 10000, fsync: str = "none") -> int:
+    # 以追加方式写入 json lines, 返回写入后的文件大小
+    with open(file_path, "a") as f:
+        for start in range(0, len(records), chunk_records):
+            chunk = records[start:start + chunk_records]
+            f.write("".join(encode_record(record) for record in chunk))
+        if fsync != "none":
+            f.flush()
+            os.fsync(f.fileno())
+        return f.tell()
+
+
+def read_new_records(file_path: Path, offset: int = 0) -> Tuple[List[Dict], int]:
+    """Read the complete records appended to `file_path` after `offset`, return them with the new offset."""
+    if not file_path.exists():
+        return [], offset
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    # 最后一行可能还没写完, 留到下次读取
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].decode().splitlines():
+        if not line:
+            continue
+        try:
+            records.append(decode_record(line))
+        except ValueError:
+            print(f"Skip broken record in {file_path}")
+    return records, offset + end
+
+
+class Journal:
+    """Append-only task journal stored as numbered segment files plus a checkpoint.
+
+    Only one process (the manager) appends to a journal. Every record carries a crc32, so a record torn by a crash
+    is skipped on load instead of being misread.
+
+    The state is loaded into a TaskTable, whose task inputs are kept in `inputs.jsonl` of the journal and referred
+    to by offset from the records. A checkpoint holds the compact table at a position (segment, offset) of the
+    journal and summary data of the manager. Loading replays only the records after that position; `replayed` maps
+    the tasks they changed to their status in the checkpoint (None for new tasks).
+    """
+
+    def __init__(self, journal_dir: Path, segment_size: int = 64 * 1024 * 1024, chunk_records: int = 10000,
+                 fsync: str = "none"):
+        self.journal_dir = Path(journal_dir)
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.checkpoint_file = self.journal_dir / "checkpoint.json"
+        self.input_file = self.journal_dir / "inputs.jsonl"
+        # 运行参数 (例如 serializer), 恢复运行时必须一致
+        self.meta_file = self.journal_dir / "meta.json"
+        self.segment_size = segment_size
+        self.chunk_records = chunk_records
+        self.fsync = fsync
+
+        segments = self.list_segments()
+        self.segment_index = segments[-1] if segments else 1
+        self.close_broken_tail()
+        segment_path = self.segment_path(self.segment_index)
+        self.segment_offset = segment_path.stat().st_size if segment_path.exists() else 0
+        # 当前段写满后需要生成检查点
+        self.need_compact = False
+        # 上次检查点之后是否追加过记录
+        self.changed = False
+        # load 时读到的检查点
+        self.checkpoint_summary = {}
+        self.replayed: Dict[str, Optional[str]] = {}
+
+    def segment_path(self, index: int) -> Path:
+        return self.journal_dir / f"segment_{index:06d}.jsonl"
+
+    def list_segments(self) -> List[int]:
+        return sorted(int(path.stem.split("_")[1]) for path in self.journal_dir.glob("segment_*.jsonl"))
+
+    def close_broken_tail(self):
+        # 保证后续追加的记录从新的一行开始
+        segment_path = self.segment_path(self.segment_index)
+        if segment_path.exists() and segment_path.stat().st_size > 0:
+            with open(segment_path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    def has_records(self) -> bool:
+        return self.checkpoint_file.exists() or len(self.list_segments()) > 0
+
+    def load_meta(self) -> Optional[Dict]:
+        if not self.meta_file.exists():
+            return None
+        return json.loads(self.meta_file.read_text())
+
+    def write_meta(self, meta: Dict):
+        atomic_write(self.meta_file, json.dumps(meta), fsync=self.fsync)
+
+    def append(self, records: List[Dict]):
+        if len(records) == 0:
+            return
+        self.segment_offset = append_records(self.segment_path(self.segment_index), records, self.chunk_records,
+                                             self.fsync)
+        self.changed = True
+        if self.segment_offset >= self.segment_size:
+            self.segment_index += 1
+            self.segment_offset = 0
+            self.need_compact = True
+
+    def read_segment(self, index: int, offset: int = 0) -> Iterator[Dict]:
+        with open(self.segment_path(index), "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    yield decode_record(line.decode())
+                except ValueError:
+                    # 上次异常退出时未写完的记录
+                    print(f"Skip broken record in {self.segment_path(index)}")
+
+    def load(self) -> TaskTable:
+        state = TaskTable(self.input_file, fsync=self.fsync)
+        if not self.has_records():
+            state.clear_inputs()
+        first_segment, first_offset = 1, 0
+        self.checkpoint_summary, self.replayed = {}, {}
+        if self.checkpoint_file.exists():
+            checkpoint = json.loads(self.checkpoint_file.read_text())
+            first_segment, first_offset = checkpoint["segment"], checkpoint["offset"]
+            self.checkpoint_summary = checkpoint["summary"]
+            state.restore(checkpoint["table"])
+
+        for index in self.list_segments():
+            if index < first_segment:
+                continue
+            for record in self.read_segment(index, first_offset if index == first_segment else 0):
+                task_name = record["task"]
+                if task_name not in self.replayed:
+                    self.replayed[task_name] = state.status(task_name) if task_name in state else None
+                state.apply(record)
+        return state
+
+    def write_checkpoint(self, state: TaskTable, summary: Optional[Dict] = None):
+        """Write the task table at the current position and drop the segments before it.
+
+        `state` must already contain every record appended so far.
+        """
+        checkpoint = {"segment": self.segment_index, "offset": self.segment_offset, "summary": summary or {},
+                      "table": state.dump()}
+        atomic_write(self.checkpoint_file, json.dumps(checkpoint), fsync=self.fsync)
+
+        for index in self.list_segments():
+            if index < self.segment_index:
+                self.segment_path(index).unlink()
+        if self.fsync == "full":
+            fsync_dir(self.journal_dir)
+        self.need_compact = False
+        self.changed = False
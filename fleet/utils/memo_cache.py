@@ -0,0 +1,109 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from fleet.utils.file_utils import atomic_write
+from fleet.utils.serializer import Serializer
+
+
+def stable_bytes(value: Any) -> bytes:
+    # 相同的值得到相同的字节, json 无法表示时退回 pickle
+    try:
+        return json.dumps(value, sort_keys=True).encode()
+    except (TypeError, ValueError):
+        return pickle.dumps(value, protocol=4)
+
+
+def input_digest(task_input: Any) -> str:
+    """Digest of an encoded task input, used to find identical inputs within a run."""
+    return hashlib.sha256(stable_bytes(task_input)).hexdigest()
+
+
+def function_identity(job_func: Callable) -> str:
+    # 模块名、函数名和源码, 修改任务函数后缓存自动失效
+    try:
+        code = inspect.getsource(job_func)
+    except (OSError, TypeError):
+        code = getattr(getattr(job_func, "__code__", None), "co_code", b"").hex()
+    return f"{job_func.__module__}.{getattr(job_func, '__qualname__', repr(job_func))}:{code}"
+
+
+class MemoCache:
+    """Persistent cache of successful job results, one file per key under `cache_dir/<key[:2]>/<key>`.
+
+    The key is a hash of (job function identity, info, serializer, encoded input). Entries are written with
+    atomic_write, so workers on several hosts can share the cache on a shared file system. Hits refresh the mtime,
+    which `evict` uses for age and size eviction.
+    """
+
+    def __init__(self, cache_dir: Path, fsync: str = "none"):
+        self.cache_dir = Path(cache_dir)
+        self.fsync = fsync
+        self.prefix = b""
+
+    def bind(self, job_func: Callable, info: Dict):
+        # worker 启动时计算一次任务函数和 info 的部分
+        self.prefix = hashlib.sha256(function_identity(job_func).encode() + b"\0" + stable_bytes(info)).digest()
+
+    def key(self, task_input: Any, serializer: Serializer) -> str:
+        return hashlib.sha256(self.prefix + serializer.name.encode() + b"\0" + stable_bytes(task_input)).hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key: str, serializer: Serializer) -> Optional[Dict]:
+        """Return the cached job result ({"status": "success", "result"?}) or None."""
+        entry_path = self.entry_path(key)
+        try:
+            data = entry_path.read_bytes()
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        # 第一个字节表示是否有 result
+        if data[:1] == b"\1":
+            return {"status": "success", "result": serializer.loads(data[1:])}
+        return {"status": "success"}
+
+    def put(self, key: str, result: Dict, serializer: Serializer):
+        if result.get("status") != "success":
+            return
+        data = b"\1" + serializer.dumps(result["result"]) if "result" in result else b"\0"
+        entry_path = self.entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(entry_path, data, fsync=self.fsync)
+
+    def evict(self, max_size: Optional[int] = None, max_age: Optional[float] = None) -> int:
+        """Remove entries older than `max_age` seconds, then the least recently used ones above `max_size` bytes."""
+        if not self.cache_dir.exists() or (max_size is None and max_age is None):
+            return 0
+        entries = []
+        for entry_path in self.cache_dir.glob("*/*"):
+            # 正在写入的临时文件
+            if entry_path.name.startswith("."):
+                continue
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        entries.sort()
+
+        removed = 0
+        total_size = sum(size for _, size, _ in entries)
+        for mtime, size, entry_path in entries:
+            too_old = max_age is not None and time.time() - mtime > max_age
+            too_large = max_size is not None and total_size > max_size
+            if not too_old and not too_large:
+                break
+            try:
+                entry_path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            removed += 1
+        return removed
@@ -0,0 +1,110 @@
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from fleet.utils.serializer import Serializer
+
+# 每条结果: 数据长度, crc32, 序列化后的数据
+RECORD_HEADER = struct.Struct("<QI")
+
+
+class ResultWriter:
+    """Append serialized job results to one shard file, `results/<shard>.bin`.
+
+    Each shard has a single writer (one worker, or the manager for results sent inline), so appends need no
+    file locking. `append` returns the reference [shard, offset, length] that the manager keeps in the journal.
+    A `shared` shard is read from other hosts (e.g. over NFS), so `flush` always fsyncs it: another client is
+    only guaranteed to see the data once it reached the server.
+    """
+
+    def __init__(self, result_dir: Path, shard: str, fsync: str = "none", shared: bool = False):
+        self.result_dir = Path(result_dir)
+        self.shard = shard
+        self.fsync = fsync
+        self.shared = shared
+        self.file = None
+        # 同一个 worker 的多个线程会同时写入
+        self.lock = threading.Lock()
+
+    def append_bytes(self, data: bytes) -> List:
+        with self.lock:
+            if self.file is None:
+                self.result_dir.mkdir(parents=True, exist_ok=True)
+                self.file = open(self.result_dir / f"{self.shard}.bin", "ab")
+            offset = self.file.seek(0, os.SEEK_END)
+            self.file.write(RECORD_HEADER.pack(len(data), zlib.crc32(data)))
+            self.file.write(data)
+            return [self.shard, offset, RECORD_HEADER.size + len(data)]
+
+    def append(self, result: Any, serializer: Serializer) -> List:
+        return self.append_bytes(serializer.dumps(result))
+
+    def flush(self):
+        """Make the appended results visible to readers, called before the results are reported."""
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.flush()
+            if self.fsync != "none" or self.shared:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class ResultReader:
+    """Read results by the references stored in the journal."""
+
+    def __init__(self, result_dir: Path, max_open_files: int = 64):
+        self.result_dir = Path(result_dir)
+        self.max_open_files = max_open_files
+        # 分片 -> 打开的文件
+        self.files: Dict[str, Any] = {}
+        # 分片 -> 已知的文件大小
+        self.sizes: Dict[str, int] = {}
+
+    def open_shard(self, shard: str, end: int):
+        file = self.files.get(shard)
+        if file is not None and end <= self.sizes[shard]:
+            return file
+        # 记录在已知大小之外: 先检查文件大小, 仍然不够时重新打开, 共享文件系统在打开时才重新验证缓存
+        if file is not None:
+            self.sizes[shard] = os.fstat(file.fileno()).st_size
+            if end <= self.sizes[shard]:
+                return file
+            file.close()
+            del self.files[shard]
+        if len(self.files) >= self.max_open_files:
+            self.files.pop(next(iter(self.files))).close()
+        file = open(self.result_dir / f"{shard}.bin", "rb")
+        self.files[shard] = file
+        self.sizes[shard] = os.fstat(file.fileno()).st_size
+        return file
+
+    def read_bytes(self, result_ref: List) -> bytes:
+        shard, offset, length = result_ref
+        file = self.open_shard(shard, offset + length)
+        file.seek(offset)
+        record = file.read(length)
+        data_size, checksum = RECORD_HEADER.unpack_from(record)
+        data = record[RECORD_HEADER.size:RECORD_HEADER.size + data_size]
+        if len(data) != data_size or zlib.crc32(data) != checksum:
+            raise ValueError(f"broken result record {result_ref}")
+        return data
+
+    def read(self, result_ref: Optional[List], serializer: Serializer) -> Any:
+        if result_ref is None:
+            return None
+        return serializer.loads(self.read_bytes(result_ref))
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+        self.sizes = {}
@@ -0,0 +1,154 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import List, Optional, Set
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+# 只在文件写完 (关闭或 rename 到位) 后唤醒, 避免读到写了一半的文件
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+class Wakeup:
+    """A pipe that interrupts `Backoff.wait` from another thread, e.g. when a message is queued for the waiter."""
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+
+    def set(self):
+        if self.write_fd is None:
+            return
+        try:
+            os.write(self.write_fd, b"\0")
+        except BlockingIOError:
+            # 管道已满, 等待方一定会被唤醒
+            pass
+
+    def clear(self):
+        if self.read_fd is None:
+            return
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        # 关闭后 set 不再写入, 避免写到复用了同一编号的其他文件
+        if self.read_fd is None:
+            return
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        self.read_fd = self.write_fd = None
+
+
+class DirWatcher:
+    """Wake up on changes in the given directories through inotify.
+
+    Falls back to plain sleeping when inotify is not available. On network file systems inotify only sees changes
+    made on the local host, so callers must still poll with a bounded interval.
+    """
+
+    def __init__(self, dirs: List[Path], names: Optional[Set[str]] = None):
+        # 只关心这些文件名的事件, None 表示全部
+        self.names = names
+        self.fd = None
+        libc = load_libc()
+        if libc is None:
+            return
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+        for dir in dirs:
+            if libc.inotify_add_watch(fd, str(dir).encode(), WATCH_MASK) < 0:
+                os.close(fd)
+                return
+        self.fd = fd
+
+    def read_events(self) -> bool:
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+        if self.names is None:
+            return len(data) > 0
+
+        changed = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, _, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="ignore")
+            offset += name_len
+            if name in self.names:
+                changed = True
+        return changed
+
+    def wait(self, timeout: float, wakeup: Optional[Wakeup] = None) -> bool:
+        """Sleep up to `timeout` seconds, return True if a change or `wakeup` woke us up."""
+        fds = [fd for fd in [self.fd, wakeup.read_fd if wakeup else None] if fd is not None]
+        if not fds:
+            time.sleep(timeout)
+            return False
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select(fds, [], [], remaining)
+            if wakeup is not None and wakeup.read_fd in readable:
+                wakeup.clear()
+                return True
+            if self.fd in readable and self.read_events():
+                return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Backoff:
+    """Exponential backoff between polls, reset as soon as there is work to do."""
+
+    def __init__(self, min_interval: float = 0.01, max_interval: float = 0.5, factor: float = 2.0,
+                 watcher: Optional[DirWatcher] = None, wakeup: Optional[Wakeup] = None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.watcher = watcher
+        # 其他线程有新消息时立即唤醒
+        self.wakeup = wakeup
+        self.interval = min_interval
+
+    def reset(self):
+        self.interval = self.min_interval
+
+    def wait(self) -> bool:
+        if self.watcher is not None:
+            changed = self.watcher.wait(self.interval, self.wakeup)
+        elif self.wakeup is not None:
+            changed = bool(select.select([self.wakeup.read_fd], [], [], self.interval)[0])
+            self.wakeup.clear()
+        else:
+            time.sleep(self.interval)
+            changed = False
+        self.interval = min(self.interval * self.factor, self.max_interval)
+        return changed
@@ -0,0 +1,142 @@
+import base64
+import json
+import pickle
+import struct
+from typing import Any, Dict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SERIALIZERS = ["json", "msgpack", "pickle", "raw"]
+
+LENGTH = struct.Struct("<Q")
+
+
+class Serializer:
+    """Encode task payloads to bytes and back.
+
+    `encode`/`decode` wrap the bytes so they can be embedded in the JSON journal and lease records: binary
+    serializers are base64 encoded once when the task is ingested, and only the worker decodes them.
+    """
+
+    name = None
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+    def wrap(self, data: bytes) -> Any:
+        return base64.b64encode(data).decode("ascii")
+
+    def unwrap(self, value: Any) -> bytes:
+        return base64.b64decode(value)
+
+    def encode(self, obj: Any) -> Any:
+        return self.wrap(self.dumps(obj))
+
+    def decode(self, value: Any) -> Any:
+        return self.loads(self.unwrap(value))
+
+
+class JsonSerializer(Serializer):
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    # 任务输入本身就是 json, 直接写入 journal, 保持可读
+    def wrap(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def unwrap(self, value: Any) -> bytes:
+        return json.dumps(value).encode()
+
+    def encode(self, obj: Any) -> Any:
+        return obj
+
+    def decode(self, value: Any) -> Any:
+        return value
+
+
+class MsgpackSerializer(Serializer):
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is not installed, run `pip install msgpack` to use --serializer msgpack")
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+class PickleSerializer(Serializer):
+    """Pickle protocol 5; large buffers (e.g. numpy arrays) are stored out-of-band and loaded without copying.
+
+    Layout: buffer count, buffer sizes, pickle size, pickle data, then the raw buffers.
+    """
+
+    name = "pickle"
+
+    def dumps(self, obj: Any) -> bytes:
+        buffers = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        raw_buffers = [buffer.raw() for buffer in buffers]
+        header = LENGTH.pack(len(raw_buffers)) + b"".join(LENGTH.pack(raw.nbytes) for raw in raw_buffers)
+        return b"".join([header, LENGTH.pack(len(data)), data, *raw_buffers])
+
+    def loads(self, data: bytes) -> Any:
+        view = memoryview(data)
+        buffer_num, = LENGTH.unpack_from(view, 0)
+        sizes = [LENGTH.unpack_from(view, LENGTH.size * (index + 1))[0] for index in range(buffer_num)]
+        offset = LENGTH.size * (buffer_num + 1)
+        data_size, = LENGTH.unpack_from(view, offset)
+        offset += LENGTH.size
+        pickle_data = view[offset:offset + data_size]
+        offset += data_size
+        buffers = []
+        for size in sizes:
+            buffers.append(view[offset:offset + size])
+            offset += size
+        return pickle.loads(pickle_data, buffers=buffers)
+
+
+class RawSerializer(Serializer):
+    """Pass bytes through unchanged, for jobs whose inputs are already encoded."""
+
+    name = "raw"
+
+    def dumps(self, obj: Any) -> bytes:
+        if not isinstance(obj, (bytes, bytearray, memoryview)):
+            raise TypeError(f"raw serializer only accepts bytes, got {type(obj).__name__}")
+        return bytes(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return data
+
+
+SERIALIZER_CLASSES = {
+    "json": JsonSerializer,
+    "msgpack": MsgpackSerializer,
+    "pickle": PickleSerializer,
+    "raw": RawSerializer,
+}
+
+_serializers: Dict[str, Serializer] = {}
+
+
+def get_serializer(name: str) -> Serializer:
+    if name not in SERIALIZER_CLASSES:
+        raise ValueError(f"Unknown serializer: {name}, choose from {SERIALIZERS}")
+    if name not in _serializers:
+        _serializers[name] = SERIALIZER_CLASSES[name]()
+    return _serializers[name]
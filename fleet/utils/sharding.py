@@ -0,0 +1,18 @@
+import copy
+import zlib
+from pathlib import Path
+
+
+def shard_args(args, shard: int):
+    """Copy of args pointing to the coordination store of a shard: `base_dir/shard_<i>`, TCP port + i."""
+    args = copy.copy(args)
+    if args.base_dir is not None:
+        args.base_dir = str(Path(args.base_dir) / f"shard_{shard}")
+    host, port = args.store_address.rsplit(":", 1)
+    args.store_address = f"{host}:{int(port) + shard}"
+    return args
+
+
+def node_shard(node_id: str, shards: int) -> int:
+    # 节点 id 含有随机部分, 节点均匀分布到各个分片
+    return zlib.crc32(node_id.encode()) % shards
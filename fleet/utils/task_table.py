@@ -0,0 +1,310 @@
+import base64
+import json
+import math
+import os
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 任务状态码, 每个任务一个字节
+STATE_CODES = {"unassigned": "u", "assigned": "a", "success": "s", "crashed": "c", "failed": "f", "released": "r"}
+CODE_STATES = {ord(code): status for status, code in STATE_CODES.items()}
+# 还没有记录的任务 id
+MISSING_CODE = ord("-")
+
+# 保存在定长数组中的时间字段, NaN 表示没有
+TIME_FIELDS = ("assigned_at", "started_at", "finished_at")
+# 租约 id 的格式: lease_ + 32 位十六进制, 保存为 16 字节
+LEASE_PREFIX = "lease_"
+LEASE_ID_SIZE = 16
+NO_LEASE = bytes(LEASE_ID_SIZE)
+
+
+def id_of(task_name: str) -> int:
+    # manager 按读入顺序生成任务名: task1, task2, ...
+    return int(task_name[4:]) - 1
+
+
+def name_of(task_id: int) -> str:
+    return f"task{task_id + 1}"
+
+
+def encode_array(values: array) -> str:
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+def decode_array(typecode: str, data: str) -> array:
+    return array(typecode, base64.b64decode(data))
+
+
+class TaskTable:
+    """State of all tasks of a run in flat arrays indexed by task id (task name `task<N>` has id N - 1).
+
+    The status of a task is one byte of `states` (see STATE_CODES). The node, lease, result reference and timings
+    of a task are kept in fixed-width columns; node and result shard names are interned in `names`. Any other
+    field goes into one compact JSON string per task, None if it has none. Inputs are appended to `input_path`,
+    one JSON value per line, by `store_input`; records refer to them with "input_ref": [offset, length], so the
+    journal does not hold them a second time. Records returned by the table are new dicts without the input, use
+    `get_input` for it.
+    """
+
+    def __init__(self, input_path: Path, fsync: str = "none"):
+        self.input_path = Path(input_path)
+        self.fsync = fsync
+        self.states = bytearray()
+        self.details: List[Optional[str]] = []
+        # 输入在 input_path 中的位置和长度, 长度为 0 表示没有输入
+        self.input_offsets = array("q")
+        self.input_lengths = array("I")
+        # 节点名和结果分片名 -> names 中的序号, -1 表示没有
+        self.names: List[str] = []
+        self.name_index: Dict[str, int] = {}
+        self.assigned_to = array("i")
+        self.lease_ids = bytearray()
+        self.result_shards = array("i")
+        self.result_offsets = array("q")
+        self.result_lengths = array("I")
+        self.times = {field: array("d") for field in TIME_FIELDS}
+        self.setters = {"assigned_to": self.set_assigned_to, "lease_id": self.set_lease_id,
+                        "result_ref": self.set_result_ref}
+        self.bind_time_setters()
+        self.input_file = open(self.input_path, "ab")
+        self.input_file.seek(0, os.SEEK_END)
+        self.input_size = self.input_file.tell()
+        self.input_reader = open(self.input_path, "rb")
+        self.unflushed = False
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __contains__(self, task_name: str) -> bool:
+        try:
+            index = id_of(task_name)
+        except ValueError:
+            return False
+        return 0 <= index < len(self.states) and self.states[index] != MISSING_CODE
+
+    def __iter__(self) -> Iterator[str]:
+        return (name_of(index) for index, code in enumerate(self.states) if code != MISSING_CODE)
+
+    def __reversed__(self) -> Iterator[str]:
+        return (name_of(index) for index in range(len(self.states) - 1, -1, -1)
+                if self.states[index] != MISSING_CODE)
+
+    def __getitem__(self, task_name: str) -> Dict:
+        index = self.index(task_name)
+        record = {"status": CODE_STATES[self.states[index]]}
+        if self.assigned_to[index] >= 0:
+            record["assigned_to"] = self.names[self.assigned_to[index]]
+        lease_id = self.lease_ids[index * LEASE_ID_SIZE:(index + 1) * LEASE_ID_SIZE]
+        if lease_id != NO_LEASE:
+            record["lease_id"] = LEASE_PREFIX + lease_id.hex()
+        if self.result_shards[index] >= 0:
+            record["result_ref"] = [self.names[self.result_shards[index]], self.result_offsets[index],
+                                    self.result_lengths[index]]
+        for field, values in self.times.items():
+            if not math.isnan(values[index]):
+                record[field] = values[index]
+        if self.details[index] is not None:
+            record.update(json.loads(self.details[index]))
+        return record
+
+    def index(self, task_name: str) -> int:
+        if task_name not in self:
+            raise KeyError(task_name)
+        return id_of(task_name)
+
+    def status(self, task_name: str) -> str:
+        return CODE_STATES[self.states[self.index(task_name)]]
+
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        return ((task_name, self[task_name]) for task_name in self)
+
+    def values(self) -> Iterator[Dict]:
+        return (self[task_name] for task_name in self)
+
+    def intern(self, name: str) -> int:
+        name_id = self.name_index.get(name)
+        if name_id is None:
+            name_id = self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def grow(self, size: int):
+        missing_num = size - len(self.states)
+        if missing_num == 1:
+            # 按顺序读入的任务每次只增加一个
+            self.states.append(MISSING_CODE)
+            self.details.append(None)
+            self.input_offsets.append(0)
+            self.input_lengths.append(0)
+            self.assigned_to.append(-1)
+            self.lease_ids += NO_LEASE
+            self.result_shards.append(-1)
+            self.result_offsets.append(0)
+            self.result_lengths.append(0)
+            for values in self.times.values():
+                values.append(math.nan)
+            return
+        self.states.extend(bytes([MISSING_CODE]) * missing_num)
+        self.details.extend([None] * missing_num)
+        self.input_offsets.extend([0] * missing_num)
+        self.input_lengths.extend([0] * missing_num)
+        self.assigned_to.extend([-1] * missing_num)
+        self.lease_ids.extend(NO_LEASE * missing_num)
+        self.result_shards.extend([-1] * missing_num)
+        self.result_offsets.extend([0] * missing_num)
+        self.result_lengths.extend([0] * missing_num)
+        for values in self.times.values():
+            values.extend([math.nan] * missing_num)
+
+    # 每个定长列的写入函数, 值不适合这一列时返回 False (字段改为保存在 details 中), None 清空这一列
+    def set_assigned_to(self, index: int, value: Any) -> bool:
+        if value is not None and not isinstance(value, str):
+            return False
+        self.assigned_to[index] = -1 if value is None else self.intern(value)
+        return True
+
+    def set_lease_id(self, index: int, value: Any) -> bool:
+        if value is None:
+            lease_id = NO_LEASE
+        elif isinstance(value, str) and len(value) == len(LEASE_PREFIX) + 2 * LEASE_ID_SIZE \
+                and value.startswith(LEASE_PREFIX):
+            try:
+                lease_id = bytes.fromhex(value[len(LEASE_PREFIX):])
+            except ValueError:
+                return False
+            # 只接受能原样还原的 id (小写, 不全为 0)
+            if lease_id == NO_LEASE or lease_id.hex() != value[len(LEASE_PREFIX):]:
+                return False
+        else:
+            return False
+        self.lease_ids[index * LEASE_ID_SIZE:(index + 1) * LEASE_ID_SIZE] = lease_id
+        return True
+
+    def set_result_ref(self, index: int, value: Any) -> bool:
+        if value is None:
+            self.result_shards[index] = -1
+            return True
+        if not (isinstance(value, list) and len(value) == 3 and isinstance(value[0], str)
+                and type(value[1]) is int and type(value[2]) is int and value[1] >= 0 and 0 <= value[2] < 2 ** 32):
+            return False
+        self.result_shards[index] = self.intern(value[0])
+        self.result_offsets[index] = value[1]
+        self.result_lengths[index] = value[2]
+        return True
+
+    def bind_time_setters(self):
+        for field in TIME_FIELDS:
+            self.setters[field] = self.time_setter(field)
+
+    def time_setter(self, field: str):
+        values = self.times[field]
+
+        def set_time(index: int, value: Any) -> bool:
+            if value is None:
+                values[index] = math.nan
+                return True
+            if type(value) is not float or math.isnan(value):
+                return False
+            values[index] = value
+            return True
+        return set_time
+
+    def apply(self, record: Dict):
+        # 每条记录只包含变化的字段, 按任务合并
+        index = id_of(record["task"])
+        if index >= len(self.states):
+            self.grow(index + 1)
+        fields = {}
+        columns = []
+        for key, value in record.items():
+            if key in ("task", "status", "input_ref"):
+                continue
+            setter = self.setters.get(key)
+            if setter is not None:
+                if setter(index, value):
+                    columns.append(key)
+                    continue
+                setter(index, None)
+            fields[key] = value
+        if fields or (columns and self.details[index] is not None):
+            details = {} if self.details[index] is None else json.loads(self.details[index])
+            # 放入定长列的字段不再保留在 details 中
+            for key in columns:
+                details.pop(key, None)
+            details.update(fields)
+            self.details[index] = json.dumps(details, separators=(",", ":")) if details else None
+        if "status" in record:
+            self.states[index] = ord(STATE_CODES[record["status"]])
+        if "input_ref" in record:
+            self.input_offsets[index], self.input_lengths[index] = record["input_ref"]
+
+    def store_input(self, value: Any) -> List[int]:
+        """Append an input to `input_path`, return its [offset, length] for the "input_ref" of a record."""
+        data = json.dumps(value).encode()
+        offset = self.input_size
+        self.input_file.write(data + b"\n")
+        self.input_size += len(data) + 1
+        self.unflushed = True
+        return [offset, len(data)]
+
+    def get_input(self, task_name: str) -> Any:
+        index = self.index(task_name)
+        if self.input_lengths[index] == 0:
+            raise KeyError(f"{task_name} has no input")
+        if self.unflushed:
+            self.input_file.flush()
+            self.unflushed = False
+        self.input_reader.seek(self.input_offsets[index])
+        return json.loads(self.input_reader.read(self.input_lengths[index]))
+
+    def flush(self):
+        """Write the stored inputs out, called before journal records that refer to them are appended."""
+        if not self.unflushed:
+            return
+        self.input_file.flush()
+        if self.fsync != "none":
+            os.fsync(self.input_file.fileno())
+        self.unflushed = False
+
+    def clear_inputs(self):
+        # 输入文件来自没有写入 journal 的运行
+        self.input_file.truncate(0)
+        self.input_size = 0
+
+    def dump(self) -> Dict:
+        """Compact form of the table for a journal checkpoint, the inputs stay in `input_path`."""
+        self.flush()
+        return {
+            "states": self.states.decode("ascii"),
+            "details": self.details,
+            "input_offsets": encode_array(self.input_offsets),
+            "input_lengths": encode_array(self.input_lengths),
+            "names": self.names,
+            "assigned_to": encode_array(self.assigned_to),
+            "lease_ids": base64.b64encode(self.lease_ids).decode("ascii"),
+            "result_shards": encode_array(self.result_shards),
+            "result_offsets": encode_array(self.result_offsets),
+            "result_lengths": encode_array(self.result_lengths),
+            **{field: encode_array(values) for field, values in self.times.items()},
+        }
+
+    def restore(self, data: Dict):
+        self.states = bytearray(data["states"], "ascii")
+        self.details = data["details"]
+        self.input_offsets = decode_array("q", data["input_offsets"])
+        self.input_lengths = decode_array("I", data["input_lengths"])
+        self.names = data["names"]
+        self.name_index = {name: name_id for name_id, name in enumerate(self.names)}
+        self.assigned_to = decode_array("i", data["assigned_to"])
+        self.lease_ids = bytearray(base64.b64decode(data["lease_ids"]))
+        self.result_shards = decode_array("i", data["result_shards"])
+        self.result_offsets = decode_array("q", data["result_offsets"])
+        self.result_lengths = decode_array("I", data["result_lengths"])
+        self.times = {field: decode_array("d", data[field]) for field in TIME_FIELDS}
+        self.bind_time_setters()
+
+    def close(self):
+        self.input_file.close()
+        self.input_reader.close()
@@ -1,4 +1,5 @@
 import time
+from typing import Optional
 
 def format_time(time_second: float)->str:
     # 根据时间的长度返回不同单位的字符串
@@ -13,8 +14,9 @@ def format_time(time_second: float)->str:
 
 
 class TimeTracker:
-    def __init__(self, total_tasks: int):
-        assert total_tasks > 0, "task number must larger than zero!"
+    def __init__(self, total_tasks: Optional[int]):
+        # total_tasks 为 None 表示任务总数未知
+        assert total_tasks is None or total_tasks > 0, "task number must larger than zero!"
         self.total_tasks = total_tasks
         self.reset()
 
@@ -32,7 +34,7 @@ class TimeTracker:
 
     @property
     def est(self) -> str:
-        if self.finished_tasks == 0:
+        if self.finished_tasks == 0 or self.total_tasks is None:
             return "Unknown"
         elapsed_time = self.current_time - self.start_time
         remaining_tasks = self.total_tasks - self.finished_tasks
@@ -1,121 +1,173 @@
-from typing import Callable, Dict, List
-import os
-import sys
+from typing import Callable, Dict, List, Optional
+import asyncio
+import inspect
 import time
 import uuid
-import json
-from multiprocessing import Process, Queue
+from multiprocessing import Process
 import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from pathlib import Path
 
-from fleet.utils.file_utils import safe_load_json
+from fleet.store.base import StoreUnavailableError
+from fleet.store.factory import create_store
+from fleet.utils.host_utils import get_host_profile
+from fleet.utils.input_cache import InputCache, set_input_cache
+from fleet.utils.memo_cache import MemoCache
+from fleet.utils.result_store import ResultWriter
+from fleet.utils.scheduling import Backoff, Wakeup
+from fleet.utils.serializer import get_serializer
+from fleet.utils.sharding import node_shard, shard_args
+from fleet.worker_utils.lease_claimer import LeaseClaimer
+from fleet.worker_utils.runner_pool import RunnerPool
+
+
+def send_heartbeat(store, node_id: str, status: str = 'available'):
+    current_time = int(time.time())
+    retry_time = 0
+    while True:
+        try:
+            retry_time += 1
+            store.write_heartbeat(node_id, {"status": status, "last_heartbeat": current_time})
+            break
+        except StoreUnavailableError:
+            # manager 已经退出, 不再重试
+            print(f"Failed to write heartbeat of node {node_id}, the store is unavailable")
+            break
+        except:
+            print(f"Failed to write heartbeat of node {node_id}, tried {retry_time} times")
+            time.sleep(1)
+            if retry_time > 20:
+                print(f"Failed to write heartbeat of node {node_id}")
+                break
 
 
-def run_job(job_func, job_input, info, output_queue):
+def heartbeat_daemon(node_id: str, store_args):
+    """这个函数将作为独立的进程运行，负责发送心跳信号。"""
+    # 心跳进程使用自己的存储连接, 参数可以 pickle, spawn 启动方式下也能使用
+    store = create_store(store_args)
     try:
-        result = job_func(job_input, info)
-        output_queue.put(result)
-    except Exception as e:
-        error_message = traceback.format_exc()
-        print(error_message)
-        output_queue.put({"error": error_message, "status": "crashed"})
+        while True:
+            send_heartbeat(store, node_id)
+            time.sleep(10)  # 设定心跳频率，例如每10秒发送一次心跳
+    except KeyboardInterrupt:
+        pass  # 这里可以捕捉 KeyboardInterrupt 异常来优雅地处理进程终止
     finally:
-        # 强制终止当前进程和所有子线程/子进程
-        # os._exit(0)
-        sys.exit(0)
+        store.close()
 
 
 class Worker:
     def __init__(self, args, job_func: Callable, info: Dict = {}):
-        self.base_dir = Path(args.base_dir)
+        # 使用 tcp 存储时 worker 不需要共享目录
+        self.base_dir = Path(args.base_dir) if args.base_dir else None
         self.timeout = args.timeout
         self.wait_manager = args.wait_manager
         self.max_job = args.max_job
         self.max_work_time = args.max_work_time
+        self.concurrency = args.concurrency
+        self.max_poll_interval = args.max_poll_interval
+        self.executor = args.executor
         unique_id = str(uuid.uuid4())
         self.node_id = f"{args.node_id}_{unique_id}" if args.node_id else unique_id
-        self.nodes_dir = self.base_dir / 'nodes'
-        self.status_dir = self.base_dir / 'status'
-        self.heart_dir = self.base_dir / 'heart'
-        self.finished_file = self.base_dir / 'finished'
-        self.available_dir = self.base_dir / 'available'
-        self.available_file = self.available_dir / self.node_id
-
-        self.node_status_path = self.nodes_dir / f'{self.node_id}.status'
-        self.node_heart_status_path = self.heart_dir / f'{self.node_id}.heart'
+        # 分层运行时加入一个子 manager 的分片, 结果缓存仍然在 base_dir 下共用
+        store_args = args
+        if args.shards > 1:
+            store_args = shard_args(args, node_shard(self.node_id, args.shards))
+            print(f"Node {self.node_id} joins {store_args.base_dir or store_args.store_address}")
+        self.store_args = store_args
+        self.store_dir = Path(store_args.base_dir) if store_args.base_dir else None
+        self.store = create_store(store_args)
+        # 注册时声明的资源和标签, 分配线程只把满足需求的任务分配给这个节点
+        self.profile = get_host_profile(args.resources, args.tags)
+        # --claim 时自己从分区队列领取 manager 发布的租约
+        self.claimer = LeaseClaimer(self.store, self.node_id, self.profile, args.claim_partitions) if args.claim else None
+        # 本机的输入缓存, 同一主机上的 worker 共用; 缓存中的输入上报给分配线程
+        self.input_cache = None
+        self.reported_keys = set()
+        self.cache_reported_at = 0
+        if args.input_cache_dir:
+            self.input_cache = InputCache(
+                args.input_cache_dir,
+                max_size=None if args.input_cache_size is None else int(args.input_cache_size * 1024 * 1024))
+            set_input_cache(self.input_cache)
 
         self.job_func = job_func
         self.info = info
+        # async def 的任务函数在同一个事件循环中并发执行, 最多 concurrency 个
+        self.is_async_job = inspect.iscoroutinefunction(job_func)
+        self.event_loop = None
+        # 任务输入和结果的编码方式, 由 worker 自己的参数决定, 不信任租约中的字段
+        self.serializer = get_serializer(args.serializer)
+        # 任务返回值追加到本节点的结果分片; 不共享 base_dir 时随结果一起上报给 manager
+        # file 存储时 manager 可能在其他主机上通过共享文件系统读取分片, 上报之前必须 fsync
+        self.result_writer = None
+        if self.store.shares_base_dir:
+            self.result_writer = ResultWriter(self.store_dir / 'results', self.node_id, fsync=args.fsync,
+                                              shared=store_args.store == "file")
+        # --memoize 时跳过缓存中已有成功结果的输入
+        self.memo_cache = None
+        if args.memoize:
+            if args.cache_dir is None and self.base_dir is None:
+                print("No --cache_dir or --base_dir for the result cache, memoization is disabled on this worker")
+            else:
+                self.memo_cache = MemoCache(args.cache_dir or self.base_dir / 'cache', fsync=args.fsync)
+                self.memo_cache.bind(job_func, info)
 
         # self.unassigned_task_status = {}
         self.not_find_job_num = 0
+        # 等待分配任务时的退避, 节点文件被写入时立即唤醒
+        self.backoff = None
+        # 正在执行的租约中被 manager 取消的任务 (推测执行时另一个副本已经完成): lease_id -> 任务名
+        self.cancelled_tasks: Dict[str, set] = {}
+        self.cancel_checked_at: Dict[str, float] = {}
 
         self.heartbeat_process = None  # 添加一个属性来保存心跳进程的引用
+        # 设置了 timeout 或使用 process executor 时在常驻子进程中执行任务
+        self.runner_pool = None
+        # 同时执行多个任务时使用的线程池; 每个任务完成后立即上报, 空出的 slot 可以接收新的租约
+        self.thread_pool = None
+        # 线程池中的任务 -> (lease_id, task), 租约中还没有完成的任务数, 以及领取的租约
+        self.running_tasks = {}
+        self.lease_tasks: Dict[str, int] = {}
+        self.claimed_leases = set()
+        # 线程池中有任务完成时唤醒等待
+        self.task_wakeup = Wakeup() if self.concurrency > 1 and not self.is_async_job else None
 
         if self.wait_manager:
             wait_time = 0
-            missing_dirs = self.check_dirs()
-            while len(missing_dirs) > 0:
+            missing_parts = self.store.missing_parts()
+            while len(missing_parts) > 0:
                 if wait_time % 30 == 0:
-                    print(f"Waiting for manager to create dirs...")
-                    for missing_dir in missing_dirs:
-                        print(f"Missing dir: {missing_dir}")
+                    print(f"Waiting for manager to create the store...")
+                    for missing_part in missing_parts:
+                        print(f"Missing: {missing_part}")
                 time.sleep(1)
                 wait_time += 1
-                missing_dirs = self.check_dirs()
+                missing_parts = self.store.missing_parts()
 
         else:
-            missing_dirs = self.check_dirs()
-            assert len(missing_dirs) == 0, f"Missing dirs: {missing_dirs}"
+            missing_parts = self.store.missing_parts()
+            assert len(missing_parts) == 0, f"Missing: {missing_parts}"
 
         self.finished_job_num = 0
         self.worker_start_time = time.time()
 
-    def check_dirs(self) -> List[str]:
-        missing_dirs = []
-        for dir in [self.nodes_dir, self.status_dir, self.heart_dir, self.available_dir]:
-            if not dir.exists():
-                missing_dirs.append(str(dir))
-        return missing_dirs
-
-    def create_available_file(self):
-        if not self.available_file.exists():
-            self.available_file.touch()
-
-    def heartbeat_daemon(self):
-        """这个函数将作为独立的进程运行，负责发送心跳信号。"""
-        try:
-            while True:
-                self.send_heartbeat()
-                time.sleep(10)  # 设定心跳频率，例如每10秒发送一次心跳
-        except KeyboardInterrupt:
-            pass  # 这里可以捕捉 KeyboardInterrupt 异常来优雅地处理进程终止
+    def set_available(self, slots: Optional[int] = None):
+        self.store.set_available(self.node_id, self.concurrency if slots is None else slots)
 
     def send_heartbeat(self, status: str = 'available'):
-        current_time = int(time.time())
-        while True:
-            retry_time = 0
-            try:
-                retry_time += 1
-                self.node_heart_status_path.write_text(json.dumps({"status": status, "last_heartbeat": current_time}))
-                break
-            except:
-                print(f"Failed to write heart status file {self.node_heart_status_path}, tried {retry_time} times")
-                time.sleep(1)
-                if retry_time > 20:
-                    print(f"Failed to write heart status file {self.node_heart_status_path}")
-                    break
+        send_heartbeat(self.store, self.node_id, status)
 
     def check_heart(self):
-        heart_status = safe_load_json(self.node_heart_status_path)
+        # manager 会把死亡节点的心跳归档
+        heart_status = self.store.read_heartbeat(self.node_id)
         if heart_status is None or heart_status['status'] == 'dead':
             return False
         return True
 
     def start_heartbeat(self):
         """启动心跳进程。"""
-        self.heartbeat_process = Process(target=self.heartbeat_daemon)
+        self.heartbeat_process = Process(target=heartbeat_daemon, args=(self.node_id, self.store_args))
         self.heartbeat_process.start()
 
     def stop_heartbeat(self):
@@ -129,82 +181,336 @@ class Worker:
         self.send_heartbeat(status='dead')
 
     def register_node(self):
+        # 先同步写一次心跳, 保证 check_heart 时心跳已经存在
+        self.send_heartbeat()
         self.start_heartbeat()  # 在任务开始时启动心跳进程
 
-        # for task_status_file in self.status_dir.iterdir():
-        # status_info = safe_load_json(task_status_file)
-        # if status_info and status_info["status"] == "unassigned":
-        #     self.unassigned_task_status[task_status_file.stem] = status_info
-        # print("Read task status done")
         node_info = {
-            "status": "idle"
+            "status": "idle",
+            "slots": self.concurrency
         }
-        # self.node_status_path.write_text('idle')
-        self.node_status_path.write_text(json.dumps(node_info))
-        self.create_available_file()
-        print(f"Node {self.node_id} registered")
-
-    def process_job(self):
-        find_job = False
-        node_info = safe_load_json(self.node_status_path)
-        if node_info and node_info['status'] == 'busy':
-            task_status_path = node_info['task_status_path']
-            status_info = safe_load_json(Path(task_status_path))
-            task_status_file = Path(node_info["task_status_path"])
-
-            job_input = status_info.get('input')
-            print(f"Processing task: {job_input}")
-            find_job = True
+        self.store.write_node(self.node_id, node_info)
+        # 在标记为可用之前写入, 分配线程读到可用标记时资源已经存在
+        self.store.write_profile(self.node_id, self.profile)
+        self.report_cached_inputs(force=True)
+        self.set_available()
+        print(f"Node {self.node_id} registered with {self.profile}")
+
+    def report_cached_inputs(self, force: bool = False):
+        """Report the inputs added to or evicted from the host's input cache since the last report."""
+        if self.input_cache is None or (not force and time.time() - self.cache_reported_at < 1):
+            return
+        self.cache_reported_at = time.time()
+        cached_keys = self.input_cache.cached_keys()
+        added = sorted(cached_keys - self.reported_keys)
+        removed = sorted(self.reported_keys - cached_keys)
+        if added or removed:
+            self.store.push_cache_updates(self.node_id, [{"host": self.profile["hostname"], "added": added,
+                                                          "removed": removed}])
+            self.reported_keys = cached_keys
+
+    def start_executors(self):
+        if self.is_async_job:
+            self.event_loop = asyncio.new_event_loop()
+            return
+        if self.timeout is not None or self.executor == "process":
+            self.runner_pool = RunnerPool(self.job_func, self.info, size=self.concurrency, timeout=self.timeout)
+        if self.concurrency > 1:
+            self.thread_pool = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def stop_executors(self):
+        if self.event_loop:
+            self.event_loop.close()
+        if self.thread_pool:
+            self.thread_pool.shutdown()
+            self.task_wakeup.close()
+        if self.runner_pool:
+            self.runner_pool.close()
+        if self.result_writer:
+            self.result_writer.close()
+
+    def read_cache(self, task: Dict):
+        """Return the cache key of the task (None without --memoize) and its cached result, if any."""
+        if self.memo_cache is None:
+            return None, None
+        key = self.memo_cache.key(task['input'], self.serializer)
+        try:
+            return key, self.memo_cache.get(key, self.serializer)
+        except Exception as e:
+            print(f"Failed to read the result cache of task {task['task']}: {e}")
+            return key, None
 
-            if self.timeout is None:
+    def write_cache(self, key: str, result: Dict):
+        if key is None:
+            return
+        try:
+            self.memo_cache.put(key, result, self.serializer)
+        except Exception as e:
+            print(f"Failed to write the result cache: {e}")
+
+    def get_cached_result(self, task: Dict, result: Dict) -> Dict:
+        print(f"Task {task['task']} found in the result cache")
+        task_result = self.get_task_result(result, time.time())
+        task_result['cached'] = True
+        return task_result
+
+    def is_cancelled(self, lease_id: str, task_name: str) -> bool:
+        # 每个租约每秒最多读取一次, 租约刚开始时不会有被取消的任务
+        if time.time() - self.cancel_checked_at[lease_id] >= 1:
+            self.cancel_checked_at[lease_id] = time.time()
+            self.cancelled_tasks[lease_id] = set(self.store.read_cancelled(lease_id))
+        return task_name in self.cancelled_tasks[lease_id]
+
+    def run_task(self, lease_id: str, task: Dict) -> Optional[Dict]:
+        """Run one task of the lease, return None if the manager cancelled it."""
+        if self.is_cancelled(lease_id, task['task']):
+            print(f"Task {task['task']} is cancelled")
+            return None
+        key, result = self.read_cache(task)
+        if result is not None:
+            return self.get_cached_result(task, result)
+        job_input = self.serializer.decode(task['input'])
+        print(f"Processing task: {job_input}")
+        started_at = time.time()
+        if self.runner_pool is None:
+            # 与 runner_loop 相同, 任务抛出的异常作为可重试的崩溃上报, 不让 worker 退出
+            try:
                 result = self.job_func(job_input, self.info)
-            else:
-                output_queue = Queue()
-                job_process = Process(target=run_job, args=(self.job_func, job_input, self.info, output_queue))
-                job_process.start()
-                job_process.join(timeout=self.timeout)
-                if job_process.is_alive():
-                    job_process.terminate()
-                    job_process.join()
-                    result = {"error": "job timeout", "status": "crashed"}
-                else:
-                    result = output_queue.get()
-
+            except Exception:
+                error_message = traceback.format_exc()
+                print(error_message)
+                result = {"error": error_message, "status": "crashed"}
+        else:
+            result = self.runner_pool.run(job_input, cancelled=lambda: self.is_cancelled(lease_id, task['task']))
+        print(f"Task {job_input} Done!")
+        self.write_cache(key, result)
+        if self.is_cancelled(lease_id, task['task']):
+            print(f"Task {task['task']} is cancelled")
+            return None
+        return self.get_task_result(result, started_at)
+
+    async def run_async_task(self, lease_id: str, task: Dict, semaphore: asyncio.Semaphore):
+        key, result = self.read_cache(task)
+        if result is not None:
+            return task, self.get_cached_result(task, result)
+        async with semaphore:
+            if self.is_cancelled(lease_id, task['task']):
+                print(f"Task {task['task']} is cancelled")
+                return task, None
+            job_input = self.serializer.decode(task['input'])
+            print(f"Processing task: {job_input}")
+            started_at = time.time()
+            try:
+                # 超时通过取消协程实现
+                result = await asyncio.wait_for(self.job_func(job_input, self.info), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                result = {"error": "job timeout", "status": "crashed"}
+            except Exception as e:
+                error_message = traceback.format_exc()
+                print(error_message)
+                result = {"error": error_message, "status": "crashed"}
             print(f"Task {job_input} Done!")
+        self.write_cache(key, result)
+        return task, self.get_task_result(result, started_at)
+
+    async def run_async_lease(self, lease_id: str, tasks: List[Dict]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        for finished in asyncio.as_completed([self.run_async_task(lease_id, task, semaphore) for task in tasks]):
+            task, task_result = await finished
+            if task_result is None:
+                continue
             self.finished_job_num += 1
-            if 'error' in result:
-                status_info['error'] = result['error']
+            # 每个任务完成后立即上报
+            self.commit_results(lease_id, {task['task']: task_result}, part=task['task'])
+
+    def get_task_result(self, result: Dict, started_at: float) -> Dict:
+        # 上报给 manager 的任务结果, 附带执行的起止时间
+        task_result = {"status": result['status'], "started_at": started_at, "finished_at": time.time()}
+        if 'error' in result:
+            task_result['error'] = result['error']
+        if 'result' in result:
+            try:
+                if self.result_writer is None:
+                    task_result['result_data'] = self.serializer.encode(result['result'])
+                else:
+                    task_result['result_ref'] = self.result_writer.append(result['result'], self.serializer)
+            except Exception as e:
+                # 保存结果失败不改变任务状态
+                print(f"Failed to serialize the result with {self.serializer.name}: {e}")
+                task_result['result_error'] = repr(e)
+        return task_result
+
+    def commit_results(self, lease_id: str, results: Dict[str, Dict], part: Optional[str] = None):
+        # 上报之前结果分片必须已经写入
+        if self.result_writer:
+            self.result_writer.flush()
+        completed_info = {
+            "lease_id": lease_id,
+            "assigned_to": self.node_id,
+            "results": results,
+        }
+        self.store.push_completion(lease_id if part is None else f"{lease_id}.{part}", completed_info)
 
-            # 更新任务状态为完成
-            status_info['status'] = result['status']
+    def refuse_lease(self, lease_info: Dict) -> bool:
+        # 租约的编码方式与 --serializer 不同时不解码任何输入 (例如被篡改为 pickle 的租约)
+        lease_serializer = lease_info.get('serializer', 'json')
+        if lease_serializer == self.serializer.name:
+            return False
+        error = f"lease serializer {lease_serializer} does not match worker --serializer {self.serializer.name}"
+        print(f"Refused lease {lease_info['lease_id']}: {error}")
+        self.commit_results(lease_info['lease_id'],
+                            {task['task']: {"status": "failed", "error": error} for task in lease_info['tasks']})
+        return True
 
-            task_status_file.write_text(json.dumps(status_info))
+    def start_lease(self, lease_id: str):
+        self.cancelled_tasks[lease_id] = set()
+        self.cancel_checked_at[lease_id] = time.time()
+
+    def run_lease(self, lease_info: Dict):
+        """Run the tasks of a lease and report their results."""
+        if self.refuse_lease(lease_info):
+            return
+        lease_id = lease_info['lease_id']
+        tasks = lease_info['tasks']
+        self.start_lease(lease_id)
+        if self.is_async_job:
+            self.event_loop.run_until_complete(self.run_async_lease(lease_id, tasks))
+            self.clear_cancelled(lease_id)
+            return
+
+        results = {}
+        for task in tasks:
+            task_result = self.run_task(lease_id, task)
+            if task_result is None:
+                continue
+            self.finished_job_num += 1
+            # 更新任务状态为完成
+            results[task['task']] = task_result
+
+        # 租约内的任务全部执行完后一次写回 (被取消的任务不再上报)
+        if results:
+            self.commit_results(lease_id, results)
+        self.clear_cancelled(lease_id)
+
+    def submit_lease(self, lease_info: Dict, claimed: bool = False):
+        """Queue the tasks of a lease on the thread pool, their results are reported by `collect_finished_tasks`."""
+        lease_id = lease_info['lease_id']
+        if self.refuse_lease(lease_info):
+            if claimed:
+                self.store.finish_claim(self.node_id, lease_id)
+            return
+        self.start_lease(lease_id)
+        self.lease_tasks[lease_id] = len(lease_info['tasks'])
+        if claimed:
+            self.claimed_leases.add(lease_id)
+        for task in lease_info['tasks']:
+            future = self.thread_pool.submit(self.run_task, lease_id, task)
+            self.running_tasks[future] = (lease_id, task)
+            future.add_done_callback(lambda _: self.task_wakeup.set())
+
+    def collect_finished_tasks(self) -> int:
+        """Report the tasks finished on the thread pool, return how many finished."""
+        finished = [future for future in self.running_tasks if future.done()]
+        for future in finished:
+            lease_id, task = self.running_tasks.pop(future)
+            task_result = future.result()
+            if task_result is not None:
+                self.finished_job_num += 1
+                # 每个任务完成后立即上报, 不等待租约中较慢的任务 (被取消的任务不再上报)
+                self.commit_results(lease_id, {task['task']: task_result}, part=task['task'])
+            self.lease_tasks[lease_id] -= 1
+            if self.lease_tasks[lease_id] == 0:
+                del self.lease_tasks[lease_id]
+                self.clear_cancelled(lease_id)
+                if lease_id in self.claimed_leases:
+                    self.claimed_leases.remove(lease_id)
+                    self.store.finish_claim(self.node_id, lease_id)
+        return len(finished)
+
+    def wait_running_tasks(self):
+        # 退出前不再接收新的租约, 已经写入节点状态的租约仍然执行
+        if self.thread_pool is None:
+            return
+        self.store.clear_available(self.node_id)
+        node_info = self.store.read_node(self.node_id)
+        if node_info and node_info['status'] == 'busy':
+            self.store.write_node(self.node_id, {"status": "idle", "slots": self.concurrency})
+            self.submit_lease(node_info)
+        while self.running_tasks:
+            wait(list(self.running_tasks), return_when=FIRST_COMPLETED)
+            self.collect_finished_tasks()
+
+    def clear_cancelled(self, lease_id: str):
+        # 只有执行租约的 worker 读取取消标记, 租约结束后删除, 避免标记一直累积
+        self.cancel_checked_at.pop(lease_id, None)
+        if self.cancelled_tasks.pop(lease_id, None):
+            self.store.clear_cancelled(lease_id)
+
+    def process_pooled_jobs(self) -> bool:
+        """Take new leases while earlier ones still run on the thread pool, return True if anything changed."""
+        changed = self.collect_finished_tasks() > 0
+        node_info = self.store.read_node(self.node_id)
+        if node_info and node_info['status'] == 'busy':
+            # 可用标记已经被分配线程清除, 重新标记之前不会有新的租约写入节点状态
+            self.store.write_node(self.node_id, {"status": "idle", "slots": self.concurrency})
+            self.submit_lease(node_info)
+            changed = True
+        elif self.claimer is not None and len(self.running_tasks) < self.concurrency:
+            lease = self.claimer.claim()
+            if lease is not None:
+                self.store.clear_available(self.node_id)
+                print(f"Claimed lease {lease['lease_id']} from partition {lease['partition']}")
+                self.submit_lease(lease, claimed=True)
+                changed = True
+        free_slots = self.concurrency - len(self.running_tasks)
+        if changed and free_slots > 0 and self.check_worker_status() == "running":
+            self.report_cached_inputs()
+            self.set_available(free_slots)
+        return changed
 
+    def process_job(self):
+        if self.thread_pool:
+            return self.process_pooled_jobs()
+        node_info = self.store.read_node(self.node_id)
+        # manager 写入节点文件的租约 (包括 --claim 时推测执行的副本) 优先
+        if node_info and node_info['status'] == 'busy':
+            self.run_lease(node_info)
             # 标记节点为空闲
             node_info = {
-                "status": "idle"
+                "status": "idle",
+                "slots": self.concurrency
             }
-            self.node_status_path.write_text(json.dumps(node_info))
-            worker_status = self.check_worker_status()
-            if worker_status == "running":
-                self.create_available_file()
-            return find_job
-        return find_job
+            self.store.write_node(self.node_id, node_info)
+        elif self.claimer is not None:
+            lease = self.claimer.claim()
+            if lease is None:
+                return False
+            # 执行领取的租约时不接受 manager 分配的副本
+            self.store.clear_available(self.node_id)
+            print(f"Claimed lease {lease['lease_id']} from partition {lease['partition']}")
+            self.run_lease(lease)
+            self.store.finish_claim(self.node_id, lease['lease_id'])
+        else:
+            return False
+        worker_status = self.check_worker_status()
+        if worker_status == "running":
+            # 在重新标记为可用之前上报, 下一次分配时已经知道新缓存的输入
+            self.report_cached_inputs()
+            self.set_available()
+        return True
 
     def check_and_process_tasks(self):
         find_job = self.process_job()
 
         if not find_job:
-            if self.not_find_job_num % 100 == 20:
+            if self.not_find_job_num % 100 == 20 and not self.running_tasks:
                 print("No task assigned...")
 
-            if self.not_find_job_num < 20:
-                time.sleep(0.1)
-            else:
-                time.sleep(0.5)
+            self.backoff.wait()
 
             self.not_find_job_num += 1
         else:
+            self.backoff.reset()
             self.not_find_job_num = 0
 
     def check_worker_status(self) -> str:
@@ -212,33 +518,43 @@ class Worker:
             return "max_job_reached"
         if self.max_work_time is not None and time.time() - self.worker_start_time > self.max_work_time:
             return "max_work_time_reached"
-        if self.finished_file.exists():
+        if self.store.is_finished():
             return "finished_file_exists"
         if not self.check_heart():
             return "heart_dead"
         return "running"
 
     def run(self):
+        self.backoff = Backoff(max_interval=self.max_poll_interval,
+                               watcher=self.store.watcher("worker", self.node_id), wakeup=self.task_wakeup)
         self.register_node()
+        self.start_executors()
 
         try:
             while True:
                 self.check_and_process_tasks()
                 worker_status = self.check_worker_status()
                 if worker_status == "finished_file_exists":
-                    node_info = safe_load_json(self.node_status_path)
-                    if node_info and node_info['status'] == 'busy':
+                    node_info = self.store.read_node(self.node_id)
+                    if (node_info and node_info['status'] == 'busy') or self.running_tasks:
                         continue
 
                     print("Finished file exists, exit!")
                     break
                 if worker_status != "running":
                     print(f"Worker finish reason: {worker_status}")
+                    self.wait_running_tasks()
                     break
 
+        except StoreUnavailableError as e:
+            print(f"Coordination store is unavailable, exit! {e}")
         except Exception as e:
             # traceback.print_exc()  # 打印异常信息和堆栈跟踪
             error_message = traceback.format_exc()
             print(error_message)
         finally:
+            if self.backoff.watcher:
+                self.backoff.watcher.close()
+            self.stop_executors()
             self.stop_heartbeat()  # 在任何结束时确保心跳进程被终止
+            self.store.close()
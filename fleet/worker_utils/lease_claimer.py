@@ -0,0 +1,39 @@
+from typing import Dict, Optional
+
+from fleet.manager_utils.matching import fits
+from fleet.store.base import CoordinationStore
+from fleet.utils.sharding import node_shard
+
+
+class LeaseClaimer:
+    """Claim the leases published by the manager (--claim) for one worker.
+
+    The worker takes the oldest lease of its home partition, chosen from its node id, and steals from the other
+    partitions in turn when its own is empty. Leases whose requirements the node does not meet are skipped.
+    """
+
+    def __init__(self, store: CoordinationStore, node_id: str, profile: Optional[Dict], partitions: int):
+        self.store = store
+        self.node_id = node_id
+        self.profile = profile
+        home = node_shard(node_id, partitions)
+        self.partitions = [(home + offset) % partitions for offset in range(partitions)]
+        # 不满足需求的租约, 不再读取
+        self.skipped = set()
+
+    def claim(self) -> Optional[Dict]:
+        """Return a lease now owned by this node, None if there is nothing to claim."""
+        for partition in self.partitions:
+            for entry in self.store.list_published(partition):
+                if entry in self.skipped:
+                    continue
+                lease = self.store.read_published(partition, entry)
+                # 已经被其他节点领取
+                if lease is None:
+                    continue
+                if not fits(self.profile, lease.get("requires")):
+                    self.skipped.add(entry)
+                    continue
+                if self.store.claim_lease(self.node_id, partition, entry, lease):
+                    return lease
+        return None
@@ -0,0 +1,115 @@
+import queue
+import time
+import traceback
+from multiprocessing import Pipe, Process
+from typing import Any, Callable, Dict, Optional
+
+# 检查任务是否被取消的间隔 (秒)
+CANCEL_CHECK_INTERVAL = 1
+
+
+def runner_loop(job_func, info, conn):
+    # 常驻子进程, 依次执行收到的任务, 任务之间保留进程内的状态
+    while True:
+        try:
+            job_input = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        try:
+            result = job_func(job_input, info)
+        except Exception as e:
+            error_message = traceback.format_exc()
+            print(error_message)
+            result = {"error": error_message, "status": "crashed"}
+        try:
+            conn.send(result)
+        except Exception as e:
+            conn.send({"error": f"can not send job result: {e}", "status": "crashed"})
+
+
+class JobRunner:
+    def __init__(self, job_func: Callable, info: Dict):
+        self.conn, child_conn = Pipe()
+        # 不能是 daemon 进程, 否则任务函数不能再启动子进程 (multiprocessing.Pool 等)
+        self.process = Process(target=runner_loop, args=(job_func, info, child_conn))
+        self.process.start()
+        child_conn.close()
+
+    def run(self, job_input: Any, timeout: Optional[float],
+            cancelled: Optional[Callable[[], bool]] = None) -> Optional[Dict]:
+        """Run one job, return None if the runner timed out, was cancelled or died and must be replaced."""
+        self.conn.send(job_input)
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait_time = None if deadline is None else max(0.0, deadline - time.time())
+            if cancelled is not None:
+                wait_time = CANCEL_CHECK_INTERVAL if wait_time is None else min(wait_time, CANCEL_CHECK_INTERVAL)
+            if self.conn.poll(wait_time):
+                break
+            if deadline is not None and time.time() >= deadline:
+                return None
+            if cancelled is not None and cancelled():
+                return None
+        try:
+            return self.conn.recv()
+        except EOFError:
+            return None
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class RunnerPool:
+    """A pool of long-lived job runner processes with a per-job timeout.
+
+    A runner is only replaced when its job times out or the runner process dies. The runners are not daemonic so
+    jobs can start processes of their own, `close` must be called to stop them.
+    """
+
+    def __init__(self, job_func: Callable, info: Dict, size: int = 1, timeout: Optional[float] = None):
+        self.job_func = job_func
+        self.info = info
+        self.timeout = timeout
+        self.idle_runners = queue.Queue()
+        # 所有的 runner, 包括正在执行任务的, close 时全部停止
+        self.runners = set()
+        for _ in range(size):
+            self.idle_runners.put(self.start_runner())
+
+    def start_runner(self) -> JobRunner:
+        runner = JobRunner(self.job_func, self.info)
+        self.runners.add(runner)
+        return runner
+
+    def run(self, job_input: Any, cancelled: Optional[Callable[[], bool]] = None) -> Dict:
+        """Run one job; `cancelled` is polled while the job runs and stops the runner when it returns True."""
+        runner = self.idle_runners.get()
+        try:
+            result = runner.run(job_input, self.timeout, cancelled)
+        except (BrokenPipeError, EOFError):
+            result = None
+
+        if result is not None:
+            self.idle_runners.put(runner)
+            return result
+
+        # 子进程退出时管道会先关闭, 稍等进程结束再判断原因
+        runner.process.join(timeout=0.1)
+        if runner.process.is_alive() and cancelled is not None and cancelled():
+            error_message = "job cancelled"
+        elif runner.process.is_alive():
+            error_message = "job timeout"
+        else:
+            error_message = f"job runner exited with code {runner.process.exitcode}"
+        runner.stop()
+        self.runners.discard(runner)
+        self.idle_runners.put(self.start_runner())
+        return {"error": error_message, "status": "crashed"}
+
+    def close(self):
+        for runner in self.runners:
+            runner.stop()
+        self.runners.clear()
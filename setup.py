@@ -41,6 +41,7 @@ def get_extra_requires() -> dict:
             "ruff",
         ],
         "dev": ["build", "twine"],
+        "msgpack": ["msgpack"],
     }
 
     return req